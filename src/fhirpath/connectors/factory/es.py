@@ -69,13 +69,60 @@ class EsConnMixin:
             params["size"] = size
             if scroll is not None:
                 params["scroll"] = scroll
+                # scroll context always counts total hits accurately
+                compiled_query.pop("track_total_hits", None)
         elif query_type == EngineQueryType.COUNT:
+            # count API has no time budget, only (per shard) hits limit,
+            # nor profiling
+            compiled_query.pop("timeout", None)
+            compiled_query.pop("profile", None)
+            terminate_after = compiled_query.pop("terminate_after", None)
+            if terminate_after is not None:
+                params["terminate_after"] = terminate_after
             compiled_query.pop("_source", None)
-
-        params["ignore_unavailable"] = ignore_unavailable
+            compiled_query.pop("sort", None)
+            compiled_query.pop("search_after", None)
+            compiled_query.pop("pit", None)
+            compiled_query.pop("track_total_hits", None)
+
+        if "pit" not in compiled_query:
+            # index options are not allowed with point in time
+            params["ignore_unavailable"] = ignore_unavailable
         params["body"] = compiled_query
         return params
 
+    @staticmethod
+    def transport_params(request_timeout=None):
+        """Client side options of single request, ``request_timeout``
+        (in seconds) overrides connection's default."""
+        if request_timeout is None:
+            return {}
+        return {"request_timeout": request_timeout}
+
+    def finalize_msearch_params(self, index, compiled_query):
+        """Returns (header, body) pair of single search in _msearch request"""
+        search_params = self.finalize_search_params(compiled_query, EngineQueryType.DML)
+        header = {"index": index}
+        if "ignore_unavailable" in search_params:
+            header["ignore_unavailable"] = search_params["ignore_unavailable"]
+        body = search_params["body"]
+        body["from"] = search_params["from_"]
+        body["size"] = search_params["size"]
+        return header, body
+
+    def evaluate_msearch_result(self, result):
+        """Returns responses, those are in same order of searches"""
+        responses = result["responses"]
+        for response in responses:
+            if "error" in response:
+                logger.warning(f'Error running query: {response["error"]}')
+                error = response["error"]
+                if isinstance(error, dict):
+                    error = error.get("reason", "Unknown")
+                raise Invalid(error)
+            self.evaluate_result(response)
+        return responses
+
 
 class ElasticsearchConnection(Connection, EsConnMixin):
     """Elasticsearch Connection"""
@@ -113,7 +160,7 @@ class ElasticsearchConnection(Connection, EsConnMixin):
             )
         return info
 
-    def fetch(self, index, compiled_query):
+    def fetch(self, index, compiled_query, request_timeout=None):
         """xxx: must have use scroll+slice
         https://stackoverflow.com/questions/43211387/
         what-does-elasticsearch-automatic-slicing-do
@@ -121,18 +168,36 @@ class ElasticsearchConnection(Connection, EsConnMixin):
         elasticsearch-scroll-api-with-multi-threading
         """
         search_params = self.finalize_search_params(compiled_query, EngineQueryType.DML)
+        search_params.update(self.transport_params(request_timeout))
         conn = self.raw_connection
-        result = conn.search(
-            index=ElasticsearchConnection.real_index(index), **search_params
-        )
+        if "pit" in search_params["body"]:
+            # index is bound with point in time
+            result = conn.search(**search_params)
+        else:
+            result = conn.search(
+                index=ElasticsearchConnection.real_index(index), **search_params
+            )
         self.evaluate_result(result)
         return result
 
-    def count(self, index, compiled_query):
+    def msearch(self, index, compiled_queries, request_timeout=None):
+        """Executes several searches by single _msearch request.
+        Scroll and point in time are not supported here."""
+        index = ElasticsearchConnection.real_index(index)
+        body = list()
+        for compiled_query in compiled_queries:
+            body.extend(self.finalize_msearch_params(index, compiled_query))
+        result = self.raw_connection.msearch(
+            body=body, **self.transport_params(request_timeout)
+        )
+        return self.evaluate_msearch_result(result)
+
+    def count(self, index, compiled_query, request_timeout=None):
         """ """
         search_params = self.finalize_search_params(
             compiled_query, EngineQueryType.COUNT
         )
+        search_params.update(self.transport_params(request_timeout))
         conn = self.raw_connection
         result = conn.count(
             index=ElasticsearchConnection.real_index(index), **search_params
@@ -140,14 +205,31 @@ class ElasticsearchConnection(Connection, EsConnMixin):
         self.evaluate_result(result)
         return result
 
-    def scroll(self, scroll_id, scroll="30s"):
+    def scroll(self, scroll_id, scroll="30s", request_timeout=None):
         """ """
         result = self.raw_connection.scroll(
-            body={"scroll_id": scroll_id}, scroll=scroll
+            body={"scroll_id": scroll_id},
+            scroll=scroll,
+            **self.transport_params(request_timeout),
         )
         self.evaluate_result(result)
         return result
 
+    def open_point_in_time(self, index, keep_alive="1m"):
+        """Returns point in time id"""
+        result = self.raw_connection.open_point_in_time(
+            index=ElasticsearchConnection.real_index(index), keep_alive=keep_alive
+        )
+        return result["id"]
+
+    def close_point_in_time(self, pit_id):
+        """ """
+        self.raw_connection.close_point_in_time(body={"id": pit_id}, ignore=(404,))
+
+    def clear_scroll(self, scroll_id):
+        """Release server side scroll context, already expired one is ignored"""
+        self.raw_connection.clear_scroll(body={"scroll_id": scroll_id}, ignore=(404,))
+
 
 class AsyncElasticsearchConnection(Connection, EsConnMixin):
     """Elasticsearch Connection"""
@@ -193,7 +275,7 @@ class AsyncElasticsearchConnection(Connection, EsConnMixin):
             return index()
         raise NotImplementedError
 
-    async def fetch(self, index, compiled_query):
+    async def fetch(self, index, compiled_query, request_timeout=None):
         """xxx: must have use scroll+slice
         https://stackoverflow.com/questions/43211387/
         what-does-elasticsearch-automatic-slicing-do
@@ -201,18 +283,37 @@ class AsyncElasticsearchConnection(Connection, EsConnMixin):
         elasticsearch-scroll-api-with-multi-threading
         """
         search_params = self.finalize_search_params(compiled_query, EngineQueryType.DML)
+        search_params.update(self.transport_params(request_timeout))
         conn = self.raw_connection
-        result = await conn.search(
-            index=await AsyncElasticsearchConnection.real_index(index), **search_params
-        )
+        if "pit" in search_params["body"]:
+            # index is bound with point in time
+            result = await conn.search(**search_params)
+        else:
+            result = await conn.search(
+                index=await AsyncElasticsearchConnection.real_index(index),
+                **search_params,
+            )
         self.evaluate_result(result)
         return result
 
-    async def count(self, index, compiled_query):
+    async def msearch(self, index, compiled_queries, request_timeout=None):
+        """Executes several searches by single _msearch request.
+        Scroll and point in time are not supported here."""
+        index = await AsyncElasticsearchConnection.real_index(index)
+        body = list()
+        for compiled_query in compiled_queries:
+            body.extend(self.finalize_msearch_params(index, compiled_query))
+        result = await self.raw_connection.msearch(
+            body=body, **self.transport_params(request_timeout)
+        )
+        return self.evaluate_msearch_result(result)
+
+    async def count(self, index, compiled_query, request_timeout=None):
         """ """
         search_params = self.finalize_search_params(
             compiled_query, EngineQueryType.COUNT
         )
+        search_params.update(self.transport_params(request_timeout))
         conn = self.raw_connection
         result = await conn.count(
             index=await AsyncElasticsearchConnection.real_index(index), **search_params
@@ -220,14 +321,36 @@ class AsyncElasticsearchConnection(Connection, EsConnMixin):
         self.evaluate_result(result)
         return result
 
-    async def scroll(self, scroll_id, scroll="30s"):
+    async def scroll(self, scroll_id, scroll="30s", request_timeout=None):
         """ """
         result = await self.raw_connection.scroll(
-            body={"scroll_id": scroll_id}, scroll=scroll
+            body={"scroll_id": scroll_id},
+            scroll=scroll,
+            **self.transport_params(request_timeout),
         )
         self.evaluate_result(result)
         return result
 
+    async def open_point_in_time(self, index, keep_alive="1m"):
+        """Returns point in time id"""
+        result = await self.raw_connection.open_point_in_time(
+            index=await AsyncElasticsearchConnection.real_index(index),
+            keep_alive=keep_alive,
+        )
+        return result["id"]
+
+    async def close_point_in_time(self, pit_id):
+        """ """
+        await self.raw_connection.close_point_in_time(
+            body={"id": pit_id}, ignore=(404,)
+        )
+
+    async def clear_scroll(self, scroll_id):
+        """Release server side scroll context, already expired one is ignored"""
+        await self.raw_connection.clear_scroll(
+            body={"scroll_id": scroll_id}, ignore=(404,)
+        )
+
 
 class ElasticsearchConnectionFactory(ConnectionFactory):
     """ """
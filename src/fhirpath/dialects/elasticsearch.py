@@ -2,26 +2,56 @@
 """ElasticSearch Dialect"""
 import logging
 import re
+from decimal import Decimal
 
 import isodate
 from zope.interface import alsoProvides
 
-from fhirpath.enums import OPERATOR, GroupType, MatchType, SortOrderType, TermMatchType
+from fhirpath.enums import (
+    OPERATOR,
+    GroupType,
+    MatchType,
+    SortOrderType,
+    TermMatchType,
+    TotalType,
+)
 from fhirpath.interfaces import IFhirPrimitiveType, IPrimitiveTypeCollection
 from fhirpath.interfaces.dialects import IIgnoreNestedCheck
 from fhirpath.interfaces.fql import (
     IExistsTerm,
     IGroupTerm,
+    IIdsTerm,
     IInTerm,
     INonFhirTerm,
     ITerm,
 )
+from fhirpath.storage import LRUStorage
 
 from .base import DialectBase
 
 __author__ = "Md Nazrul Islam<email2nazrul@gmail.com>"
 logger = logging.getLogger("fhirpath.dialects.elasticsearch")
 URI_SCHEME = re.compile(r"^https?://", re.I)
+# hits are counted accurately up to this threshold for ``_total=estimate``
+ESTIMATE_TOTAL_HITS = 1000
+# default ``index.max_terms_count`` of Elasticsearch
+MAX_TERMS_COUNT = 65536
+# number of compiled query templates kept per dialect instance
+COMPILE_CACHE_SIZE = 1024
+# n-gram size of ``contains`` subfield, shorter values cannot be looked up there
+CONTAINS_NGRAM_SIZE = 3
+STRING_TYPE_NAMES = (
+    "string",
+    "xhtml",
+    "uri",
+    "url",
+    "canonical",
+    "code",
+    "oid",
+    "id",
+    "uuid",
+)
+NUMERIC_TYPE_NAMES = ("integer", "decimal", "unsignedInt", "positiveInt")
 ES_PY_OPERATOR_MAP = {
     OPERATOR.eq: None,
     OPERATOR.ne: None,
@@ -54,6 +84,11 @@ def escape_all(v):
 class ElasticSearchDialect(DialectBase):
     """ """
 
+    def __init__(self, connection=None, cache_size=COMPILE_CACHE_SIZE):
+        """ """
+        super(ElasticSearchDialect, self).__init__(connection)
+        self.compile_cache = LRUStorage(maxsize=cache_size)
+
     @staticmethod
     def apply_nested(query, dotted_path):
         """ """
@@ -67,6 +102,43 @@ class ElasticSearchDialect(DialectBase):
         }
         return wrapper
 
+    @staticmethod
+    def merge_nested_clauses(clauses):
+        """Sibling nested queries on the same path are merged into single nested
+        query (one join), those inner queries are OR´ed. Only applicable for
+        ``should`` and ``must_not`` clauses: any element matches A or any element
+        matches B is the same as any element matches A or B, but for ``filter``
+        different elements might match A and B (decoupled)."""
+        groups = dict()
+        for clause in clauses:
+            nested = clause.get("nested") if len(clause) == 1 else None
+            if nested is None:
+                key = (id(clause),)
+            else:
+                key = (
+                    nested["path"],
+                    nested.get("ignore_unmapped"),
+                    nested.get("score_mode"),
+                )
+            groups.setdefault(key, list()).append(clause)
+
+        merged = list()
+        for group in groups.values():
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+            nested = dict(group[0]["nested"])
+            nested["query"] = {
+                "bool": {
+                    "should": ElasticSearchDialect.merge_nested_clauses(
+                        [clause["nested"]["query"] for clause in group]
+                    ),
+                    "minimum_should_match": 1,
+                }
+            }
+            merged.append({"nested": nested})
+        return merged
+
     @staticmethod
     def apply_path_replacement(dotted_path, root_replacer):
         """ """
@@ -139,8 +211,20 @@ class ElasticSearchDialect(DialectBase):
         return q
 
     @staticmethod
-    def create_contains_term(path, value):
-        """Create ES Regex Query"""
+    def create_ngram_term(path, value, map_info=None):
+        """Create ES Match Phrase Query on n-gram ``contains`` subfield,
+        consecutive n-grams of value are looked up like terms.
+        None if there is no such subfield or value is too short."""
+        if not map_info or "contains" not in map_info.get("fields", {}):
+            return None
+        if not isinstance(value, str) or len(value) < CONTAINS_NGRAM_SIZE:
+            return None
+        return {"match_phrase": {f"{path}.contains": value}}
+
+    @staticmethod
+    def create_contains_term(path, value, map_info=None):
+        """Create ES Match Phrase Query on n-gram subfield,
+        falls back to Regex Query"""
 
         if isinstance(value, (list, tuple)):
             if len(value) == 1:
@@ -149,17 +233,31 @@ class ElasticSearchDialect(DialectBase):
                 q = {"bool": {"should": [], "minimum_should_match": 1}}
                 for val in value:
                     q["bool"]["should"].append(
-                        {"prefix": {path: {"value": ".*{0}.*".format(escape_all(val))}}}
+                        ElasticSearchDialect.create_contains_term(path, val, map_info)
                     )
                 return q
 
-        q = {"regexp": {path: {"value": ".*{0}.*".format(escape_all(value))}}}
+        q = ElasticSearchDialect.create_ngram_term(path, value, map_info)
+        if q is None:
+            q = {"regexp": {path: {"value": ".*{0}.*".format(escape_all(value))}}}
 
         return q
 
     @staticmethod
-    def create_eb_term(path, value):
-        """Create ES Prefix Query"""
+    def create_reverse_term(path, value, map_info=None):
+        """Create ES Prefix Query on reversed ``reverse`` subfield, prefix value
+        is not analyzed, so it is only reversed (case sensitive, like wildcard).
+        None if there is no such subfield."""
+        if not map_info or "reverse" not in map_info.get("fields", {}):
+            return None
+        if not isinstance(value, str):
+            return None
+        return {"prefix": {f"{path}.reverse": value[::-1]}}
+
+    @staticmethod
+    def create_eb_term(path, value, map_info=None):
+        """Create ES Prefix Query on reversed subfield,
+        falls back to Wildcard Query"""
         if isinstance(value, (list, tuple)):
             if len(value) == 1:
                 value = value[0]
@@ -167,11 +265,13 @@ class ElasticSearchDialect(DialectBase):
                 q = {"bool": {"should": [], "minimum_should_match": 1}}
                 for val in value:
                     q["bool"]["should"].append(
-                        {"wildcard": {path: {"value": "*" + escape_star(val)}}}
+                        ElasticSearchDialect.create_eb_term(path, val, map_info)
                     )
                 return q
 
-        q = {"wildcard": {path: {"value": "*{0}".format(escape_star(value))}}}
+        q = ElasticSearchDialect.create_reverse_term(path, value, map_info)
+        if q is None:
+            q = {"wildcard": {path: {"value": "*{0}".format(escape_star(value))}}}
 
         return q
 
@@ -187,6 +287,19 @@ class ElasticSearchDialect(DialectBase):
             path_ = term.path.path
         return path_
 
+    @staticmethod
+    def get_term_paths(term, root_replacer=None):
+        """Dotted paths looked up by term, group term's paths are collected
+        from its terms."""
+        if IGroupTerm.providedBy(term):
+            paths = list()
+            for t_ in term.terms:
+                for path_ in ElasticSearchDialect.get_term_paths(t_, root_replacer):
+                    if path_ not in paths:
+                        paths.append(path_)
+            return paths
+        return [ElasticSearchDialect.create_dotted_path(term, root_replacer)]
+
     @staticmethod
     def clean_up(body_structure):
         """ """
@@ -271,6 +384,10 @@ class ElasticSearchDialect(DialectBase):
 
             container.append(q)
 
+        # filter clauses are kept apart, each might be matched by other element
+        bool_ = body_structure["query"]["bool"]
+        bool_["must_not"] = ElasticSearchDialect.merge_nested_clauses(bool_["must_not"])
+
         # if not searching on all resources, add a predicate to filter on resourceType
         if resource_type != "Resource":
             ElasticSearchDialect.apply_from_constraint(
@@ -283,6 +400,13 @@ class ElasticSearchDialect(DialectBase):
         )
         # Limit
         ElasticSearchDialect.apply_limit(query.get_limit(), body_structure)
+        ElasticSearchDialect.apply_track_total_hits(query.get_limit(), body_structure)
+        ElasticSearchDialect.apply_search_after(
+            query.get_limit(),
+            body_structure,
+            resource_type,
+            root_replacer=root_replacer,
+        )
         # ES source_
         ElasticSearchDialect.apply_source_filter(
             query, body_structure, root_replacer=root_replacer
@@ -297,6 +421,41 @@ class ElasticSearchDialect(DialectBase):
         return body_structure
 
     def compile(self, query, calculate_field_index_name, get_mapping):
+        """Queries sharing the same structure (paths, operators, modifiers, sort,
+        limit and selected elements) are compiled once, subsequent compilations
+        only splice the literal values into a copy of the cached template."""
+        slots = list()
+        fingerprint = self.create_fingerprint(query, calculate_field_index_name, slots)
+        if fingerprint is None:
+            return self.compile_without_cache(
+                query, calculate_field_index_name, get_mapping
+            )
+
+        template = self.compile_cache.get(fingerprint, None)
+        if template is not None:
+            body_structure, locations = template
+            body_structure = ElasticSearchDialect.copy_structure(body_structure)
+            for (value, _), slot_locations in zip(slots, locations):
+                for location in slot_locations:
+                    container = body_structure
+                    for key in location[:-1]:
+                        container = container[key]
+                    container[location[-1]] = value
+            ElasticSearchDialect.bind_cursor(query.get_limit(), body_structure)
+            return body_structure
+
+        compiled = self.compile_without_cache(
+            query, calculate_field_index_name, get_mapping
+        )
+        locations = ElasticSearchDialect.locate_slots(compiled, slots)
+        if locations is not None:
+            self.compile_cache.insert(
+                fingerprint,
+                (ElasticSearchDialect.copy_structure(compiled), locations),
+            )
+        return compiled
+
+    def compile_without_cache(self, query, calculate_field_index_name, get_mapping):
         """ """
         query_fragments = []
 
@@ -335,6 +494,191 @@ class ElasticSearchDialect(DialectBase):
         else:
             return query_fragments[0]
 
+    def create_fingerprint(self, query, calculate_field_index_name, slots):
+        """Structural key of the query, literal values that are placed verbatim
+        into the compiled query are appended to ``slots`` (as value and expected
+        occurrences) instead of being part of the key.
+        Returns None if the query cannot be cached."""
+        where = list()
+        for term in query.get_where():
+            term_key = ElasticSearchDialect.create_term_fingerprint(term, slots)
+            if term_key is None:
+                return None
+            where.append(term_key)
+
+        # a value might be shared between terms (i.e. one search parameter
+        # expanded to several paths), the sharing is part of the structure.
+        first_indexes = dict()
+        shared = tuple(
+            first_indexes.setdefault(id(value), index)
+            for index, (value, _) in enumerate(slots)
+        )
+        limit = query.get_limit()
+        return (
+            shared,
+            tuple(
+                (
+                    from_clause[0],
+                    from_clause[1].get_resource_type(),
+                    calculate_field_index_name(from_clause[1].get_resource_type()),
+                )
+                for from_clause in query.get_from()
+            ),
+            tuple(where),
+            tuple((term.path._raw, term.order) for term in query.get_sort()),
+            # cursor values are bound into the cached template (``bind_cursor``),
+            # only their presence changes the structure.
+            (
+                limit.limit,
+                limit.offset,
+                limit.cursor,
+                bool(limit.search_after),
+                limit.point_in_time is not None,
+                limit.total,
+            ),
+            tuple((el._raw, el.non_fhir) for el in query.get_element()),
+        )
+
+    @staticmethod
+    def create_term_fingerprint(term, slots):
+        """ """
+        path_ = getattr(term, "path", None)
+        base = (
+            term.__class__.__name__,
+            getattr(path_, "_raw", path_),
+            getattr(term, "comparison_operator", None),
+            getattr(term, "unary_operator", None),
+            getattr(term, "match_type", None),
+            IIgnoreNestedCheck.providedBy(term),
+        )
+        if IGroupTerm.providedBy(term):
+            children = list()
+            for t_ in term.terms:
+                child_key = ElasticSearchDialect.create_term_fingerprint(t_, slots)
+                if child_key is None:
+                    return None
+                children.append(child_key)
+            return base + (term.type, term.match_operator, tuple(children))
+
+        elif IInTerm.providedBy(term):
+            children = list()
+            for t_ in term:
+                child_key = ElasticSearchDialect.create_term_fingerprint(t_, slots)
+                if child_key is None:
+                    return None
+                children.append(child_key)
+            return base + (tuple(children),)
+
+        elif IIdsTerm.providedBy(term):
+            if len(term.get_real_value()) > MAX_TERMS_COUNT:
+                return None
+            slots.append((term.get_real_value(), 1))
+            return base
+
+        elif IExistsTerm.providedBy(term):
+            return base
+
+        elif ITerm.providedBy(term) or INonFhirTerm.providedBy(term):
+            value = term.get_real_value()
+            occurrences = ElasticSearchDialect.get_value_occurrences(term, value)
+            if occurrences > 0 and not ElasticSearchDialect.is_shared_object(value):
+                slots.append((value, occurrences))
+                return base + (type(value),)
+            # value changes the structure of the compiled query
+            return base + ((type(value), repr(value)),)
+
+        return None
+
+    @staticmethod
+    def get_value_occurrences(term, value):
+        """How many times the term value is placed as is (unformatted,
+        unescaped) into the compiled query, zero if not applicable."""
+        if INonFhirTerm.providedBy(term) or not term.path.context.type_is_primitive:
+            return 0
+        type_name = term.path.context.type_name
+
+        if (
+            type_name in STRING_TYPE_NAMES
+            and type(value) is str
+            and term.comparison_operator not in (OPERATOR.eb, OPERATOR.contains)
+        ):
+            return 1
+
+        if type_name in NUMERIC_TYPE_NAMES and type(value) in (int, float, Decimal):
+            if term.comparison_operator in (OPERATOR.eq, OPERATOR.ne):
+                # both range boundaries
+                return 2
+            return 1
+
+        return 0
+
+    @staticmethod
+    def is_shared_object(value):
+        """The interpreter reuses a single object for some values (i.e small
+        integers, one character strings), those might be placed by the dialect
+        itself (``minimum_should_match: 1``), so cannot be located by identity."""
+        if type(value) is int:
+            return int(str(value)) is value
+        if type(value) is str:
+            return value.encode("utf8").decode("utf8") is value
+        return False
+
+    @staticmethod
+    def bind_cursor(limit_clause, body_structure):
+        """Place search_after values and point in time id into the copy of
+        cached template."""
+        if "search_after" in body_structure:
+            body_structure["search_after"] = limit_clause.search_after
+        if "pit" in body_structure:
+            body_structure["pit"]["id"] = limit_clause.point_in_time
+
+    @staticmethod
+    def locate_slots(body_structure, slots):
+        """Find the locations (as keys path) of each slot value inside compiled
+        query, matched by identity. Returns None if any value could not be
+        located exactly as many times as expected."""
+        positions = dict()
+        occurrences = [0] * len(slots)
+        for index, (value, occurrence) in enumerate(slots):
+            # shared value is located once, at first slot
+            index = positions.setdefault(id(value), index)
+            occurrences[index] += occurrence
+        locations = [list() for _ in slots]
+
+        def walk(node, location):
+            if isinstance(node, dict):
+                items = node.items()
+            else:
+                items = enumerate(node)
+            for key, child in items:
+                # slot value might be a list (i.e ids), so identity goes first
+                if id(child) in positions:
+                    locations[positions[id(child)]].append(location + (key,))
+                elif isinstance(child, (dict, list)):
+                    walk(child, location + (key,))
+
+        for key, child in body_structure.items():
+            # cursor values are bound separately
+            if key in ("search_after", "pit"):
+                continue
+            walk({key: child}, ())
+        for occurrence, slot_locations in zip(occurrences, locations):
+            if len(slot_locations) != occurrence:
+                return None
+        return locations
+
+    @staticmethod
+    def copy_structure(node):
+        """Faster than deepcopy for the dict/list only compiled query"""
+        if isinstance(node, dict):
+            return {
+                key: ElasticSearchDialect.copy_structure(value)
+                for key, value in node.items()
+            }
+        elif isinstance(node, list):
+            return [ElasticSearchDialect.copy_structure(value) for value in node]
+        return node
+
     def resolve_term(self, term, mapping, root_replacer):
         """ """
         if IGroupTerm.providedBy(term):
@@ -377,6 +721,12 @@ class ElasticSearchDialect(DialectBase):
                 else:
                     container.append(resolved)
 
+            if term.type == GroupType.DECOUPLED and term.match_operator in (
+                MatchType.ANY,
+                MatchType.NONE,
+            ):
+                container[:] = ElasticSearchDialect.merge_nested_clauses(container)
+
             if not IIgnoreNestedCheck.providedBy(term):
                 qr = ElasticSearchDialect.attach_nested_on_demand(
                     term.path.context, qr, root_replacer
@@ -393,10 +743,16 @@ class ElasticSearchDialect(DialectBase):
             for t_ in term:
                 resolved = self.resolve_term(t_, mapping, root_replacer)
                 container.append(resolved[0])
+            container[:] = ElasticSearchDialect.merge_nested_clauses(container)
             if len(container) > 0:
                 qr["bool"]["minimum_should_match"] = 1
             return qr, unary_operator
 
+        elif IIdsTerm.providedBy(term):
+            return ElasticSearchDialect.resolve_ids_term(
+                term, root_replacer=root_replacer
+            )
+
         elif IExistsTerm.providedBy(term):
             return ElasticSearchDialect.resolve_exists_term(
                 term, root_replacer=root_replacer
@@ -441,10 +797,12 @@ class ElasticSearchDialect(DialectBase):
                         if term.comparison_operator == OPERATOR.sa:
                             q = ElasticSearchDialect.create_sa_term(dotted_path, value)
                         elif term.comparison_operator == OPERATOR.eb:
-                            q = ElasticSearchDialect.create_eb_term(dotted_path, value)
+                            q = ElasticSearchDialect.create_eb_term(
+                                dotted_path, value, map_info
+                            )
                         elif term.comparison_operator == OPERATOR.contains:
                             q = ElasticSearchDialect.create_contains_term(
-                                dotted_path, value
+                                dotted_path, value, map_info
                             )
                         else:
                             # FIXME find a cleaner way to do that
@@ -626,19 +984,23 @@ class ElasticSearchDialect(DialectBase):
             elif term.comparison_operator == OPERATOR.sa:
                 qr = {"match_phrase_prefix": {path_: value}}
             elif term.comparison_operator == OPERATOR.eb:
-                qr = {
-                    "query_string": {
-                        "fields": [path_],
-                        "query": "*{0}".format(escape_star(value)),
+                qr = ElasticSearchDialect.create_reverse_term(path_, value, map_info)
+                if qr is None:
+                    qr = {
+                        "query_string": {
+                            "fields": [path_],
+                            "query": "*{0}".format(escape_star(value)),
+                        }
                     }
-                }
             elif term.comparison_operator == OPERATOR.contains:
-                qr = {
-                    "query_string": {
-                        "fields": [path_],
-                        "query": "*{0}*".format(escape_star(value)),
+                qr = ElasticSearchDialect.create_ngram_term(path_, value, map_info)
+                if qr is None:
+                    qr = {
+                        "query_string": {
+                            "fields": [path_],
+                            "query": "*{0}*".format(escape_star(value)),
+                        }
                     }
-                }
             else:
                 qr = {"match": {path_: {"query": value, "fuzziness": "AUTO"}}}
 
@@ -663,6 +1025,46 @@ class ElasticSearchDialect(DialectBase):
 
         return qr, term.unary_operator
 
+    @staticmethod
+    def resolve_ids_term(term, root_replacer=None):
+        """Single ``terms`` query, values beyond ``MAX_TERMS_COUNT`` are split
+        into several ``terms`` queries."""
+        path_ = ElasticSearchDialect.create_dotted_path(term, root_replacer)
+        values = term.get_real_value()
+
+        if root_replacer == "*":
+            # searching on all resources
+            qr = {
+                "bool": {
+                    "should": [
+                        ElasticSearchDialect.create_term(
+                            path_, value, all_resources=True
+                        )
+                        for value in values
+                    ],
+                    "minimum_should_match": 1,
+                }
+            }
+        elif len(values) <= MAX_TERMS_COUNT:
+            qr = {"terms": {path_: values}}
+        else:
+            qr = {
+                "bool": {
+                    "should": [
+                        {"terms": {path_: values[index : index + MAX_TERMS_COUNT]}}
+                        for index in range(0, len(values), MAX_TERMS_COUNT)
+                    ],
+                    "minimum_should_match": 1,
+                }
+            }
+
+        if not IIgnoreNestedCheck.providedBy(term):
+            qr = ElasticSearchDialect.attach_nested_on_demand(
+                term.path.context, qr, root_replacer
+            )
+
+        return qr, term.unary_operator
+
     def resolve_nonfhir_term(self, term):
         """ """
         if IPrimitiveTypeCollection.providedBy(term.value):
@@ -719,9 +1121,47 @@ class ElasticSearchDialect(DialectBase):
             return
         if isinstance(limit_clause.limit, int):
             body_structure["size"] = limit_clause.limit
-        if isinstance(limit_clause.offset, int):
+        if isinstance(limit_clause.offset, int) and not limit_clause.cursor:
             body_structure["from"] = limit_clause.offset
 
+    @staticmethod
+    def apply_track_total_hits(limit_clause, body_structure):
+        """https://www.elastic.co/guide/en/elasticsearch/reference/\
+        current/search-your-data.html#track-total-hits"""
+        if limit_clause.total is None:
+            return
+        if limit_clause.total == TotalType.NONE:
+            body_structure["track_total_hits"] = False
+        elif limit_clause.total == TotalType.ESTIMATE:
+            body_structure["track_total_hits"] = ESTIMATE_TOTAL_HITS
+        else:
+            body_structure["track_total_hits"] = True
+
+    @staticmethod
+    def apply_search_after(
+        limit_clause, body_structure, resource_type, root_replacer=None
+    ):
+        """https://www.elastic.co/guide/en/elasticsearch/reference/\
+        current/paginate-search-results.html#search-after
+
+        Resource id is used as tiebreaker, so that sort values are unique."""
+        if limit_clause.empty or not limit_clause.cursor:
+            return
+        if resource_type == "Resource":
+            tiebreaker = "_id"
+        else:
+            tiebreaker = f"{root_replacer or resource_type}.id"
+        if not any(tiebreaker in item for item in body_structure["sort"]):
+            body_structure["sort"].append({tiebreaker: {"order": "asc"}})
+
+        if len(limit_clause.search_after) > 0:
+            body_structure["search_after"] = limit_clause.search_after
+        if limit_clause.point_in_time is not None:
+            body_structure["pit"] = {
+                "id": limit_clause.point_in_time,
+                "keep_alive": "1m",
+            }
+
     @staticmethod
     def apply_sort(sort_terms, body_structure, root_replacer=None):
         """ """
@@ -784,10 +1224,10 @@ class ElasticSearchDialect(DialectBase):
             else:
                 includes.append(root_replacer)
         elif len(query.get_element()) > 0:
-            # always include the resourceType in the ES response
-            includes.append(
-                f"{root_replacer}.resourceType" if root_replacer else "resourceType"
-            )
+            # always include the resourceType and id in the ES response,
+            # resources are identified by those (i.e _include deduplication)
+            for name in ("resourceType", "id"):
+                includes.append(f"{root_replacer}.{name}" if root_replacer else name)
             for path_el in query.get_element():
                 includes.append(replace(path_el))
 
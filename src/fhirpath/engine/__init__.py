@@ -4,9 +4,11 @@ from fhirpath.connectors.connection import Connection
 from fhirpath.enums import FHIR_VERSION
 
 from .base import (
+    ColumnarEngineResultBody,
     Engine,
     EngineResult,
     EngineResultBody,
+    EngineResultColumn,
     EngineResultHeader,
     EngineResultRow,
 )
@@ -20,6 +22,8 @@ __all__ = [
     "EngineResultHeader",
     "EngineResultBody",
     "EngineResultRow",
+    "EngineResultColumn",
+    "ColumnarEngineResultBody",
 ]
 
 
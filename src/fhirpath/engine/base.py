@@ -1,9 +1,15 @@
 # _*_ coding: utf-8 _*_
+import datetime
+import math
+import re
 import time
 from abc import ABC
+from array import array
 from collections import defaultdict, deque
-from typing import Dict, List
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
+import isodate
 from zope.interface import implementer
 
 from fhirpath.enums import FHIR_VERSION, WhereConstraintType
@@ -18,8 +24,97 @@ from fhirpath.interfaces.engine import (
     IEngineResultRow,
 )
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 __author__ = "Md Nazrul Islam <email2nazrul@gmail.com>"
 
+COLUMN_INTEGER_TYPES = {"integer", "positiveInt", "unsignedInt"}
+COLUMN_DECIMAL_TYPES = {"decimal"}
+COLUMN_DATETIME_TYPES = {"date", "dateTime", "instant"}
+# same as numpy.datetime64("NaT") as int64
+NAT = -(2**63)
+# relative or absolute literal reference, version specific part is ignored
+REFERENCE_PATTERN = re.compile(
+    r"^(?:.*/)?(?P<resource_type>[A-Z][A-Za-z]+)/(?P<resource_id>[A-Za-z0-9\-.]{1,64})"
+    r"(?:/_history/[A-Za-z0-9\-.]{1,64})?$"
+)
+
+
+def parse_reference(ref_attr: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+    """Returns (resource type, resource id) of a Reference, ``None`` if
+    the reference is not resolvable (i.e contained or logical reference)."""
+    reference = ref_attr.get("reference")
+    if not reference or reference.startswith("#"):
+        return None
+    if reference.startswith("urn:"):
+        # urn:uuid:<id> or urn:oid:<id>, resource type only known from Reference.type
+        resource_type = ref_attr.get("type")
+        if not resource_type:
+            return None
+        return resource_type, reference.rsplit(":", 1)[1]
+    matched = REFERENCE_PATTERN.match(reference)
+    if matched is None:
+        return None
+    return matched.group("resource_type"), matched.group("resource_id")
+
+
+@lru_cache(maxsize=1024)
+def parse_reference_expression(
+    expression: str,
+) -> Tuple[str, Tuple[str, ...], Optional[str]]:
+    """Returns (resource type, path parts, target resource type) of
+    reference search parameter expression, target type is ``None``
+    if references are not restricted to single resource type."""
+    # use ElementPath to parse fhirpath expressions like .where()
+    path_element = ElementPath(expression)
+    target_type = None
+    if path_element._where and path_element._where.type == WhereConstraintType.T2:
+        # only references of the required resource type
+        target_type = path_element._where.value
+    resource_type, *parts = path_element._path.split(".")
+    return resource_type, tuple(parts), target_type
+
+
+@lru_cache(maxsize=1024)
+def compile_reference_extractor(
+    expression: str,
+) -> Callable[[Dict[str, Any]], Iterator[Tuple[str, str]]]:
+    """Compiles search parameter expression into function, which yields
+    (resource type, resource id) of all references from a resource."""
+    _, parts, target_type = parse_reference_expression(expression)
+
+    def extractor(resource):
+        nodes = [resource]
+        for part in parts:
+            children = []
+            for node in nodes:
+                if not isinstance(node, dict):
+                    continue
+                value = node.get(part)
+                if value is None:
+                    continue
+                if isinstance(value, list):
+                    children.extend(value)
+                else:
+                    children.append(value)
+            nodes = children
+            if len(nodes) == 0:
+                return
+        for ref_attr in nodes:
+            if not isinstance(ref_attr, dict):
+                continue
+            parsed = parse_reference(ref_attr)
+            if parsed is None:
+                continue
+            if target_type is not None and parsed[0] != target_type:
+                continue
+            yield parsed
+
+    return extractor
+
 
 @implementer(IEngine)
 class Engine(ABC):
@@ -53,6 +148,22 @@ class Engine(ABC):
         """Hook: before execution of query"""
         pass
 
+    def execute_iter(self, query, unrestricted=False):
+        """Yields ``EngineResult`` page by page (async iterator, if engine is
+        async). Fallback for engines without streaming support, whole result
+        of ``execute`` is yielded as single page."""
+        if self.is_async():
+
+            async def pages():
+                yield await self.execute(query, unrestricted)
+
+        else:
+
+            def pages():
+                yield self.execute(query, unrestricted)
+
+        return pages()
+
     @classmethod
     def is_async(cls):
         return False
@@ -66,6 +177,14 @@ class EngineResultHeader(object):
     raw_query = None
     generated_on = None
     elements = None
+    # opaque token of next page, cursor based pagination
+    next_cursor = None
+    # partial result, search was stopped by time budget
+    timed_out = False
+    # partial result, search was stopped by max number of documents per shard
+    terminated_early = False
+    # execution timings of each where term, available if query is profiled
+    profile = None
 
     def __init__(self, total, raw_query=None):
         """ """
@@ -93,6 +212,209 @@ class EngineResultRow(list):
     """ """
 
 
+class EngineResultColumn(object):
+    """Single column of columnar result.
+    Numeric and date (epoch milliseconds) values are stored in typed ``array``,
+    column falls back to object (list) storage, if any value doesn't fit."""
+
+    def __init__(self, name: str, kind: Optional[str] = None):
+        """ """
+        self.name = name
+        self.kind = kind
+        self.values: Any
+        if kind == "integer":
+            self.values = array("q")
+        elif kind == "decimal":
+            self.values = array("d")
+        elif kind == "datetime":
+            self.values = array("q")
+        else:
+            self.kind = None
+            self.values = list()
+
+    @staticmethod
+    def kind_from_element_path(el_path) -> Optional[str]:
+        """ """
+        if el_path._raw.endswith(".count()"):
+            return "integer"
+        context = el_path.context
+        if el_path.star or el_path.non_fhir or context is None or context.multiple:
+            return None
+        type_name = getattr(context, "type_name", None)
+        if type_name in COLUMN_INTEGER_TYPES:
+            return "integer"
+        if type_name in COLUMN_DECIMAL_TYPES:
+            return "decimal"
+        if type_name in COLUMN_DATETIME_TYPES:
+            return "datetime"
+        return None
+
+    @staticmethod
+    def to_epoch_milliseconds(value: str) -> int:
+        """FHIR date, dateTime, instant to epoch milliseconds (UTC)"""
+        if "T" in value:
+            dt = isodate.parse_datetime(value)
+        else:
+            date = isodate.parse_date(value)
+            dt = datetime.datetime(date.year, date.month, date.day)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=datetime.timezone.utc)
+        return int(dt.timestamp() * 1000)
+
+    def append(self, value):
+        """ """
+        if self.kind is None:
+            self.values.append(value)
+        elif self.kind == "integer":
+            if value is None:
+                # no null for integer, becomes decimal (NaN)
+                self._change_kind("decimal")
+                self.values.append(math.nan)
+            elif isinstance(value, int) and not isinstance(value, bool):
+                self.values.append(value)
+            else:
+                self._change_kind(None)
+                self.values.append(value)
+        elif self.kind == "decimal":
+            if value is None:
+                self.values.append(math.nan)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.values.append(value)
+            else:
+                self._change_kind(None)
+                self.values.append(value)
+        elif self.kind == "datetime":
+            if value is None:
+                self.values.append(NAT)
+                return
+            try:
+                self.values.append(self.to_epoch_milliseconds(value))
+            except (TypeError, ValueError, isodate.ISO8601Error):
+                self._change_kind(None)
+                self.values.append(value)
+
+    def _change_kind(self, kind: Optional[str]):
+        """ """
+        if kind == "decimal":
+            self.values = array("d", self.values)
+        elif self.kind in ("datetime", "decimal"):
+            # NaN, NaT become None
+            self.values = list(self)
+        else:
+            self.values = list(self.values)
+        self.kind = kind
+
+    def to_numpy(self):
+        """ """
+        if numpy is None:
+            raise ImportError("numpy is required for numpy export!")
+        if self.kind == "integer":
+            return numpy.frombuffer(self.values, dtype=numpy.int64)
+        if self.kind == "decimal":
+            return numpy.frombuffer(self.values, dtype=numpy.float64)
+        if self.kind == "datetime":
+            return numpy.frombuffer(self.values, dtype=numpy.int64).view(
+                "datetime64[ms]"
+            )
+        arr = numpy.empty(len(self.values), dtype=object)
+        arr[:] = self.values
+        return arr
+
+    def __getitem__(self, index):
+        """ """
+        value = self.values[index]
+        if self.kind == "decimal" and math.isnan(value):
+            return None
+        if self.kind == "datetime":
+            if value == NAT:
+                return None
+            return datetime.datetime.fromtimestamp(
+                value / 1000, tz=datetime.timezone.utc
+            )
+        return value
+
+    def __iter__(self):
+        """ """
+        for index in range(len(self)):
+            yield self[index]
+
+    def __len__(self):
+        """ """
+        return len(self.values)
+
+
+@implementer(IEngineResultBody)
+class ColumnarEngineResultBody(object):
+    """Columnar result body, stores one column (array) per select path
+    instead of list per row."""
+
+    def __init__(self, columns: List[EngineResultColumn]):
+        """ """
+        self.columns = columns
+
+    @classmethod
+    def from_selects(cls, selects) -> "ColumnarEngineResultBody":
+        """ """
+        return cls(
+            [
+                EngineResultColumn(
+                    el_path._raw, EngineResultColumn.kind_from_element_path(el_path)
+                )
+                for el_path in selects
+            ]
+        )
+
+    @property
+    def names(self) -> List[str]:
+        """ """
+        return [column.name for column in self.columns]
+
+    def column(self, name: str) -> EngineResultColumn:
+        """ """
+        for column in self.columns:
+            if column.name == name:
+                return column
+        raise KeyError(name)
+
+    def append(self, value):
+        """ """
+        for column, item in zip(self.columns, value):
+            column.append(item)
+
+    def add(self, value):
+        """ """
+        self.append(value)
+
+    def to_numpy(self) -> Dict[str, Any]:
+        """Returns dict of column name and numpy array"""
+        return {column.name: column.to_numpy() for column in self.columns}
+
+    def to_records(self):
+        """Returns numpy record array if numpy is available,
+        otherwise list of tuples."""
+        if numpy is None:
+            return list(zip(*[list(column) for column in self.columns]))
+        return numpy.rec.fromarrays(
+            [column.to_numpy() for column in self.columns],
+            names=self.names,
+        )
+
+    def __getitem__(self, index):
+        """ """
+        return EngineResultRow(column[index] for column in self.columns)
+
+    def __iter__(self):
+        """ """
+        for index in range(len(self)):
+            yield self[index]
+
+    def __len__(self):
+        """ """
+        if len(self.columns) == 0:
+            return 0
+        return len(self.columns[0])
+
+
 @implementer(IEngineResult)
 class EngineResult(object):
     """ """
@@ -142,53 +464,11 @@ class EngineResult(object):
                 f"'expression' is not defined for search parameter {search_param.name}"
             )
 
-        ids: Dict = defaultdict(list)
-
-        # use ElementPath to parse fhirpath expressions like .where()
-        path_element = ElementPath(search_param.expression)
-
-        def browse(node, path):
-            parts = path.split(".", 1)
-
-            if len(parts) == 0:
-                return node
-            elif parts[0] not in node:
-                return None
-            elif len(parts) == 1:
-                return node[parts[0]]
-            else:
-                return browse(node[parts[0]], parts[1])
-
-        def append_ref(ref_attr):
-            # if the searchparam expression contains .where() statement, skip references
-            # that do not match the required resource type
-            if (
-                path_element._where
-                and path_element._where.type == WhereConstraintType.T2
-            ):
-                ref_target_type = ref_attr["reference"].split("/")[0]
-                if path_element._where.value != ref_target_type:
-                    return
-
-            if "reference" not in ref_attr:
-                return
-
-            # FIXME: this does not work with references using absolute URLs
-            referenced_resource, _id = ref_attr["reference"].split("/")
-            ids[referenced_resource].append(_id)
-
-        # remove the resource type from the path
-        _, path = path_element._path.split(".", 1)
+        extractor = compile_reference_extractor(search_param.expression)
+        # ordered set of IDs per resource type
+        ids: Dict = defaultdict(dict)
         for row in self.body:
-            resource = row[0]
-            ref_attribute = browse(resource, path)
+            for resource_type, resource_id in extractor(row[0]):
+                ids[resource_type][resource_id] = None
 
-            if ref_attribute is None:
-                continue
-            elif isinstance(ref_attribute, list):
-                for r in ref_attribute:
-                    append_ref(r)
-            else:
-                append_ref(ref_attribute)
-
-        return ids
+        return {resource_type: list(ids_) for resource_type, ids_ in ids.items()}
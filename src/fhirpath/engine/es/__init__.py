@@ -1,7 +1,11 @@
 # _*_ coding: utf-8 _*_
+import asyncio
 import re
+import time
 from collections import defaultdict
-from typing import Dict, List, Optional
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from fhirspec import FHIRStructureDefinitionElement
 from zope.interface import implementer
@@ -12,6 +16,8 @@ from fhirpath.engine.base import (
     EngineResult,
     EngineResultBody,
     EngineResultHeader,
+    parse_reference,
+    parse_reference_expression,
 )
 from fhirpath.engine.es.mapping import (
     build_elements_paths,
@@ -19,49 +25,213 @@ from fhirpath.engine.es.mapping import (
     fhir_types_mapping,
 )
 from fhirpath.enums import EngineQueryType
-from fhirpath.exceptions import ValidationError
+from fhirpath.exceptions import DeadlineExceeded, ValidationError
 from fhirpath.fhirspec import FhirSpecFactory
 from fhirpath.interfaces import IElasticsearchEngine
-from fhirpath.utils import BundleWrapper
+from fhirpath.utils import BundleWrapper, encode_cursor
 
 CONTAINS_INDEX_OR_FUNCTION = re.compile(r"[a-z09_]+(\[[0-9]+\])|(\([0-9]*\))$", re.I)
 CONTAINS_INDEX = re.compile(r"[a-z09_]+\[[0-9]+\]$", re.I)
 CONTAINS_FUNCTION = re.compile(r"[a-z09_]+\([0-9]*\)$", re.I)
+# subfields of string fields (see mapping), looked up instead of the field itself
+PROFILE_SUBFIELDS = ("raw", "contains", "reverse")
 
 __author__ = "Md Nazrul Islam<email2nazrul@gmail.com>"
 
 
-def navigate_indexed_path(source, path_):
-    """ """
-    parts = path_.split("[")
-    p_ = parts[0]
-    index = int(parts[1][:-1])
-    value = source.get(p_, None)
-    if value is None:
-        return value
+@lru_cache(maxsize=1024)
+def compile_path_segment(path_: str) -> Callable[[Any], Any]:
+    """Compiles single segment of source filter path into an accessor function.
+    Looks path_ is innocent string key, but may content expression, function;
+    all regex evaluations are done once here, instead of for every hit."""
+    is_function = CONTAINS_FUNCTION.match(path_) is not None
+    func_name = None
+    index = None
+    if is_function:
+        parts = path_.split("(")
+        func_name = parts[0]
+        if len(parts[1]) > 1:
+            index = int(parts[1][:-1])
+
+    # dict source
+    if CONTAINS_INDEX_OR_FUNCTION.search(path_) and is_function:
+
+        def from_dict(source):
+            raise ValidationError(
+                f"Invalid path {path_} has been supllied!"
+                "Path cannot contain function if source type is dict"
+            )
+
+    elif CONTAINS_INDEX.match(path_):
+        key, key_index = path_[:-1].split("[")
+        key_index = int(key_index)
+
+        def from_dict(source):
+            value = source.get(key, None)
+            if value is None:
+                return value
+            try:
+                return value[key_index]
+            except IndexError:
+                return None
+
+    elif path_ == "*":
+
+        def from_dict(source):
+            # TODO check if we can have other keys than resource
+            return source[list(source.keys())[0]]
+
+    else:
+
+        def from_dict(source):
+            return source.get(path_, None)
+
+    # list source
+    if not is_function:
+
+        def from_list(source):
+            raise ValidationError(
+                f"Invalid path {path_} has been supllied!"
+                "Path should contain function if source type is list"
+            )
+
+    elif func_name == "count":
+        from_list = len
+    elif func_name == "first":
+
+        def from_list(source):
+            return source[0]
+
+    elif func_name == "last":
 
-    try:
-        return value[index]
-    except IndexError:
-        return None
+        def from_list(source):
+            return source[-1]
+
+    elif func_name == "Skip":
+
+        def from_list(source):
+            return [no for idx, no in enumerate(source) if idx != index]
+
+    elif func_name == "Take":
+
+        def from_list(source):
+            try:
+                return source[index]
+            except IndexError:
+                return None
+
+    else:
+
+        def from_list(source):
+            raise NotImplementedError
+
+    # string source
+    if not is_function:
+
+        def from_str(source):
+            raise ValidationError(
+                f"Invalid path {path_} has been supplied!"
+                "Path should contain function if source type is list"
+            )
+
+    elif func_name == "count":
+        from_str = len
+    else:
+
+        def from_str(source):
+            raise NotImplementedError
+
+    def accessor(source):
+        if isinstance(source, dict):
+            return from_dict(source)
+        elif isinstance(source, list):
+            return from_list(source)
+        elif isinstance(source, (bytes, str)):
+            return from_str(source)
+        raise NotImplementedError
+
+    return accessor
+
+
+@lru_cache(maxsize=1024)
+def compile_field_pattern(field: str):
+    """Regex of field (or its subfield) in description of profiled Lucene query,
+    ``*`` as root (search on all resources) matches any index field name."""
+    pattern = re.escape(field).replace(r"\*", r"[\w.]*")
+    subfields = "|".join(PROFILE_SUBFIELDS)
+    return re.compile(rf"(?<![\w.]){pattern}(?:\.(?:{subfields}))?(?![\w.])")
+
+
+@lru_cache(maxsize=1024)
+def compile_source_filter(fullpath: str) -> Tuple[Callable[[Any], Any], ...]:
+    """Compiles dotted source filter path into tuple of accessors"""
+    return tuple(compile_path_segment(path_) for path_ in fullpath.split("."))
 
 
 class ElasticsearchEngineBase(Engine):
+
+    # max number of worker threads, used to fetch (scroll) pages in background
+    executor_max_workers: int = 4
+    # unlimited (scroll) query is split into that number of slices
+    # those are drained concurrently, 1 means no slicing.
+    scroll_slices: int = 1
+    # use cursor (search_after) based pagination instead of from/size
+    # for searches, also could be enabled per request by ``_cursor`` param.
+    cursor_pagination: bool = False
+    # cursor based pagination is performed on point in time (consistent view)
+    use_point_in_time: bool = False
+    # max number of independent queries (i.e _include, _revinclude, _has)
+    # those are executed concurrently
+    query_concurrency: int = 4
+    # number of distinct references, collected by single page of
+    # composite aggregation (i.e for _has)
+    references_page_size: int = 1000
+    # max number of documents collected per shard by deadline bound query,
+    # None means unlimited
+    terminate_after: Optional[int] = None
+    # client side request timeout of deadline bound query is exceeding server
+    # side timeout by this margin (in seconds), so that partial result arrives
+    request_timeout_margin: float = 0.5
+    _executor: Optional[ThreadPoolExecutor] = None
+    _query_executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """Lazily created thread pool, owned by engine."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.executor_max_workers,
+                thread_name_prefix="fhirpath-es",
+            )
+        return self._executor
+
+    @property
+    def query_executor(self) -> ThreadPoolExecutor:
+        """Lazily created thread pool for whole queries, kept apart from
+        ``executor`` as each query might wait for its own page fetching."""
+        if self._query_executor is None:
+            self._query_executor = ThreadPoolExecutor(
+                max_workers=self.query_concurrency,
+                thread_name_prefix="fhirpath-es-query",
+            )
+        return self._query_executor
+
     def initial_bundle_data(self):
         """Can be overridden in sub class"""
         return BundleWrapper.init_data()
 
     def extract_hits(self, source_filters, hits, container, doc_type="_doc"):
         """ """
+        accessors = [compile_source_filter(fullpath) for fullpath in source_filters]
         for res in hits:
             if res["_type"] != doc_type:
                 continue
             row = EngineResultRow()
-            if len(source_filters) > 0:
-                for fullpath in source_filters:
+            if len(accessors) > 0:
+                for path_accessors in accessors:
                     source = res["_source"]
-                    for path_ in fullpath.split("."):
-                        source = self._traverse_for_value(source, path_)
+                    for accessor in path_accessors:
+                        source = accessor(source)
                         if source is None:
                             break
                     row.append(source)
@@ -91,14 +261,20 @@ class ElasticsearchEngineBase(Engine):
         return yarl.URL"""
         raise NotImplementedError
 
-    def wrapped_with_bundle(self, result, includes=None, as_json=False):
+    def wrapped_with_bundle(self, result, includes=None, as_json=False, as_bytes=False):
         """ """
         url = self.current_url()
         if includes is None:
             includes = list()
         init_data = self.initial_bundle_data()
         wrapper = BundleWrapper(
-            self, result, includes, url, "searchset", init_data=init_data
+            self,
+            result,
+            includes,
+            url,
+            "searchset",
+            init_data=init_data,
+            as_bytes=as_bytes,
         )
         return wrapper(as_json=as_json)
 
@@ -106,9 +282,15 @@ class ElasticsearchEngineBase(Engine):
         self,
         reference_analyzer: str = None,
         token_normalizer: str = None,
+        contains_analyzer: str = None,
+        reverse_analyzer: str = None,
     ):
         """
         You may use this function to build the ES mapping.
+        ``contains_analyzer``: n-gram analyzer (see ``contains_analysis_settings``)
+        of ``contains`` subfield of string fields, used by :contains modifier.
+        ``reverse_analyzer``: analyzer (see ``reverse_analysis_settings``)
+        of ``reverse`` subfield of string fields, used by eb operator.
         Returns an object like:
         {
             "Patient": {
@@ -151,7 +333,11 @@ class ElasticsearchEngineBase(Engine):
         elements_paths = build_elements_paths(resources_elements)
 
         fhir_es_mappings = fhir_types_mapping(
-            self.fhir_release.name, reference_analyzer, token_normalizer
+            self.fhir_release.name,
+            reference_analyzer,
+            token_normalizer,
+            contains_analyzer,
+            reverse_analyzer,
         )
         return {
             resource: {
@@ -162,70 +348,7 @@ class ElasticsearchEngineBase(Engine):
 
     def _traverse_for_value(self, source, path_):
         """Looks path_ is innocent string key, but may content expression, function."""
-        if isinstance(source, dict):
-            # xxx: validate path, not blindly sending None
-            if CONTAINS_INDEX_OR_FUNCTION.search(path_) and CONTAINS_FUNCTION.match(
-                path_
-            ):
-                raise ValidationError(
-                    f"Invalid path {path_} has been supllied!"
-                    "Path cannot contain function if source type is dict"
-                )
-            if CONTAINS_INDEX.match(path_):
-                return navigate_indexed_path(source, path_)
-            if path_ == "*":
-                # TODO check if we can have other keys than resource
-                return source[list(source.keys())[0]]
-
-            return source.get(path_, None)
-
-        elif isinstance(source, list):
-            if not CONTAINS_FUNCTION.match(path_):
-                raise ValidationError(
-                    f"Invalid path {path_} has been supllied!"
-                    "Path should contain function if source type is list"
-                )
-            parts = path_.split("(")
-            func_name = parts[0]
-            index = None
-            if len(parts[1]) > 1:
-                index = int(parts[1][:-1])
-            if func_name == "count":
-                return len(source)
-            elif func_name == "first":
-                return source[0]
-            elif func_name == "last":
-                return source[-1]
-            elif func_name == "Skip":
-                new_order = list()
-                for idx, no in enumerate(source):
-                    if idx == index:
-                        continue
-                    new_order.append(no)
-                return new_order
-            elif func_name == "Take":
-                try:
-                    return source[index]
-                except IndexError:
-                    return None
-            else:
-                raise NotImplementedError
-        elif isinstance(source, (bytes, str)):
-            if not CONTAINS_FUNCTION.match(path_):
-                raise ValidationError(
-                    f"Invalid path {path_} has been supplied!"
-                    "Path should contain function if source type is list"
-                )
-            parts = path_.split("(")
-            func_name = parts[0]
-            index = len(parts[1]) > 1 and int(parts[1][:-1]) or None
-            if func_name == "count":
-                return len(source)
-            else:
-                raise NotImplementedError
-
-        else:
-            raise NotImplementedError
+        return compile_path_segment(path_)(source)
 
     def _get_source_filters(self, selects):
         """ """
@@ -244,6 +367,289 @@ class ElasticsearchEngineBase(Engine):
             )
         return source_filters
 
+    def _compile(self, query, unrestricted):
+        """ """
+        query_copy = query.clone()
+
+        if unrestricted is False:
+            self.build_security_query(query_copy)
+
+        compiled = self.dialect.compile(
+            query_copy,
+            calculate_field_index_name=self.calculate_field_index_name,
+            get_mapping=self.get_mapping,
+        )
+        if query.get_limit().profile:
+            compiled = dict(compiled, profile=True)
+        return compiled
+
+    def _create_profile(self, query):
+        """Profile entries (without timings) of each where term in order,
+        the last one is for other clauses (i.e resource type or security
+        constraints)."""
+        root_replacers = [
+            self.calculate_field_index_name(from_clause[1].get_resource_type())
+            for from_clause in query.get_from()
+        ] or ["*"]
+        profile = list()
+        for index, term in enumerate(query.get_where()):
+            fields = list()
+            for root_replacer in root_replacers:
+                for field in self.dialect.get_term_paths(term, root_replacer):
+                    if field not in fields:
+                        fields.append(field)
+            profile.append(
+                {
+                    "index": index,
+                    "paths": self.dialect.get_term_paths(term),
+                    "fields": fields,
+                    "time_in_nanos": 0,
+                }
+            )
+        profile.append({"index": None, "paths": [], "fields": [], "time_in_nanos": 0})
+        return profile
+
+    def _add_profile(self, query, header, raw_result):
+        """Execution time of top level clauses of profiled query are summed up
+        (over shards and slices) per where term, clause is matched to the terms
+        by fields in its (Lucene) description. Merged clause is counted for
+        each term it contains."""
+        raw_profile = raw_result.get("profile")
+        if raw_profile is None:
+            return
+        if header.profile is None:
+            header.profile = self._create_profile(query)
+        patterns = [
+            [compile_field_pattern(field) for field in entry["fields"]]
+            for entry in header.profile
+        ]
+        for shard in raw_profile.get("shards", []):
+            for search in shard.get("searches", []):
+                for root in search.get("query", []):
+                    if root.get("type") == "BooleanQuery":
+                        nodes = root.get("children", [])
+                    else:
+                        nodes = [root]
+                    for node in nodes:
+                        description = node.get("description", "")
+                        matched = [
+                            entry
+                            for entry, patterns_ in zip(header.profile, patterns)
+                            if any(p.search(description) for p in patterns_)
+                        ] or [header.profile[-1]]
+                        for entry in matched:
+                            entry["time_in_nanos"] += node.get("time_in_nanos", 0)
+
+    def _get_remaining_time(self, deadline):
+        """Remaining time budget (in seconds), None if unbounded."""
+        if deadline is None:
+            return None
+        return deadline - time.monotonic()
+
+    def _get_request_timeout(self, deadline):
+        """Client side timeout of next request, None if unbounded.
+        Raises ``DeadlineExceeded`` if time budget has been spent."""
+        remaining = self._get_remaining_time(deadline)
+        if remaining is None:
+            return None
+        if remaining <= 0:
+            raise DeadlineExceeded("Search has exceeded its time budget.")
+        return remaining + self.request_timeout_margin
+
+    def _apply_deadline(self, compiled, deadline):
+        """Returns (compiled, request timeout), remaining time budget becomes
+        server side timeout of compiled query."""
+        request_timeout = self._get_request_timeout(deadline)
+        if request_timeout is None:
+            return compiled, None
+        remaining = request_timeout - self.request_timeout_margin
+        compiled = dict(compiled, timeout=f"{max(int(remaining * 1000), 1)}ms")
+        if self.terminate_after is not None:
+            compiled["terminate_after"] = self.terminate_after
+        return compiled, request_timeout
+
+    def _apply_batch_deadline(self, batch):
+        """Returns (batch, request timeout) of multi search, each query is bound
+        to its own time budget, whole request is bounded by the longest one."""
+        applied = list()
+        request_timeouts = list()
+        for index, query, compiled in batch:
+            compiled, request_timeout = self._apply_deadline(
+                compiled, query.get_limit().deadline
+            )
+            applied.append((index, query, compiled))
+            request_timeouts.append(request_timeout)
+        if None in request_timeouts:
+            return applied, None
+        return applied, max(request_timeouts)
+
+    def _is_deadline_exceeded(self, deadline):
+        """ """
+        remaining = self._get_remaining_time(deadline)
+        return remaining is not None and remaining <= 0
+
+    def _add_partial_flags(self, header, raw_result):
+        """Partial result of any (page) request makes whole result partial"""
+        if raw_result.get("timed_out", False) is True:
+            header.timed_out = True
+        if raw_result.get("terminated_early", False) is True:
+            header.terminated_early = True
+
+    def _use_sliced_scroll(self, query, compiled):
+        """Sliced scroll is only applicable for unlimited query without sort,
+        as order cannot be kept across slices."""
+        return (
+            self.scroll_slices > 1
+            and "scroll" in compiled
+            and len(query.get_sort()) == 0
+        )
+
+    def _create_sliced_queries(self, compiled):
+        """ """
+        return [
+            dict(compiled, slice={"id": id_, "max": self.scroll_slices})
+            for id_ in range(self.scroll_slices)
+        ]
+
+    def _requires_point_in_time(self, query):
+        """First page of cursor based pagination"""
+        limit = query.get_limit()
+        return (
+            self.use_point_in_time
+            and not limit.empty
+            and limit.search_after == []
+            and limit.point_in_time is None
+        )
+
+    def _get_next_cursor(self, query, raw_result):
+        """Returns cursor token for next page, None if it was last page."""
+        limit = query.get_limit()
+        if limit.empty or not limit.cursor:
+            return None
+        hits = raw_result["hits"]["hits"]
+        if len(hits) < limit.limit or "sort" not in hits[-1]:
+            return None
+        return encode_cursor(
+            hits[-1]["sort"], raw_result.get("pit_id", limit.point_in_time)
+        )
+
+    def _get_total(self, rawresult, query_type=EngineQueryType.DML):
+        """ """
+        if query_type == EngineQueryType.COUNT:
+            return rawresult["count"]
+        if "total" not in rawresult["hits"]:
+            # total hits are not tracked (_total=none)
+            return None
+        # let´s make some compatibilities
+        if isinstance(rawresult["hits"]["total"], dict):
+            return rawresult["hits"]["total"]["value"]
+        return rawresult["hits"]["total"]
+
+    def _has_more_hits(self, rawresult, consumed):
+        """Whether next scroll page could have hits. Total might be unknown
+        or only a lower bound (_total=none|estimate)."""
+        if len(rawresult["hits"]["hits"]) == 0:
+            return False
+        total = rawresult["hits"].get("total")
+        if isinstance(total, dict):
+            if total.get("relation", "eq") != "eq":
+                return True
+            total = total["value"]
+        return total is None or total > consumed
+
+    def _use_msearch(self, query):
+        """Scroll (unlimited query) and point in time are not supported by
+        multi search, decided before compiling so that other queries are
+        compiled only once (by ``execute``)."""
+        limit = query.get_limit()
+        return (
+            not limit.empty
+            and limit.point_in_time is None
+            and not self._requires_point_in_time(query)
+        )
+
+    def _create_msearch_result(self, query, compiled, raw_result):
+        """ """
+        result = self._create_page_result(
+            query,
+            compiled,
+            self._get_total(raw_result),
+            self._get_source_filters(query.get_select()),
+            raw_result,
+        )
+        result.header.next_cursor = self._get_next_cursor(query, raw_result)
+        return result
+
+    def _get_references_field(self, resource_type, path_parts):
+        """Returns keyword field of ``Reference.reference``, those could be
+        aggregated. None if there is no keyword field or path is crossing
+        nested mapping (composite aggregation cannot be nested)."""
+        mapping = self.get_mapping(resource_type)
+        for part in path_parts:
+            mapping = mapping.get("properties", {}).get(part)
+            if mapping is None or mapping.get("type") == "nested":
+                return None
+        reference = mapping.get("properties", {}).get("reference", {})
+        if "raw" not in reference.get("fields", {}):
+            return None
+        return ".".join(
+            [
+                self.calculate_field_index_name(resource_type),
+                *path_parts,
+                "reference",
+                "raw",
+            ]
+        )
+
+    def _create_references_query(self, query, search_param, unrestricted):
+        """Returns (compiled, target resource type) of distinct references
+        aggregation, no document is fetched. None if not applicable."""
+        resource_type, path_parts, target_type = parse_reference_expression(
+            search_param.expression
+        )
+        field = self._get_references_field(resource_type, path_parts)
+        if field is None:
+            return None
+        compiled = self._compile(query, unrestricted)
+        sources = [{"reference": {"terms": {"field": field}}}]
+        return {
+            "query": compiled["query"],
+            "size": 0,
+            "_source": False,
+            "track_total_hits": False,
+            "aggs": {
+                "references": {
+                    "composite": {"size": self.references_page_size, "sources": sources}
+                }
+            },
+        }, target_type
+
+    def _collect_references(self, raw_result, target_type, container):
+        """Adds (resource type, resource id) of aggregated references into
+        container, returns the key of next page or None if it was last page."""
+        aggregation = raw_result["aggregations"]["references"]
+        for bucket in aggregation["buckets"]:
+            parsed = parse_reference({"reference": bucket["key"]["reference"]})
+            if parsed is None:
+                continue
+            if target_type is not None and parsed[0] != target_type:
+                continue
+            container[parsed[0]][parsed[1]] = None
+        if len(aggregation["buckets"]) < self.references_page_size:
+            return None
+        return aggregation.get("after_key")
+
+    def _create_page_result(self, query, compiled, total, source_filters, raw_result):
+        """Single page of result, used by ``execute_iter``"""
+        result = EngineResult(
+            header=EngineResultHeader(total=total), body=EngineResultBody()
+        )
+        self._add_partial_flags(result.header, raw_result)
+        self._add_profile(query, result.header, raw_result)
+        self.extract_hits(source_filters, raw_result["hits"]["hits"], result.body)
+        self._add_result_headers(query, result, compiled)
+        return result
+
     def _add_result_headers(self, query, result, compiled):
         """ """
         # Process additional meta
@@ -274,77 +680,301 @@ class ElasticsearchEngineBase(Engine):
 class ElasticsearchEngine(ElasticsearchEngineBase):
     """Elasticsearch Engine"""
 
-    def _execute(self, query, unrestricted, query_type):
+    def _fetch(self, compiled, query_type, request_timeout=None):
         """ """
-        query_copy = query.clone()
-
-        if unrestricted is False:
-            self.build_security_query(query_copy)
-
-        compiled = self.dialect.compile(
-            query_copy,
-            calculate_field_index_name=self.calculate_field_index_name,
-            get_mapping=self.get_mapping,
-        )
         if query_type == EngineQueryType.DML:
-            raw_result = self.connection.fetch(self.get_index_name(), compiled)
+            raw_result = self.connection.fetch(
+                self.get_index_name(), compiled, request_timeout=request_timeout
+            )
         elif query_type == EngineQueryType.COUNT:
-            raw_result = self.connection.count(self.get_index_name(), compiled)
+            raw_result = self.connection.count(
+                self.get_index_name(), compiled, request_timeout=request_timeout
+            )
         else:
             raise NotImplementedError
 
-        return raw_result, compiled
+        return raw_result
+
+    def _execute(self, query, unrestricted, query_type):
+        """ """
+        compiled, request_timeout = self._apply_deadline(
+            self._compile(query, unrestricted), query.get_limit().deadline
+        )
+        return self._fetch(compiled, query_type, request_timeout), compiled
 
     def execute(self, query, unrestricted=False, query_type=EngineQueryType.DML):
         """ """
-        raw_result, compiled = self._execute(query, unrestricted, query_type)
+        deadline = query.get_limit().deadline
+        if query_type == EngineQueryType.DML and self._requires_point_in_time(query):
+            query = query.clone()
+            query.get_limit().point_in_time = self.connection.open_point_in_time(
+                self.get_index_name()
+            )
+        compiled, request_timeout = self._apply_deadline(
+            self._compile(query, unrestricted), deadline
+        )
         selects = query.get_select()
-        # xxx: process result
-        result = self.process_raw_result(raw_result, selects, query_type)
+        if query_type == EngineQueryType.DML and self._use_sliced_scroll(
+            query, compiled
+        ):
+            source_filters = self._get_source_filters(selects)
+            result = EngineResult(
+                header=EngineResultHeader(total=0), body=EngineResultBody()
+            )
+            for total, raw_result in self._iter_sliced_scroll(compiled, deadline):
+                result.header.total = total
+                self._add_partial_flags(result.header, raw_result)
+                self._add_profile(query, result.header, raw_result)
+                self.extract_hits(
+                    source_filters, raw_result["hits"]["hits"], result.body
+                )
+        else:
+            raw_result = self._fetch(compiled, query_type, request_timeout)
+            # xxx: process result
+            result = self.process_raw_result(raw_result, selects, query_type, deadline)
+            self._add_profile(query, result.header, raw_result)
+
+            if query_type == EngineQueryType.DML:
+                result.header.next_cursor = self._get_next_cursor(query, raw_result)
+                if result.header.next_cursor is None and "pit_id" in raw_result:
+                    # last page
+                    self.connection.close_point_in_time(raw_result["pit_id"])
 
         # Process additional meta
         self._add_result_headers(query, result, compiled)
         return result
 
-    def process_raw_result(self, rawresult, selects, query_type):
+    def execute_many(self, queries, unrestricted=False):
+        """Executes several queries, results are in order of queries.
+        Those could be batched are sent by single _msearch request,
+        others (i.e unlimited/scroll) are executed concurrently
+        on ``query_executor``."""
+        results: List[Optional[EngineResult]] = [None] * len(queries)
+        batch = list()
+        futures = dict()
+        for index, query in enumerate(queries):
+            if self._use_msearch(query):
+                batch.append((index, query, self._compile(query, unrestricted)))
+            else:
+                futures[index] = self.query_executor.submit(
+                    self.execute, query, unrestricted
+                )
+        if len(batch) > 0:
+            batch, request_timeout = self._apply_batch_deadline(batch)
+            raw_results = self.connection.msearch(
+                self.get_index_name(),
+                [compiled for _, _, compiled in batch],
+                request_timeout=request_timeout,
+            )
+            for (index, query, compiled), raw_result in zip(batch, raw_results):
+                results[index] = self._create_msearch_result(
+                    query, compiled, raw_result
+                )
+        for index, future in futures.items():
+            results[index] = future.result()
+        return results
+
+    def execute_references(self, query, search_param, unrestricted=False):
+        """Returns distinct references (``{"Patient": ["ids"]}``) of reference
+        search parameter from all documents matched by query, pages of composite
+        aggregation are fetched until exhausted. None if references cannot be
+        aggregated, caller should extract those from fetched resources."""
+        references_query = self._create_references_query(
+            query, search_param, unrestricted
+        )
+        if references_query is None:
+            return None
+        compiled, target_type = references_query
+        deadline = query.get_limit().deadline
+        # ordered set of IDs per resource type
+        ids: Dict = defaultdict(dict)
+        while True:
+            # partial references cannot be used, each page must be completed
+            raw_result = self.connection.fetch(
+                self.get_index_name(),
+                compiled,
+                request_timeout=self._get_request_timeout(deadline),
+            )
+            after_key = self._collect_references(raw_result, target_type, ids)
+            if after_key is None:
+                break
+            compiled["aggs"]["references"]["composite"]["after"] = after_key
+        return {resource_type: list(ids_) for resource_type, ids_ in ids.items()}
+
+    def execute_iter(self, query, unrestricted=False):
+        """Streaming version of ``execute``, yields ``EngineResult`` page by page
+        (header's total is always the total of whole result), so memory usage
+        is bounded to single page. Next page is fetched in background while
+        caller is still consuming current page.
+        Cursor based (search_after) query is a single page, it is executed by
+        ``execute`` so that point in time and next cursor are handled."""
+        if query.get_limit().cursor:
+            yield self.execute(query, unrestricted)
+            return
+        deadline = query.get_limit().deadline
+        compiled, request_timeout = self._apply_deadline(
+            self._compile(query, unrestricted), deadline
+        )
+        if self._use_sliced_scroll(query, compiled):
+            raw_pages = self._iter_sliced_scroll(compiled, deadline)
+        else:
+            raw_pages = self._iter_scroll(
+                self._fetch(compiled, EngineQueryType.DML, request_timeout), deadline
+            )
+        source_filters = self._get_source_filters(query.get_select())
+        try:
+            for total, raw_result in raw_pages:
+                yield self._create_page_result(
+                    query, compiled, total, source_filters, raw_result
+                )
+        finally:
+            raw_pages.close()
+
+    def _iter_scroll(self, raw_result, deadline=None):
+        """Yields (total, raw result) of each page, next page is prefetched.
+        Page is flagged as timed out, if time budget has been spent before
+        all pages are fetched."""
+        total = self._get_total(raw_result)
+        scroll_id = raw_result.get("_scroll_id", None)
+        consumed = 0
+        future = None
+        try:
+            while True:
+                consumed += len(raw_result["hits"]["hits"])
+                if scroll_id is not None and self._has_more_hits(raw_result, consumed):
+                    if self._is_deadline_exceeded(deadline):
+                        raw_result = dict(raw_result, timed_out=True)
+                    else:
+                        # prefetch next page
+                        future = self.executor.submit(
+                            self.connection.scroll,
+                            scroll_id,
+                            request_timeout=self._get_request_timeout(deadline),
+                        )
+
+                yield total, raw_result
+                if future is None:
+                    break
+
+                raw_result = future.result()
+                future = None
+                scroll_id = raw_result.get("_scroll_id", scroll_id)
+                if len(raw_result["hits"]["hits"]) == 0:
+                    break
+        finally:
+            if future is not None and not future.cancel():
+                # consumer has stopped in the middle, let pending request finish
+                wait([future])
+            if scroll_id is not None:
+                self.connection.clear_scroll(scroll_id)
+
+    def _iter_sliced_scroll(self, compiled, deadline=None):
+        """Drains all slices of sliced scroll concurrently on thread pool.
+        Yields (total, raw result) of each page in order of arrival."""
+        pending = {
+            self.executor.submit(
+                self.connection.fetch,
+                self.get_index_name(),
+                sliced,
+                request_timeout=self._get_request_timeout(deadline),
+            ): id_
+            for id_, sliced in enumerate(self._create_sliced_queries(compiled))
+        }
+        scroll_ids: Dict[int, str] = dict()
+        consumed: Dict[int, int] = defaultdict(int)
+        try:
+            # total is known after first page of every slice has been arrived
+            wait(pending)
+            ready = [(pending.pop(future), future.result()) for future in list(pending)]
+            total = sum(self._get_total(raw_result) for _, raw_result in ready)
+            while True:
+                for index, (id_, raw_result) in enumerate(ready):
+                    if "_scroll_id" in raw_result:
+                        scroll_ids[id_] = raw_result["_scroll_id"]
+                    consumed[id_] += len(raw_result["hits"]["hits"])
+                    if id_ not in scroll_ids or not self._has_more_hits(
+                        raw_result, consumed[id_]
+                    ):
+                        continue
+                    if self._is_deadline_exceeded(deadline):
+                        ready[index] = (id_, dict(raw_result, timed_out=True))
+                        continue
+                    # prefetch next page of this slice
+                    future = self.executor.submit(
+                        self.connection.scroll,
+                        scroll_ids[id_],
+                        request_timeout=self._get_request_timeout(deadline),
+                    )
+                    pending[future] = id_
+
+                for _, raw_result in ready:
+                    yield total, raw_result
+
+                if len(pending) == 0:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                ready = [(pending.pop(future), future.result()) for future in done]
+        finally:
+            for future in pending:
+                if not future.cancel():
+                    wait([future])
+                    # scroll context of slice's first page must be released
+                    if future.exception() is None:
+                        scroll_id = future.result().get("_scroll_id")
+                        if scroll_id is not None:
+                            scroll_ids.setdefault(pending[future], scroll_id)
+            for scroll_id in scroll_ids.values():
+                self.connection.clear_scroll(scroll_id)
+
+    def process_raw_result(self, rawresult, selects, query_type, deadline=None):
         """ """
+        total = self._get_total(rawresult, query_type)
         if query_type == EngineQueryType.COUNT:
-            total = rawresult["count"]
             source_filters = []
-        # let´s make some compatibilities
-        elif isinstance(rawresult["hits"]["total"], dict):
-            total = rawresult["hits"]["total"]["value"]
-            source_filters = self._get_source_filters(selects)
         else:
-            total = rawresult["hits"]["total"]
             source_filters = self._get_source_filters(selects)
 
         result = EngineResult(
             header=EngineResultHeader(total=total), body=EngineResultBody()
         )
+        self._add_partial_flags(result.header, rawresult)
 
         # extract primary data
         if query_type != EngineQueryType.COUNT:
             self.extract_hits(source_filters, rawresult["hits"]["hits"], result.body)
 
-        if "_scroll_id" in rawresult and result.header.total > len(
-            rawresult["hits"]["hits"]
-        ):
-            # we need to fetch all!
-            consumed = len(rawresult["hits"]["hits"])
-
-            while result.header.total > consumed:
-                # xxx: dont know yet, if from_, size is better solution
-                raw_res = self.connection.scroll(rawresult["_scroll_id"])
-                if len(raw_res["hits"]["hits"]) == 0:
-                    break
-
-                self.extract_hits(source_filters, raw_res["hits"]["hits"], result.body)
-
-                consumed += len(raw_res["hits"]["hits"])
-
-                if result.header.total <= consumed:
-                    break
+        try:
+            if "_scroll_id" in rawresult and result.header.total > len(
+                rawresult["hits"]["hits"]
+            ):
+                # we need to fetch all!
+                consumed = len(rawresult["hits"]["hits"])
+
+                while result.header.total > consumed:
+                    if self._is_deadline_exceeded(deadline):
+                        # time budget has been spent, result is partial
+                        result.header.timed_out = True
+                        break
+                    # xxx: dont know yet, if from_, size is better solution
+                    raw_res = self.connection.scroll(
+                        rawresult["_scroll_id"],
+                        request_timeout=self._get_request_timeout(deadline),
+                    )
+                    self._add_partial_flags(result.header, raw_res)
+                    if len(raw_res["hits"]["hits"]) == 0:
+                        break
+
+                    self.extract_hits(
+                        source_filters, raw_res["hits"]["hits"], result.body
+                    )
+
+                    consumed += len(raw_res["hits"]["hits"])
+
+                    if result.header.total <= consumed:
+                        break
+        finally:
+            if "_scroll_id" in rawresult:
+                self.connection.clear_scroll(rawresult["_scroll_id"])
 
         return result
 
@@ -357,76 +987,316 @@ class AsyncElasticsearchEngine(ElasticsearchEngineBase):
     def is_async(cls):
         return True
 
-    async def _execute(self, query, unrestricted, query_type):
+    async def _fetch(self, compiled, query_type, request_timeout=None):
         """ """
-        query_copy = query.clone()
-
-        if unrestricted is False:
-            self.build_security_query(query_copy)
-
-        compiled = self.dialect.compile(
-            query_copy,
-            calculate_field_index_name=self.calculate_field_index_name,
-            get_mapping=self.get_mapping,
-        )
         if query_type == EngineQueryType.DML:
-            raw_result = await self.connection.fetch(self.get_index_name(), compiled)
+            raw_result = await self.connection.fetch(
+                self.get_index_name(), compiled, request_timeout=request_timeout
+            )
         elif query_type == EngineQueryType.COUNT:
-            raw_result = await self.connection.count(self.get_index_name(), compiled)
+            raw_result = await self.connection.count(
+                self.get_index_name(), compiled, request_timeout=request_timeout
+            )
         else:
             raise NotImplementedError
 
-        return raw_result, compiled
+        return raw_result
+
+    async def _execute(self, query, unrestricted, query_type):
+        """ """
+        compiled, request_timeout = self._apply_deadline(
+            self._compile(query, unrestricted), query.get_limit().deadline
+        )
+        return await self._fetch(compiled, query_type, request_timeout), compiled
 
     async def execute(self, query, unrestricted=False, query_type=EngineQueryType.DML):
         """ """
-        raw_result, compiled = await self._execute(query, unrestricted, query_type)
+        deadline = query.get_limit().deadline
+        if query_type == EngineQueryType.DML and self._requires_point_in_time(query):
+            query = query.clone()
+            query.get_limit().point_in_time = await self.connection.open_point_in_time(
+                self.get_index_name()
+            )
+        compiled, request_timeout = self._apply_deadline(
+            self._compile(query, unrestricted), deadline
+        )
         selects = query.get_select()
-        # xxx: process result
-        result = await self.process_raw_result(raw_result, selects, query_type)
+        if query_type == EngineQueryType.DML and self._use_sliced_scroll(
+            query, compiled
+        ):
+            source_filters = self._get_source_filters(selects)
+            result = EngineResult(
+                header=EngineResultHeader(total=0), body=EngineResultBody()
+            )
+            async for total, raw_result in self._iter_sliced_scroll(compiled, deadline):
+                result.header.total = total
+                self._add_partial_flags(result.header, raw_result)
+                self._add_profile(query, result.header, raw_result)
+                self.extract_hits(
+                    source_filters, raw_result["hits"]["hits"], result.body
+                )
+        else:
+            raw_result = await self._fetch(compiled, query_type, request_timeout)
+            # xxx: process result
+            result = await self.process_raw_result(
+                raw_result, selects, query_type, deadline
+            )
+            self._add_profile(query, result.header, raw_result)
+
+            if query_type == EngineQueryType.DML:
+                result.header.next_cursor = self._get_next_cursor(query, raw_result)
+                if result.header.next_cursor is None and "pit_id" in raw_result:
+                    # last page
+                    await self.connection.close_point_in_time(raw_result["pit_id"])
 
         # Process additional meta
         self._add_result_headers(query, result, compiled)
         return result
 
-    async def process_raw_result(self, rawresult, selects, query_type):
+    async def execute_many(self, queries, unrestricted=False):
+        """Executes several queries, results are in order of queries.
+        Those could be batched are sent by single _msearch request,
+        others (i.e unlimited/scroll) are executed concurrently,
+        at most ``query_concurrency`` at a time."""
+        results: List[Optional[EngineResult]] = [None] * len(queries)
+        batch = list()
+        pending = dict()
+        semaphore = asyncio.Semaphore(self.query_concurrency)
+
+        async def execute(query):
+            async with semaphore:
+                return await self.execute(query, unrestricted)
+
+        for index, query in enumerate(queries):
+            if self._use_msearch(query):
+                batch.append((index, query, self._compile(query, unrestricted)))
+            else:
+                pending[index] = execute(query)
+
+        async def execute_batch():
+            applied, request_timeout = self._apply_batch_deadline(batch)
+            raw_results = await self.connection.msearch(
+                self.get_index_name(),
+                [compiled for _, _, compiled in applied],
+                request_timeout=request_timeout,
+            )
+            for (index, query, compiled), raw_result in zip(applied, raw_results):
+                results[index] = self._create_msearch_result(
+                    query, compiled, raw_result
+                )
+
+        coroutines = list(pending.values())
+        if len(batch) > 0:
+            coroutines.append(execute_batch())
+        for index, result in zip(pending, await asyncio.gather(*coroutines)):
+            results[index] = result
+        return results
+
+    async def execute_references(self, query, search_param, unrestricted=False):
+        """ """
+        references_query = self._create_references_query(
+            query, search_param, unrestricted
+        )
+        if references_query is None:
+            return None
+        compiled, target_type = references_query
+        deadline = query.get_limit().deadline
+        ids: Dict = defaultdict(dict)
+        while True:
+            raw_result = await self.connection.fetch(
+                self.get_index_name(),
+                compiled,
+                request_timeout=self._get_request_timeout(deadline),
+            )
+            after_key = self._collect_references(raw_result, target_type, ids)
+            if after_key is None:
+                break
+            compiled["aggs"]["references"]["composite"]["after"] = after_key
+        return {resource_type: list(ids_) for resource_type, ids_ in ids.items()}
+
+    async def execute_iter(self, query, unrestricted=False):
+        """Async streaming version of ``execute``, yields ``EngineResult`` page
+        by page, next page is fetched concurrently while caller is still
+        consuming current page.
+        Cursor based (search_after) query is a single page, it is executed by
+        ``execute`` so that point in time and next cursor are handled."""
+        if query.get_limit().cursor:
+            yield await self.execute(query, unrestricted)
+            return
+        deadline = query.get_limit().deadline
+        compiled, request_timeout = self._apply_deadline(
+            self._compile(query, unrestricted), deadline
+        )
+        if self._use_sliced_scroll(query, compiled):
+            raw_pages = self._iter_sliced_scroll(compiled, deadline)
+        else:
+            raw_pages = self._iter_scroll(
+                await self._fetch(compiled, EngineQueryType.DML, request_timeout),
+                deadline,
+            )
+        source_filters = self._get_source_filters(query.get_select())
+        try:
+            async for total, raw_result in raw_pages:
+                yield self._create_page_result(
+                    query, compiled, total, source_filters, raw_result
+                )
+        finally:
+            await raw_pages.aclose()
+
+    async def _iter_scroll(self, raw_result, deadline=None):
+        """Yields (total, raw result) of each page, next page is prefetched.
+        Pending page is cancelled and scroll is cleared, also when consuming
+        task has been cancelled."""
+        total = self._get_total(raw_result)
+        scroll_id = raw_result.get("_scroll_id", None)
+        consumed = 0
+        task = None
+        try:
+            while True:
+                consumed += len(raw_result["hits"]["hits"])
+                if scroll_id is not None and self._has_more_hits(raw_result, consumed):
+                    if self._is_deadline_exceeded(deadline):
+                        raw_result = dict(raw_result, timed_out=True)
+                    else:
+                        # prefetch next page
+                        task = asyncio.ensure_future(
+                            self.connection.scroll(
+                                scroll_id,
+                                request_timeout=self._get_request_timeout(deadline),
+                            )
+                        )
+
+                yield total, raw_result
+                if task is None:
+                    break
+
+                raw_result = await task
+                task = None
+                scroll_id = raw_result.get("_scroll_id", scroll_id)
+                if len(raw_result["hits"]["hits"]) == 0:
+                    break
+        finally:
+            if task is not None:
+                task.cancel()
+            if scroll_id is not None:
+                await self.connection.clear_scroll(scroll_id)
+
+    async def _iter_sliced_scroll(self, compiled, deadline=None):
+        """Drains all slices of sliced scroll concurrently.
+        Yields (total, raw result) of each page in order of arrival."""
+        request_timeout = self._get_request_timeout(deadline)
+        first_pages = [
+            asyncio.ensure_future(
+                self.connection.fetch(
+                    self.get_index_name(), sliced, request_timeout=request_timeout
+                )
+            )
+            for sliced in self._create_sliced_queries(compiled)
+        ]
+        try:
+            raw_results = await asyncio.gather(*first_pages)
+        except BaseException:
+            # failed or cancelled, scroll contexts of arrived pages are released
+            for task in first_pages:
+                task.cancel()
+            for task in first_pages:
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    scroll_id = task.result().get("_scroll_id")
+                    if scroll_id is not None:
+                        await self.connection.clear_scroll(scroll_id)
+            raise
+        # total is known after first page of every slice has been arrived
+        total = sum(self._get_total(raw_result) for raw_result in raw_results)
+        ready = list(enumerate(raw_results))
+        pending: Dict[asyncio.Future, int] = dict()
+        scroll_ids: Dict[int, str] = dict()
+        consumed: Dict[int, int] = defaultdict(int)
+        try:
+            while True:
+                for index, (id_, raw_result) in enumerate(ready):
+                    if "_scroll_id" in raw_result:
+                        scroll_ids[id_] = raw_result["_scroll_id"]
+                    consumed[id_] += len(raw_result["hits"]["hits"])
+                    if id_ not in scroll_ids or not self._has_more_hits(
+                        raw_result, consumed[id_]
+                    ):
+                        continue
+                    if self._is_deadline_exceeded(deadline):
+                        ready[index] = (id_, dict(raw_result, timed_out=True))
+                        continue
+                    # prefetch next page of this slice
+                    task = asyncio.ensure_future(
+                        self.connection.scroll(
+                            scroll_ids[id_],
+                            request_timeout=self._get_request_timeout(deadline),
+                        )
+                    )
+                    pending[task] = id_
+
+                for _, raw_result in ready:
+                    yield total, raw_result
+
+                if len(pending) == 0:
+                    break
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                ready = [(pending.pop(task), task.result()) for task in done]
+        finally:
+            for task in pending:
+                task.cancel()
+            for scroll_id in scroll_ids.values():
+                await self.connection.clear_scroll(scroll_id)
+
+    async def process_raw_result(self, rawresult, selects, query_type, deadline=None):
         """ """
+        total = self._get_total(rawresult, query_type)
         if query_type == EngineQueryType.COUNT:
-            total = rawresult["count"]
             source_filters = []
-        # let´s make some compatibilities
-        elif isinstance(rawresult["hits"]["total"], dict):
-            total = rawresult["hits"]["total"]["value"]
-            source_filters = self._get_source_filters(selects)
         else:
-            total = rawresult["hits"]["total"]
             source_filters = self._get_source_filters(selects)
 
         result = EngineResult(
             header=EngineResultHeader(total=total), body=EngineResultBody()
         )
+        self._add_partial_flags(result.header, rawresult)
 
         # extract primary data
         if query_type != EngineQueryType.COUNT:
             self.extract_hits(source_filters, rawresult["hits"]["hits"], result.body)
 
-        if "_scroll_id" in rawresult and result.header.total > len(
-            rawresult["hits"]["hits"]
-        ):
-            # we need to fetch all!
-            consumed = len(rawresult["hits"]["hits"])
-
-            while result.header.total > consumed:
-                # xxx: dont know yet, if from_, size is better solution
-                raw_res = await self.connection.scroll(rawresult["_scroll_id"])
-                if len(raw_res["hits"]["hits"]) == 0:
-                    break
-
-                self.extract_hits(source_filters, raw_res["hits"]["hits"], result.body)
-
-                consumed += len(raw_res["hits"]["hits"])
-
-                if result.header.total <= consumed:
-                    break
+        try:
+            if "_scroll_id" in rawresult and result.header.total > len(
+                rawresult["hits"]["hits"]
+            ):
+                # we need to fetch all!
+                consumed = len(rawresult["hits"]["hits"])
+
+                while result.header.total > consumed:
+                    if self._is_deadline_exceeded(deadline):
+                        # time budget has been spent, result is partial
+                        result.header.timed_out = True
+                        break
+                    # xxx: dont know yet, if from_, size is better solution
+                    raw_res = await self.connection.scroll(
+                        rawresult["_scroll_id"],
+                        request_timeout=self._get_request_timeout(deadline),
+                    )
+                    self._add_partial_flags(result.header, raw_res)
+                    if len(raw_res["hits"]["hits"]) == 0:
+                        break
+
+                    self.extract_hits(
+                        source_filters, raw_res["hits"]["hits"], result.body
+                    )
+
+                    consumed += len(raw_res["hits"]["hits"])
+
+                    if result.header.total <= consumed:
+                        break
+        finally:
+            # also when task has been cancelled, scroll context is released
+            if "_scroll_id" in rawresult:
+                await self.connection.clear_scroll(rawresult["_scroll_id"])
 
         return result
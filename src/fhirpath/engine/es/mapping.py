@@ -1,6 +1,7 @@
 import logging
 from collections import defaultdict
 
+from fhirpath.dialects.elasticsearch import CONTAINS_NGRAM_SIZE
 from fhirpath.enums import FHIR_VERSION
 
 ignored_datatype = [
@@ -118,10 +119,49 @@ def create_resource_mapping(elements_paths_def, fhir_es_mappings):
     return mapped
 
 
+def contains_analysis_settings(analyzer_name="fhir_contains_analyzer"):
+    """Index analysis settings of n-gram analyzer for ``contains_analyzer``,
+    i.e. ``settings["analysis"].update(contains_analysis_settings())``.
+    Text is lowercased and ascii folded, as FHIR string search is."""
+    tokenizer_name = f"{analyzer_name}_tokenizer"
+    return {
+        "analyzer": {
+            analyzer_name: {
+                "tokenizer": tokenizer_name,
+                "filter": ["lowercase", "asciifolding"],
+            }
+        },
+        "tokenizer": {
+            tokenizer_name: {
+                "type": "ngram",
+                "min_gram": CONTAINS_NGRAM_SIZE,
+                "max_gram": CONTAINS_NGRAM_SIZE,
+                # whitespaces are kept, value could span over words
+                "token_chars": [],
+            }
+        },
+    }
+
+
+def reverse_analysis_settings(analyzer_name="fhir_reverse_analyzer"):
+    """Index analysis settings of analyzer for ``reverse_analyzer``,
+    i.e. ``settings["analysis"]["analyzer"].update(reverse_analysis_settings())``.
+    Whole text is kept as single token and reversed. It is not lowercased,
+    as ``eb`` prefix query value is not analyzed by Elasticsearch."""
+    return {
+        analyzer_name: {
+            "tokenizer": "keyword",
+            "filter": ["reverse"],
+        }
+    }
+
+
 def fhir_types_mapping(
     fhir_release: str,
     reference_analyzer=None,
     token_normalizer=None,
+    contains_analyzer=None,
+    reverse_analyzer=None,
 ):
     Boolean = {"type": "boolean", "store": False}
     Float = {"type": "float", "store": False}
@@ -138,10 +178,17 @@ def fhir_types_mapping(
     if token_normalizer:
         Token.update({"normalizer": token_normalizer})
 
+    # string elements of complex types
+    StringToken = {**Token, "fields": {**Token["fields"]}}
+
     ReferenceToken = {
         "type": "text",
         "index": True,
         "store": False,
+        "fields": {
+            # distinct references could be aggregated (i.e for _has)
+            "raw": {"type": "keyword"}
+        },
     }
     if reference_analyzer:
         ReferenceToken.update({"analyzer": reference_analyzer})
@@ -155,6 +202,16 @@ def fhir_types_mapping(
             "raw": {"type": "keyword"},
         },
     }
+    if contains_analyzer:
+        # n-grams are looked up for :contains modifier, instead of regexp
+        Contains = {"type": "text", "analyzer": contains_analyzer}
+        Text["fields"]["contains"] = Contains
+        StringToken["fields"]["contains"] = Contains
+    if reverse_analyzer:
+        # reversed text, :eb modifier becomes prefix query, instead of wildcard
+        Reverse = {"type": "text", "analyzer": reverse_analyzer}
+        Text["fields"]["reverse"] = Reverse
+        StringToken["fields"]["reverse"] = Reverse
 
     SearchableText = {
         "type": "text",
@@ -209,20 +266,20 @@ def fhir_types_mapping(
     Age = Quantity
     Address = {
         "properties": {
-            "city": Token,
-            "country": Token,
-            "postalCode": Token,
-            "state": Token,
+            "city": StringToken,
+            "country": StringToken,
+            "postalCode": StringToken,
+            "state": StringToken,
             "use": Token,
         }
     }
 
     HumanName = {
         "properties": {
-            "family": Token,
+            "family": StringToken,
             "text": Text,
-            "prefix": Token,
-            "given": Token,
+            "prefix": StringToken,
+            "given": StringToken,
             "use": Token,
             "period": Period,
         },
@@ -30,6 +30,29 @@ class SortOrderType(enum.Enum):
     DESC: str = "desc"
 
 
+@enum.unique
+class TotalType(enum.Enum):
+    """https://www.hl7.org/fhir/search.html#total"""
+
+    NONE: str = "none"
+    ESTIMATE: str = "estimate"
+    ACCURATE: str = "accurate"
+
+
+@enum.unique
+class MaterializationType(enum.Enum):
+    """How resources are returned while iterating over query result"""
+
+    # python dict as stored
+    DICT: str = "dict"
+    # fully validated model (default)
+    VALIDATED: str = "validated"
+    # trusted model, constructed without validation
+    CONSTRUCT: str = "construct"
+    # model is validated on first attribute access
+    LAZY: str = "lazy"
+
+
 @enum.unique
 class MatchType(enum.Enum):
     """ """
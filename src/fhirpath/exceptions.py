@@ -18,3 +18,7 @@ class MultipleResultsFound(Invalid):
 
 class NoResultFound(Invalid):
     """ """
+
+
+class DeadlineExceeded(Invalid):
+    """ """
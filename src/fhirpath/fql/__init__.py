@@ -9,6 +9,7 @@ from .expressions import (
     eb_,
     exact_,
     exists_,
+    ids_,
     in_,
     not_,
     not_exists_,
@@ -30,6 +31,7 @@ __all__ = [
     "not_",
     "not_exists_",
     "in_",
+    "ids_",
     "not_in_",
     "or_",
     "sort_",
@@ -8,6 +8,7 @@ from .types import (
     ExistsGroupTerm,
     ExistsTerm,
     GroupTerm,
+    IdsTerm,
     InTerm,
     NonFhirTerm,
     SortTerm,
@@ -29,6 +30,7 @@ __all__ = [
     "xor_",
     "not_",
     "in_",
+    "ids_",
     "sort_",
     "fql",
 ]
@@ -148,6 +150,13 @@ def not_in_(path, values):
     return not_(in_(path, values))
 
 
+def ids_(path, values):
+    """Single term for any of IDs (or references) values"""
+    term = IdsTerm(path, values)
+    term.unary_operator = OPERATOR.pos
+    return term
+
+
 def sa_(path, value=EMPTY_VALUE):
     """ """
     term_or_group = _prepare_term_or_group(path, value)
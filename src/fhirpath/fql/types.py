@@ -20,6 +20,7 @@ from fhirpath.enums import (
     MatchType,
     SortOrderType,
     TermMatchType,
+    TotalType,
     WhereConstraintType,
 )
 from fhirpath.exceptions import ValidationError
@@ -31,6 +32,7 @@ from fhirpath.interfaces.fql import (
     IExistsTerm,
     IFqlClause,
     IGroupTerm,
+    IIdsTerm,
     IInTerm,
     INonFhirTerm,
     IPathConstraint,
@@ -103,12 +105,25 @@ class SortClause(FqlClause):
 class LimitClause(ABC):
     """ """
 
-    __slots__ = ("_limit", "_offset")
+    __slots__ = (
+        "_limit",
+        "_offset",
+        "_search_after",
+        "_point_in_time",
+        "_total",
+        "_deadline",
+        "_profile",
+    )
 
     def __init__(self):
         """ """
         object.__setattr__(self, "_limit", None)
         object.__setattr__(self, "_offset", None)
+        object.__setattr__(self, "_search_after", None)
+        object.__setattr__(self, "_point_in_time", None)
+        object.__setattr__(self, "_total", None)
+        object.__setattr__(self, "_deadline", None)
+        object.__setattr__(self, "_profile", False)
 
     def _get_limit(self):
         """ """
@@ -130,6 +145,73 @@ class LimitClause(ABC):
 
     offset = property(_get_offset, _set_offset)
 
+    def _get_search_after(self):
+        """ """
+        return self._search_after
+
+    def _set_search_after(self, value):
+        """ """
+        if value is not None:
+            value = list(value)
+        self._search_after = value
+
+    # sort values of last hit from previous page, empty list means first page
+    # of cursor based pagination
+    search_after = property(_get_search_after, _set_search_after)
+
+    def _get_point_in_time(self):
+        """ """
+        return self._point_in_time
+
+    def _set_point_in_time(self, value):
+        """ """
+        self._point_in_time = value
+
+    point_in_time = property(_get_point_in_time, _set_point_in_time)
+
+    def _get_total(self):
+        """ """
+        return self._total
+
+    def _set_total(self, value):
+        """ """
+        if value is not None:
+            value = TotalType(value)
+        self._total = value
+
+    # how accurate total hits should be calculated, None means engine's default
+    total = property(_get_total, _set_total)
+
+    def _get_deadline(self):
+        """ """
+        return self._deadline
+
+    def _set_deadline(self, value):
+        """ """
+        if value is not None:
+            value = float(value)
+        self._deadline = value
+
+    # absolute time (``time.monotonic``) until the query must be finished,
+    # None means unbounded
+    deadline = property(_get_deadline, _set_deadline)
+
+    def _get_profile(self):
+        """ """
+        return self._profile
+
+    def _set_profile(self, value):
+        """ """
+        self._profile = bool(value)
+
+    # engine collects execution timings of each where term
+    profile = property(_get_profile, _set_profile)
+
+    @property
+    def cursor(self):
+        """Cursor based (search_after) pagination is enabled"""
+        return self._search_after is not None
+
     @property
     def empty(self):
         """ """
@@ -631,6 +713,78 @@ class ExistsTerm(object):
         return self.__copy__()
 
 
+@implementer_only(IIdsTerm)
+class IdsTerm(object):
+    """Matches any of (large number of) IDs or references. Unlike InTerm,
+    values are not wrapped/validated one by one, so that the whole list
+    could be compiled to a single query."""
+
+    def __init__(self, path, values):
+        """ """
+        # flag
+        self._finalized = False
+        # +,- (negative, positive)
+        self.unary_operator = None
+
+        if isinstance(path, str):
+            self.path = ElementPath.from_el_path(path)
+        else:
+            self.path = path
+
+        IElementPath(self.path)
+        self.values = list(values)
+
+    def finalize(self, context):
+        """ """
+        required_not_finalized(self)
+
+        if not self.path._finalized:
+            self.path.finalize(context)
+
+        if self.unary_operator is None:
+            self.unary_operator = OPERATOR.pos
+
+        self._finalized = True
+
+    def get_real_value(self):
+        """ """
+        return self.values
+
+    def __copy__(self):
+        """ """
+        newone = type(self).__new__(type(self))
+        newone.__dict__.update(self.__dict__)
+
+        # static properties
+        newone._finalized = self._finalized
+        newone.unary_operator = self.unary_operator
+
+        # !important to copy
+        newone.path = copy(self.path)
+        newone.values = copy(self.values)
+
+        return newone
+
+    def __pos__(self):
+        """+self Unary plus sign"""
+        required_not_finalized(self)
+
+        self.unary_operator = OPERATOR.pos
+        return self.clone()
+
+    def __neg__(self):
+        """-self Unary minus sign"""
+        required_not_finalized(self)
+
+        self.unary_operator = OPERATOR.neg
+
+        return self.clone()
+
+    def clone(self):
+        """ """
+        return self.__copy__()
+
+
 @implementer(ITermValue, IValuedClass)
 class TermValue(object):
     """ """
@@ -33,6 +33,7 @@ from .fql import IExistsGroupTerm  # noqa: F401
 from .fql import IExistsTerm  # noqa: F401
 from .fql import IFqlClause  # noqa: F401
 from .fql import IGroupTerm  # noqa: F401
+from .fql import IIdsTerm  # noqa: F401
 from .fql import IInTerm  # noqa: F401
 from .fql import IPathConstraint  # noqa: F401
 from .fql import ISortTerm  # noqa: F401
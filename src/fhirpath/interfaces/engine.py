@@ -33,6 +33,15 @@ class IElasticsearchEngine(IEngine):
     def calculate_field_index_name():  # lgtm[py/not-named-self]
         """ """
 
+    def execute_iter():  # lgtm[py/not-named-self]
+        """Yields result page by page"""
+
+    def execute_many():  # lgtm[py/not-named-self]
+        """Executes several queries (multi search), returns list of result"""
+
+    def execute_references():  # lgtm[py/not-named-self]
+        """Returns distinct references of all matched documents, by aggregation"""
+
 
 class IEngineFactory(Interface):
     """Utility marker"""
@@ -56,6 +65,7 @@ class IEngineResultHeader(Interface):
     raw_query = Attribute("RawQuery")
     generated_on = Attribute("GeneratedOn")
     selects = Attribute("Selects")
+    next_cursor = Attribute("NextCursor")
 
 
 class IEngineResultBody(Interface):
@@ -47,6 +47,10 @@ class IExistsTerm(ITerm):
     """ """
 
 
+class IIdsTerm(ITerm):
+    """ """
+
+
 class ITermValue(IBaseClass):
     """ """
 
@@ -6,11 +6,21 @@ from warnings import warn
 
 from zope.interface import implementer
 
-from fhirpath.enums import EngineQueryType
+from fhirpath.engine.base import (
+    ColumnarEngineResultBody,
+    EngineResult,
+    EngineResultHeader,
+)
+from fhirpath.enums import EngineQueryType, MaterializationType
 from fhirpath.exceptions import ConstraintNotSatisfied, ValidationError
 from fhirpath.model import Model
 from fhirpath.thirdparty import Proxy
-from fhirpath.utils import FHIR_VERSION, builder
+from fhirpath.utils import (
+    FHIR_VERSION,
+    LazyFhirModelProxy,
+    builder,
+    construct_fhir_model,
+)
 
 from .constraints import required_finalized, required_not_finalized
 from .exceptions import MultipleResultsFound
@@ -37,6 +47,7 @@ from .interfaces import (
 
 if typing.TYPE_CHECKING:
     from fhirpath.engine.base import Engine
+    from fhirpath.fhirspec import SearchParameter
 
 __author__ = "Md Nazrul Islam<email2nazrul@gmail.com>"
 
@@ -273,6 +284,41 @@ class QueryBuilder(ABC):
         self._limit.limit = limit
         self._limit.offset = offset
 
+    @builder
+    def cursor(self, search_after=None, point_in_time=None):
+        """Enable cursor based pagination, instead of offset.
+        :param search_after: sort values of last item from previous page
+        :param point_in_time: point in time id (Elasticsearch)
+        """
+        self._pre_check()
+        self._limit.search_after = search_after or []
+        self._limit.point_in_time = point_in_time
+
+    @builder
+    def total(self, mode):
+        """How accurate total hits should be counted.
+        :param mode: one of ``TotalType`` (none, estimate, accurate)
+        """
+        self._pre_check()
+        self._limit.total = mode
+
+    @builder
+    def deadline(self, deadline):
+        """Bound the execution time of query.
+        :param deadline: absolute time (``time.monotonic``) until the query
+        must be finished, remaining time budget is applied to each request.
+        """
+        self._pre_check()
+        self._limit.deadline = deadline
+
+    @builder
+    def profile(self, enabled=True):
+        """Collect execution timings of each where term,
+        those are available as ``profile`` of result header.
+        """
+        self._pre_check()
+        self._limit.profile = enabled
+
     @builder
     def sort(self, *args):
         """ """
@@ -309,8 +355,12 @@ class QueryBuilder(ABC):
         unrestricted: bool = False,
         engine: typing.Optional["Engine"] = None,
         async_result: bool = None,
+        materialization: typing.Union[MaterializationType, str] = None,
     ) -> typing.Union["QueryResult", "AsyncQueryResult"]:
-        """ """
+        """
+        :param materialization: how resources are yielded while iterating,
+            see ``MaterializationType``, default is validated model.
+        """
         if async_result is not None:
             warn(
                 "'async_result' is no longer used, as Engine has that info already. "
@@ -334,7 +384,10 @@ class QueryBuilder(ABC):
             result_factory = QueryResult
 
         result = result_factory(
-            query=query, engine=self._engine, unrestricted=unrestricted
+            query=query,
+            engine=self._engine,
+            unrestricted=unrestricted,
+            materialization=materialization,
         )
         return result
 
@@ -378,26 +431,106 @@ class QueryBuilder(ABC):
 class QueryResult(ABC):
     """ """
 
-    def __init__(self, query: Query, engine: "Engine", unrestricted: bool = False):
+    def __init__(
+        self,
+        query: Query,
+        engine: "Engine",
+        unrestricted: bool = False,
+        materialization: typing.Union[MaterializationType, str] = None,
+    ):
         """ """
         self._query: Query = query
         self._engine: "Engine" = engine
         self._unrestricted: bool = unrestricted
+        self._materialization: MaterializationType = MaterializationType(
+            materialization or MaterializationType.VALIDATED
+        )
+
+    def _materialize(self, model_class, data):
+        """ """
+        if self._materialization == MaterializationType.DICT:
+            return data
+        if self._materialization == MaterializationType.CONSTRUCT:
+            return construct_fhir_model(model_class, data)
+        if self._materialization == MaterializationType.LAZY:
+            return LazyFhirModelProxy(model_class, data)
+        return model_class(**data)
 
     def fetchall(self):
         """ """
         return self._engine.execute(self._query, self._unrestricted)
 
+    @staticmethod
+    def fetchall_many(results: typing.List["QueryResult"]) -> typing.List[EngineResult]:
+        """Fetches several query results at once (i.e by single multi search
+        request), if all are bound with the same engine which supports it."""
+        if len(results) < 2:
+            return [result.fetchall() for result in results]
+        engine = results[0]._engine
+        unrestricted = results[0]._unrestricted
+        if getattr(engine, "execute_many", None) is None or any(
+            result._engine is not engine or result._unrestricted != unrestricted
+            for result in results
+        ):
+            return [result.fetchall() for result in results]
+        return engine.execute_many(
+            [result._query for result in results], unrestricted=unrestricted
+        )
+
+    def fetch_references(
+        self, search_param: "SearchParameter", max_count: typing.Optional[int] = None
+    ) -> typing.Dict[str, typing.List[str]]:
+        """Returns distinct references of reference search parameter from all
+        matched resources, those are aggregated by engine if it supports,
+        otherwise extracted from fetched resources.
+        :param max_count: at most that many resources are fetched, ValidationError
+        is raised if more are matched (references would be incomplete).
+        """
+        execute_references = getattr(self._engine, "execute_references", None)
+        if execute_references is not None:
+            references = execute_references(
+                self._query, search_param, self._unrestricted
+            )
+            if references is not None:
+                return references
+        query = self._create_references_fallback_query(max_count)
+        result = self._engine.execute(query, self._unrestricted)
+        self._validate_references_fallback_result(result, max_count)
+        return result.extract_references(search_param)
+
+    def _create_references_fallback_query(self, max_count):
+        """ """
+        if max_count is None:
+            return self._query
+        query = self._query.clone()
+        # one more, to detect if matches exceed
+        query._limit.limit = max_count + 1
+        return query
+
+    def _validate_references_fallback_result(self, result, max_count):
+        """ """
+        if max_count is not None and len(result.body) > max_count:
+            resource_types = ",".join(
+                from_[1].get_resource_type() for from_ in self._query.get_from()
+            )
+            raise ValidationError(
+                f"more than {max_count} {resource_types} resources are matched, "
+                "references cannot be collected, please narrow it down."
+            )
+
     def single(self):
         """Will return the single item in the input if there is just one item.
         If the input collection is empty ({ }), the result is empty.
         If there are multiple items, an error is signaled to the evaluation environment.
         This operation is useful for ensuring that an error is returned
         if an assumption about cardinality is violated at run-time."""
-        result = self.fetchall()
-        if result.header.total == 0:
+        # total might not be tracked, two items are enough to decide
+        query = self._query.clone()
+        query._limit.limit = 2
+        result = self._engine.execute(query, self._unrestricted)
+        if len(result.body) == 0:
             return None
-        if result.header.total > 1:
+        if len(result.body) > 1:
             raise MultipleResultsFound
 
         return result.body[0]
@@ -409,7 +542,7 @@ class QueryResult(ABC):
         query = self._query.clone()
         query._limit.limit = 1
         result = self._engine.execute(query, self._unrestricted)
-        if result.header.total > 0:
+        if len(result.body) > 0:
             return result.body[0]
         return None
 
@@ -506,15 +639,35 @@ class QueryResult(ABC):
 
         #     return self.results[result_key][result_index]
 
+    def iter_pages(self):
+        """Yields EngineResult page by page, instead of loading whole result
+        into memory, next page is fetched while current one is being consumed."""
+        return self._engine.execute_iter(self._query, self._unrestricted)
+
+    def columns(self):
+        """Returns EngineResult with columnar body (one array per select path).
+        Result is fetched page by page, so rows are not accumulated as lists."""
+        selects = self._query.get_select()
+        if len(selects) == 0 or any(el_path.star for el_path in selects):
+            raise ValidationError("Columnar result requires select path(s)!")
+        body = ColumnarEngineResultBody.from_selects(selects)
+        header = None
+        for page in self.iter_pages():
+            header = header or page.header
+            for row in page.body:
+                body.add(row)
+        return EngineResult(header=header or EngineResultHeader(total=0), body=body)
+
     def __iter__(self):
         """ """
-        result = self._engine.execute(self._query, self._unrestricted)
         model_class = self._query.get_from()[0][1]
-        for row in result.body:
-            if self._query.get_element()[0].star:
-                yield model_class(**row[0])
-            else:
-                yield row
+        star = self._query.get_element()[0].star
+        for page in self.iter_pages():
+            for row in page.body:
+                if star:
+                    yield self._materialize(model_class, row[0])
+                else:
+                    yield row
 
 
 class AsyncQueryResult(QueryResult):
@@ -525,22 +678,72 @@ class AsyncQueryResult(QueryResult):
         result = await self._engine.execute(self._query, self._unrestricted)
         return result
 
+    @staticmethod
+    async def fetchall_many(
+        results: typing.List["QueryResult"],
+    ) -> typing.List[EngineResult]:
+        """ """
+        if len(results) < 2:
+            return [await result.fetchall() for result in results]
+        engine = results[0]._engine
+        unrestricted = results[0]._unrestricted
+        if getattr(engine, "execute_many", None) is None or any(
+            result._engine is not engine or result._unrestricted != unrestricted
+            for result in results
+        ):
+            return [await result.fetchall() for result in results]
+        return await engine.execute_many(
+            [result._query for result in results], unrestricted=unrestricted
+        )
+
+    async def fetch_references(
+        self, search_param: "SearchParameter", max_count: typing.Optional[int] = None
+    ) -> typing.Dict[str, typing.List[str]]:
+        """ """
+        execute_references = getattr(self._engine, "execute_references", None)
+        if execute_references is not None:
+            references = await execute_references(
+                self._query, search_param, self._unrestricted
+            )
+            if references is not None:
+                return references
+        query = self._create_references_fallback_query(max_count)
+        result = await self._engine.execute(query, self._unrestricted)
+        self._validate_references_fallback_result(result, max_count)
+        return result.extract_references(search_param)
+
+    async def columns(self):
+        """ """
+        selects = self._query.get_select()
+        if len(selects) == 0 or any(el_path.star for el_path in selects):
+            raise ValidationError("Columnar result requires select path(s)!")
+        body = ColumnarEngineResultBody.from_selects(selects)
+        header = None
+        async for page in self.iter_pages():
+            header = header or page.header
+            for row in page.body:
+                body.add(row)
+        return EngineResult(header=header or EngineResultHeader(total=0), body=body)
+
     async def __aiter__(self):
         """ """
-        result = await self._engine.execute(self._query, self._unrestricted)
         model_class = self._query.get_from()[0][1]
-        for row in result.body:
-            if self._query.get_element()[0].star:
-                yield model_class(**row[0])
-            else:
-                yield row
+        star = self._query.get_element()[0].star
+        async for page in self.iter_pages():
+            for row in page.body:
+                if star:
+                    yield self._materialize(model_class, row[0])
+                else:
+                    yield row
 
     async def single(self):
         """ """
-        result = await self.fetchall()
-        if result.header.total == 0:
+        query = self._query.clone()
+        query._limit.limit = 2
+        result = await self._engine.execute(query, self._unrestricted)
+        if len(result.body) == 0:
             return None
-        if result.header.total > 1:
+        if len(result.body) > 1:
             raise MultipleResultsFound
         return result.body[0]
 
@@ -549,7 +752,7 @@ class AsyncQueryResult(QueryResult):
         query = self._query.clone()
         query._limit.limit = 1
         result = await self._engine.execute(query, self._unrestricted)
-        if result.header.total > 0:
+        if len(result.body) > 0:
             return result.body[0]
         return None
 
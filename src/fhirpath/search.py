@@ -1,9 +1,12 @@
 # _*_ coding: utf-8 _*_
+import asyncio
 import logging
 import re
+import time
 from typing import (
     TYPE_CHECKING,
     Any,
+    Callable,
     Dict,
     List,
     Optional,
@@ -27,6 +30,7 @@ from fhirpath.enums import (
     GroupType,
     MatchType,
     SortOrderType,
+    TotalType,
     WhereConstraintType,
 )
 from fhirpath.exceptions import ValidationError
@@ -45,6 +49,7 @@ from fhirpath.fql import (
     eb_,
     exact_,
     exists_,
+    ids_,
     not_,
     not_exists_,
     sa_,
@@ -52,8 +57,15 @@ from fhirpath.fql import (
 )
 from fhirpath.fql.types import ElementPath
 from fhirpath.interfaces import IGroupTerm, ISearch, ISearchContext
-from fhirpath.query import Q_, QueryResult
-from fhirpath.storage import SEARCH_PARAMETERS_STORAGE
+from fhirpath.query import Q_, AsyncQueryResult, QueryResult
+from fhirpath.storage import (
+    SEARCH_PARAMETER_INDEX_STORAGE,
+    SEARCH_PARAMETERS_STORAGE,
+    SEARCH_RESOLUTION_STORAGE,
+    SUMMARY_ELEMENTS_STORAGE,
+    LRUStorage,
+)
+from fhirpath.utils import decode_cursor
 
 __author__ = "Md Nazrul Islam <email2nazrul@gmail.com>"
 
@@ -67,12 +79,122 @@ parentheses_wrapped: Pattern = re.compile(r"^\(.+\)$")
 logger = logging.getLogger("fhirpath.search")
 
 DEFAULT_RESULT_COUNT = 100
+# max number of resources, could be matched by sub-query of chained parameter
+MAX_CHAINED_RESULT_COUNT = 10000
+# revinclude queries are split into concurrent sub-queries of that many IDs
+# (default ``index.max_terms_count`` of Elasticsearch)
+MAX_IDS_COUNT = 65536
+# included resources are fetched by (concurrent) sub-queries of that many IDs
+INCLUDE_CHUNK_SIZE = 1000
+# combinations of resource types (i.e by _type), those definitions are kept
+RESOURCE_TYPES_CACHE_SIZE = 256
 
 
 def has_escape_comma(val):
     return "\\," in val
 
 
+class SearchParameterIndex(object):
+    """Process wide index of the search parameters of a FHIR release.
+    Definitions and parameters intersection of resource types and resolved
+    paths of search parameters are computed once and shared by all
+    ``SearchContext``."""
+
+    __slots__ = ("fhir_release", "_definitions", "_intersections", "_paths")
+
+    def __init__(self, fhir_release: FHIR_VERSION):
+        """ """
+        self.fhir_release = fhir_release
+        storage = SEARCH_PARAMETERS_STORAGE.get(fhir_release.name)
+
+        if storage.empty():
+            spec = FHIRSearchSpecFactory.from_release(fhir_release.name)
+            spec.write()
+
+        # keyed by resource types (client given by _type), so bounded
+        self._definitions = LRUStorage(maxsize=RESOURCE_TYPES_CACHE_SIZE)
+        self._intersections = LRUStorage(maxsize=RESOURCE_TYPES_CACHE_SIZE)
+        self._paths: Dict[Tuple[str, str, str], ElementPath] = dict()
+
+    @classmethod
+    def from_release(cls, fhir_release: FHIR_VERSION) -> "SearchParameterIndex":
+        """ """
+        fhir_release = FHIR_VERSION.normalize(fhir_release)
+        index = SEARCH_PARAMETER_INDEX_STORAGE.get(fhir_release.name, None)
+        if index is None:
+            index = cls(fhir_release)
+            SEARCH_PARAMETER_INDEX_STORAGE.insert(fhir_release.name, index)
+        return index
+
+    def get_definitions(
+        self, resource_types: Tuple[str, ...]
+    ) -> Tuple[ResourceSearchParameterDefinition, ...]:
+        """if resource_types is empty, returns the searchparams
+        definitions of the generic "Resource" type."""
+        definitions = self._definitions.get(resource_types, None)
+        if definitions is None:
+            storage = SEARCH_PARAMETERS_STORAGE.get(self.fhir_release.name)
+            definitions = tuple(
+                storage.get(resource_type)
+                for resource_type in (resource_types or ("Resource",))
+            )
+            self._definitions.insert(resource_types, definitions)
+        return definitions
+
+    def get_intersection(self, resource_types: Tuple[str, ...]) -> Tuple[str, ...]:
+        """Search parameters available on all resource types"""
+        # independent of the order of resource types
+        resource_types = tuple(sorted(resource_types))
+        intersection = self._intersections.get(resource_types, None)
+        if intersection is None:
+            definitions = self.get_definitions(resource_types)
+            intersection = tuple(
+                code
+                for code in definitions[0]
+                if all(code in d for d in definitions[1:])
+            )
+            self._intersections.insert(resource_types, intersection)
+        return intersection
+
+    def get_path_context(self, search_param: SearchParameter) -> ElementPath:
+        """Resolved (finalized) path of search parameter's expression"""
+        key = (search_param.code, search_param.type, search_param.expression)
+        try:
+            return self._paths[key]
+        except KeyError:
+            pass
+        if search_param.expression is None:
+            raise NotImplementedError
+
+        # Some Safeguards
+        if search_param.type == "composite":
+            raise NotImplementedError
+
+        if search_param.type in ("token", "composite") and search_param.code.startswith(
+            "combo-"
+        ):
+            raise NotImplementedError
+
+        dotted_path = search_param.expression
+
+        if parentheses_wrapped.match(dotted_path):
+            dotted_path = dotted_path[1:-1]
+
+        path_ = self.dotted_path_to_path_context(dotted_path)
+        self._paths[key] = path_
+        return path_
+
+    def dotted_path_to_path_context(self, dotted_path: str) -> ElementPath:
+        """ """
+        if len(dotted_path.split(".")) == 1:
+            raise ValidationError("Invalid dotted path ´{0}´".format(dotted_path))
+
+        path_ = ElementPath.from_el_path(dotted_path)
+        # only ``fhir_release`` of the context is required
+        path_.finalize(self)
+        return path_
+
+
 @implementer(ISearchContext)
 class SearchContext(object):
     """ """
@@ -108,19 +230,13 @@ class SearchContext(object):
         fhir_release: FHIR_VERSION,
     ) -> List[ResourceSearchParameterDefinition]:
         """ """
-        fhir_release = FHIR_VERSION.normalize(fhir_release)
-        storage = SEARCH_PARAMETERS_STORAGE.get(fhir_release.name)
-
-        if storage.empty():
-            spec = FHIRSearchSpecFactory.from_release(fhir_release.name)
-            spec.write()
-
         # if self.resource_types is empty, return the searchparams
         # definitions of the generic "Resource" type.
-        return [
-            storage.get(resource_type)
-            for resource_type in (self.resource_types or ["Resource"])
-        ]
+        return list(
+            SearchParameterIndex.from_release(fhir_release).get_definitions(
+                tuple(self.resource_types)
+            )
+        )
 
     def augment_with_types(self, resource_types: List[str]):
         if len(resource_types) == 0:
@@ -129,46 +245,57 @@ class SearchContext(object):
         self.resource_types.extend(resource_types)
         self.definitions = self.get_parameters_definition(self.engine.fhir_release)
 
-        self.search_params_intersection = [
-            sp for sp in self.definitions[0] if all(sp in d for d in self.definitions)
-        ]
+        self.search_params_intersection = list(
+            SearchParameterIndex.from_release(
+                self.engine.fhir_release
+            ).get_intersection(tuple(self.resource_types))
+        )
 
     def resolve_path_context(self, search_param: SearchParameter):
         """ """
-        if search_param.expression is None:
-            raise NotImplementedError
-
-        # Some Safeguards
-        if search_param.type == "composite":
-            raise NotImplementedError
-
-        if search_param.type in ("token", "composite") and search_param.code.startswith(
-            "combo-"
-        ):
-            raise NotImplementedError
+        return SearchParameterIndex.from_release(
+            self.engine.fhir_release
+        ).get_path_context(search_param)
+
+    def resolve_param_definitions(
+        self, param_name
+    ) -> Tuple[str, Optional[str], List[SearchParameter]]:
+        """Returns (name, modifier, [search parameter]) of parameter name.
+        Resolution is memoized in ``SEARCH_RESOLUTION_STORAGE``, terms are built
+        for each search. Paths are resolved (and kept) by ``SearchParameterIndex``."""
+        key = (
+            "param",
+            self.engine.fhir_release.name,
+            tuple(self.resource_types),
+            param_name,
+        )
+        resolved = SEARCH_RESOLUTION_STORAGE.get(key, None)
+        if resolved is not None:
+            return resolved
+        try:
+            parts = param_name.split(":")
+            param_name_ = parts[0]
+            modifier_ = parts[1]
+        except IndexError:
+            modifier_ = None
 
-        dotted_path = search_param.expression
+        param_definitions = list(self._get_search_param_definitions(param_name_))
 
-        if parentheses_wrapped.match(dotted_path):
-            dotted_path = dotted_path[1:-1]
-
-        return self._dotted_path_to_path_context(dotted_path)
+        resolved = (param_name_, modifier_, param_definitions)
+        SEARCH_RESOLUTION_STORAGE.insert(key, resolved)
+        return resolved
 
     def normalize_param(
         self, param_name, raw_value
     ) -> List[Tuple[ElementPath, str, Optional[str]]]:
         """ """
-        try:
-            parts = param_name.split(":")
-            param_name_ = parts[0]
-            modifier_ = parts[1]
-        except IndexError:
-            modifier_ = None
+        param_name_, modifier_, param_definitions = self.resolve_param_definitions(
+            param_name
+        )
 
         normalized_params: List[Tuple[ElementPath, str, Optional[str]]] = []
-        search_params_def = self._get_search_param_definitions(param_name_)
 
-        for sp in search_params_def:
+        for sp in param_definitions:
             # Look out for any composite or combo type parameter
             if sp.type == "composite":
                 normalized_params.extend(
@@ -194,6 +321,7 @@ class SearchContext(object):
                 param_value_ = values
 
             Search.validate_normalized_value(param_name_, param_value_, modifier_)
+            # unsupported parameter is raised only if it has value
             _path = self.resolve_path_context(sp)
             normalized_params.append((_path, param_value_, modifier_))
         return normalized_params
@@ -258,14 +386,51 @@ class SearchContext(object):
             params_def.append(search_param)
         return params_def
 
-    def _dotted_path_to_path_context(self, dotted_path):
-        """ """
-        if len(dotted_path.split(".")) == 1:
-            raise ValidationError("Invalid dotted path ´{0}´".format(dotted_path))
+    def resolve_chained_param(
+        self, param_name
+    ) -> Tuple[str, List["SearchContext"], str]:
+        """Returns (reference search parameter name, contexts of target resource
+        types, chained parameter name) of chained parameter i.e
+        ``subject:Patient.name`` or ``subject.name``."""
+        ref_param_raw, chained_param_name = param_name.split(".", 1)
+        parts = ref_param_raw.split(":")
+        ref_param_name = parts[0]
+        type_modifier = parts[1] if len(parts) > 1 else None
+
+        target_types: Set[str] = set()
+        for ref_param in self._get_search_param_definitions(ref_param_name):
+            if ref_param.type != "reference":
+                raise ValidationError(
+                    f"chained search parameter {ref_param_name} must be "
+                    f"of type 'reference', got {ref_param.type}"
+                )
+            target_types.update(ref_param.target or [])
 
-        path_ = ElementPath.from_el_path(dotted_path)
-        path_.finalize(self.engine)
-        return path_
+        if type_modifier is not None:
+            if type_modifier not in target_types:
+                raise ValidationError(
+                    f"invalid reference {ref_param_name}:{type_modifier} "
+                    f"({','.join(sorted(target_types))})"
+                )
+            target_types = {type_modifier}
+
+        # only target resource types, those have the chained search parameter
+        chained_param_code = chained_param_name.split(".")[0].split(":")[0]
+        target_contexts: List[SearchContext] = []
+        for target_type in sorted(target_types):
+            target_context = SearchContext(self.engine, target_type, self.unrestricted)
+            try:
+                target_context._get_search_param_definitions(chained_param_code)
+            except ValidationError:
+                continue
+            target_contexts.append(target_context)
+
+        if len(target_contexts) == 0:
+            raise ValidationError(
+                f"search parameter ``{chained_param_code}`` is not available on "
+                f"any of resources referenced by ``{ref_param_raw}``."
+            )
+        return ref_param_name, target_contexts, chained_param_name
 
     def _normalize_composite_param(
         self, raw_value, param_def, modifier
@@ -303,7 +468,9 @@ class SearchContext(object):
 
             result.append(
                 (
-                    self._dotted_path_to_path_context(component_dotted_path),
+                    SearchParameterIndex.from_release(
+                        self.engine.fhir_release
+                    ).dotted_path_to_path_context(component_dotted_path),
                     component_param_value,
                     modifier,
                 )
@@ -318,8 +485,22 @@ class SearchContext(object):
 class Search(object):
     """ """
 
-    def __init__(self, context: SearchContext, query_string=None, params=None):
-        """ """
+    def __init__(
+        self,
+        context: SearchContext,
+        query_string=None,
+        params=None,
+        chaining_cache=None,
+        timeout: Optional[float] = None,
+        profile: bool = False,
+    ):
+        """``chaining_cache``: optional mapping (i.e MemoryStorage), those keeps
+        the result of chained parameter's sub-query. The caller is responsible
+        to scope it (i.e per user), as result is restricted by engine's security.
+        ``timeout``: optional time budget (in seconds) of whole search, each
+        sub-query (_include, _revinclude, _has, chaining) gets the remaining.
+        ``profile``: main query is profiled, execution time of each search
+        parameter is reported by ``OperationOutcome`` entry."""
         # validate first
         Search.validate_params(context, query_string, params)
 
@@ -340,8 +521,17 @@ class Search(object):
         self.search_params = None
 
         self.reverse_chaining_results: Optional[Dict[str, Set[str]]] = None
+        self.chaining_results: Optional[List[Tuple[str, List[str]]]] = None
+        self.chaining_cache = chaining_cache
         self.main_query = None
         self.include_queries = None
+        # absolute time (``time.monotonic``) until the search must be finished
+        self.deadline: Optional[float] = None
+        if timeout is not None:
+            self.deadline = time.monotonic() + timeout
+        self.profile = profile
+        # search parameter of each where term of the last built query
+        self.where_params: List[Optional[str]] = list()
 
         self.prepare_params(all_params)
 
@@ -430,11 +620,22 @@ class Search(object):
                 raise ValidationError("'page' cannot be multiple!")
             self.result_params["page"] = int(page[0])
 
+        _cursor = all_params.popall("_cursor", [])
+        if len(_cursor) > 0:
+            if len(_cursor) > 1:
+                raise ValidationError("'_cursor' cannot be multiple!")
+            self.result_params["_cursor"] = _cursor[0]
+
         _total = all_params.popall("_total", [])
 
         if len(_total) > 0:
             if len(_total) > 1:
                 raise ValidationError("'_total' cannot be multiple!")
+            if _total[0] not in [mode.value for mode in TotalType]:
+                raise ValidationError(
+                    f"'_total' must be one of none, estimate, accurate; "
+                    f"got {_total[0]}"
+                )
             self.result_params["_total"] = _total[0]
 
         _type = all_params.popone("_type", None)
@@ -454,6 +655,12 @@ class Search(object):
             self.result_params["_has"] = _has
         [all_params.pop(k) for k, _ in _has]
 
+        # chained parameters i.e subject:Patient.name
+        _chain = [(k, v) for k, v in all_params.items() if "." in k]
+        if _chain:
+            self.result_params["_chain"] = _chain
+        [all_params.pop(k) for k, _ in _chain]
+
         _revinclude = all_params.popall("_revinclude", None)
         if _revinclude:
             self.result_params["_revinclude"] = _revinclude
@@ -481,26 +688,136 @@ class Search(object):
         builder = self.attach_sort_terms(builder)
         builder = self.attach_summary_terms(builder)
         builder = self.attach_limit_terms(builder)
+        builder = self.attach_total_terms(builder)
+        builder = self.attach_chaining_terms(builder)
+        builder = self.attach_deadline(builder)
+        builder = self.attach_profile(builder)
 
-        # handle _has predicates
-        if self.reverse_chaining_results:
-            # filter results on IDs
-            terms: List = []
-            for resource_type, ids in self.reverse_chaining_results.items():
-                search_context = SearchContext(self.context.engine, resource_type)
-                normalized_data = search_context.normalize_param("_id", ",".join(ids))
-                self.add_term(normalized_data, terms)
+        result: QueryResult = builder(unrestricted=self.context.unrestricted)
 
-            builder = builder.where(*terms)
+        return result
+
+    def build_ids(self) -> QueryResult:
+        """Create IDs only (unlimited) query, used as sub-query of chained
+        parameter."""
+        builder = Q_(self.context.resource_types, self.context.engine)
+
+        builder = self.attach_where_terms(builder)
+        builder = self.attach_chaining_terms(builder)
+        id_paths = [f"{r}.id" for r in self.context.resource_types]
+        builder = builder.element(*id_paths).select(*id_paths)
+        builder = self.attach_deadline(builder)
 
         result: QueryResult = builder(unrestricted=self.context.unrestricted)
 
         return result
 
-    # FIXME: sorting, paginating and large results are not handled yet.
+    def chain(self) -> List[Tuple[str, List["Search"]]]:
+        """
+        This function handles chained parameters, returns (reference search
+        parameter name, sub searches of each target resource type) pairs.
+        """
+        chain_searches: List[Tuple[str, List[Search]]] = []
+        for param_name, value in self.result_params.get("_chain", []):
+            (
+                ref_param_name,
+                target_contexts,
+                chained_param_name,
+            ) = self.context.resolve_chained_param(param_name)
+            searches = [
+                self.__class__(
+                    target_context,
+                    params=((chained_param_name, value),),
+                    chaining_cache=self.chaining_cache,
+                )
+                for target_context in target_contexts
+            ]
+            for search in searches:
+                # sub searches share the time budget of this search
+                search.deadline = self.deadline
+            chain_searches.append((ref_param_name, searches))
+
+        return chain_searches
+
+    def resolve_chaining(self) -> bool:
+        """Runs sub-queries of _has and chained parameters, returns False
+        if any of those did not match any resources."""
+        # reverse chaining (_has)
+        if self.result_params.get("_has"):
+            has_queries = self.has()
+            # compute the intersection of referenced resources' ID
+            # from the result of _has queries.
+            self.reverse_chaining_results = {}
+            for references in self.fetch_references(has_queries):
+                self.reverse_chaining_results = {
+                    r_type: set(ids).intersection(self.reverse_chaining_results[r_type])
+                    if self.reverse_chaining_results.get(r_type)
+                    else set(ids)
+                    for r_type, ids in references.items()
+                    if r_type in self.context.resource_types
+                }
+            if not self.reverse_chaining_results:
+                return False
+
+        # chaining
+        if self.result_params.get("_chain"):
+            self.chaining_results = []
+            for ref_param_name, searches in self.chain():
+                references = [
+                    f"{search.context.resource_types[0]}/{id_}"
+                    for search in searches
+                    for id_ in search.fetch_ids()
+                ]
+                if len(references) == 0:
+                    return False
+                self.chaining_results.append((ref_param_name, references))
+
+        return True
+
+    def get_chaining_cache_key(self):
+        """ """
+        return (
+            tuple(self.context.resource_types),
+            self.context.unrestricted,
+            tuple(self.search_params.items()),
+            tuple(self.result_params.get("_chain", [])),
+            tuple(self.result_params.get("_has", [])),
+        )
+
+    def fetch_ids(self) -> List[str]:
+        """Returns IDs of all matched resources, those are streamed page by page
+        and bounded by ``MAX_CHAINED_RESULT_COUNT``."""
+        cache_key = None
+        if self.chaining_cache is not None:
+            cache_key = self.get_chaining_cache_key()
+            if cache_key in self.chaining_cache:
+                return self.chaining_cache[cache_key]
+
+        ids: List[str] = []
+        if self.resolve_chaining():
+            for page in self.build_ids().iter_pages():
+                ids.extend(row[0] for row in page.body)
+                self.validate_chained_result_count(ids)
+
+        if cache_key is not None:
+            self.chaining_cache[cache_key] = ids
+        return ids
+
+    def validate_chained_result_count(self, ids):
+        """ """
+        if len(ids) > MAX_CHAINED_RESULT_COUNT:
+            raise ValidationError(
+                f"chained search parameter matches more than "
+                f"{MAX_CHAINED_RESULT_COUNT} {','.join(self.context.resource_types)} "
+                "resources, please narrow it down."
+            )
+
     def has(self) -> List[Tuple[SearchParameter, QueryResult]]:
         """
         This function handles the _has keyword.
+        References are aggregated by engine (all pages), if it is not
+        supported, at most ``MAX_CHAINED_RESULT_COUNT`` resources are fetched
+        (see ``fetch_references``), more matches are rejected.
         """
         has_queries: List[Tuple[SearchParameter, QueryResult]] = []
         _has_predicates: List[Tuple[str, str]] = cast(
@@ -556,19 +873,25 @@ class Search(object):
             self.add_term(normalized_data, terms_container)
 
             builder = builder.where(*terms_container)
-            self.attach_limit_terms(builder)
+            builder = self.attach_deadline(builder)
 
             result: QueryResult = builder(unrestricted=self.context.unrestricted)
             has_queries.append((ref_param, result))
 
         return has_queries
 
-    # FIXME: sorting, paginating and large results are not handled yet.
     def include(self, main_query_result: EngineResult) -> List[QueryResult]:
         """
         This function handles the _include keyword.
         """
         include_queries: List[QueryResult] = []
+        # resources already in the bundle (or included) are not fetched again,
+        # resourceType and id are always in the source (even with _elements)
+        seen: Set[Tuple[str, str]] = {
+            (row[0].get("resourceType"), row[0].get("id"))
+            for row in main_query_result.body
+            if isinstance(row[0], dict)
+        }
         for inc in self.result_params.get("_include", []):
             # Parse the _include input parameter
             parts = inc.split(":")
@@ -609,34 +932,40 @@ class Search(object):
             )
 
             # Extract reference IDs from the main query result
-            ids = main_query_result.extract_references(ref_param)
+            references = main_query_result.extract_references(ref_param)
+            ids = {
+                r: [id_ for id_ in references.get(r, []) if (r, id_) not in seen]
+                for r in included_resources
+            }
+            seen.update((r, id_) for r in included_resources for id_ in ids[r])
 
             # filter included resources for which we have references to
-            included_resources = [r for r in included_resources if ids.get(r)]
+            included_resources = [r for r in included_resources if ids[r]]
 
             # if no references were extracted from the main_query_result, skip.
             if not included_resources:
                 continue
 
-            # Build a Q_ (query) object to join the resource based on reference ids.
-            builder = Q_(included_resources, self.context.engine)
-            terms: List = []
+            # Build Q_ (query) objects to join each resource based on reference ids,
+            # IDs are split into (concurrent) sub-queries of INCLUDE_CHUNK_SIZE.
             for resource_type in included_resources:
                 search_context = SearchContext(self.context.engine, resource_type)
-                # for each resource, create a term to filter IDs
-                normalized_data = search_context.normalize_param(
-                    "_id", ",".join(ids[resource_type])
-                )
-                self.add_term(normalized_data, terms)
-
-            builder = builder.where(*terms)
-            self.attach_limit_terms(builder)
-
-            # FIXME: find a better way to handle the limit
-            builder = builder.limit(DEFAULT_RESULT_COUNT)
+                resource_ids = ids[resource_type]
+                for index in range(0, len(resource_ids), INCLUDE_CHUNK_SIZE):
+                    chunk = resource_ids[index : index + INCLUDE_CHUNK_SIZE]
+                    builder = Q_(resource_type, self.context.engine)
+                    # create a term to filter IDs
+                    builder = builder.where(
+                        self.create_ids_term(search_context, "_id", chunk)
+                    )
+                    # each ID matches at most one resource, all are fetched at once
+                    builder = builder.limit(len(chunk))
+                    builder = self.attach_deadline(builder)
 
-            result: QueryResult = builder(unrestricted=self.context.unrestricted)
-            include_queries.append(result)
+                    result: QueryResult = builder(
+                        unrestricted=self.context.unrestricted
+                    )
+                    include_queries.append(result)
 
         return include_queries
 
@@ -688,22 +1017,31 @@ class Search(object):
             if not ids:
                 continue
 
-            # Build a Q_ (query) object to join the resource based on reference ids.
-            builder = Q_([from_resource_type], self.context.engine)
-            terms: List = []
-            for _, resource_ids in ids.items():
-                search_context = SearchContext(self.context.engine, from_resource_type)
-                # for each resource, create a term to filter reference ids
-                normalized_data = search_context.normalize_param(
-                    ref_param_raw, ",".join(resource_ids)
-                )
-                self.add_term(normalized_data, terms)
+            # Build a Q_ (query) object to join the resource based on reference ids,
+            # large number of IDs are split into (concurrent) sub-queries.
+            search_context = SearchContext(self.context.engine, from_resource_type)
+            max_length = max(len(resource_ids) for resource_ids in ids.values())
+            for index in range(0, max_length, MAX_IDS_COUNT):
+                builder = Q_([from_resource_type], self.context.engine)
+                terms: List = []
+                for _, resource_ids in ids.items():
+                    if len(resource_ids) <= index:
+                        continue
+                    # for each resource, create a term to filter reference ids
+                    terms.append(
+                        self.create_ids_term(
+                            search_context,
+                            ref_param_raw,
+                            resource_ids[index : index + MAX_IDS_COUNT],
+                        )
+                    )
 
-            builder = builder.where(*terms)
-            self.attach_limit_terms(builder)
+                builder = builder.where(*terms)
+                self.attach_limit_terms(builder)
+                builder = self.attach_deadline(builder)
 
-            result: QueryResult = builder(unrestricted=self.context.unrestricted)
-            include_queries.append(result)
+                result: QueryResult = builder(unrestricted=self.context.unrestricted)
+                include_queries.append(result)
 
         return include_queries
 
@@ -734,8 +1072,24 @@ class Search(object):
         elif path_._is is not None:
             raise NotImplementedError
 
+        term_factory_name, path_ = self.resolve_term_factory(path_, modifier)
+        term = getattr(self, term_factory_name)(path_, param_value, modifier)
+        if isinstance(term, list):
+            terms_container.extend(term)
+        else:
+            terms_container.append(term)
+
+    def resolve_term_factory(self, path_, modifier) -> Tuple[str, ElementPath]:
+        """Returns (name of term factory, term path) of parameter's path.
+        Resolution is memoized in ``SEARCH_RESOLUTION_STORAGE``, the term itself
+        is created by the factory for each search."""
+        key = ("term", self.context.engine.fhir_release.name, path_._raw, modifier)
+        resolved = SEARCH_RESOLUTION_STORAGE.get(key, None)
+        if resolved is not None:
+            return resolved
+
         if modifier in ("missing", "exists"):
-            term = self.create_exists_term(path_, param_value, modifier)
+            resolved = ("create_exists_term", path_)
 
         elif (
             hasattr(path_.context.type_class, "is_primitive")
@@ -745,40 +1099,36 @@ class Search(object):
             klass_name = path_.context.type_class.fhir_type_name()
             if klass_name == "Reference":
                 if modifier == "identifier":
-                    path_ = path_ / "identifier"
-                    term_factory = self.create_identifier_term
+                    resolved = ("create_identifier_term", path_ / "identifier")
                 else:
-                    path_ = path_ / "reference"
-                    term_factory = self.create_term
+                    resolved = ("create_term", path_ / "reference")
             elif klass_name == "Identifier":
-                term_factory = self.create_identifier_term
+                resolved = ("create_identifier_term", path_)
             elif klass_name in ("Quantity", "Duration"):
-                term_factory = self.create_quantity_term
+                resolved = ("create_quantity_term", path_)
             elif klass_name == "CodeableConcept":
-                term_factory = self.create_codeableconcept_term
+                resolved = ("create_codeableconcept_term", path_)
             elif klass_name == "Coding":
-                term_factory = self.create_coding_term
+                resolved = ("create_coding_term", path_)
             elif klass_name == "Address":
-                term_factory = self.create_address_term
+                resolved = ("create_address_term", path_)
             elif klass_name == "ContactPoint":
-                term_factory = self.create_contactpoint_term
+                resolved = ("create_contactpoint_term", path_)
             elif klass_name == "HumanName":
-                term_factory = self.create_humanname_term
+                resolved = ("create_humanname_term", path_)
             elif klass_name == "Money":
-                term_factory = self.create_money_term
+                resolved = ("create_money_term", path_)
             elif klass_name == "Period":
-                term_factory = self.create_period_term
+                resolved = ("create_period_term", path_)
             else:
                 raise NotImplementedError(
                     f"Can't perform search on element of type {klass_name}"
                 )
-            term = term_factory(path_, param_value, modifier)
         else:
-            term = self.create_term(path_, param_value, modifier)
-        if isinstance(term, list):
-            terms_container.extend(term)
-        else:
-            terms_container.append(term)
+            resolved = ("create_term", path_)
+
+        SEARCH_RESOLUTION_STORAGE.insert(key, resolved)
+        return resolved
 
     def create_identifier_term(self, path_, param_value, modifier):
         """ """
@@ -1525,12 +1875,16 @@ class Search(object):
 
     def attach_where_terms(self, builder):
         terms_container = list()
+        self.where_params = list()
         # we make sure that there are no duplicate keys!
         for param_name in set(self.search_params):
             raw_value = list(self.search_params.getall(param_name, []))
             normalized_params = self.context.normalize_param(param_name, raw_value)
             for np in normalized_params:
                 self.add_term(np, terms_container)
+            self.where_params.extend(
+                [param_name] * (len(terms_container) - len(self.where_params))
+            )
 
         return builder.where(*terms_container)
 
@@ -1555,6 +1909,16 @@ class Search(object):
 
     def attach_limit_terms(self, builder):
         """ """
+        if self.use_cursor_pagination():
+            search_after, point_in_time = [], None
+            if self.result_params.get("_cursor"):
+                search_after, point_in_time = decode_cursor(
+                    self.result_params["_cursor"]
+                )
+            return builder.limit(
+                self.result_params.get("_count", DEFAULT_RESULT_COUNT)
+            ).cursor(search_after, point_in_time)
+
         if "_count" not in self.result_params:
             return builder.limit(DEFAULT_RESULT_COUNT)
 
@@ -1565,6 +1929,76 @@ class Search(object):
                 offset = (current_page - 1) * self.result_params["_count"]
         return builder.limit(self.result_params["_count"], offset)
 
+    def attach_total_terms(self, builder):
+        """ """
+        if "_total" not in self.result_params:
+            return builder
+        return builder.total(self.result_params["_total"])
+
+    def attach_deadline(self, builder):
+        """ """
+        if self.deadline is None:
+            return builder
+        return builder.deadline(self.deadline)
+
+    def attach_profile(self, builder):
+        """ """
+        if not self.profile:
+            return builder
+        return builder.profile()
+
+    def label_profile(self, header):
+        """Adds search parameter (``param``) to profile entry of each where
+        term, None for other clauses."""
+        for entry in getattr(header, "profile", None) or []:
+            index = entry["index"]
+            if index is not None and index < len(self.where_params):
+                entry["param"] = self.where_params[index]
+            else:
+                entry["param"] = None
+
+    def attach_chaining_terms(self, builder):
+        """Filters on IDs, those are matched by _has and chained sub-queries"""
+        terms: List = []
+        if self.reverse_chaining_results:
+            for resource_type, ids in self.reverse_chaining_results.items():
+                search_context = SearchContext(self.context.engine, resource_type)
+                terms.append(self.create_ids_term(search_context, "_id", list(ids)))
+                self.where_params.append("_has")
+
+        for ref_param_name, references in self.chaining_results or []:
+            terms.append(self.create_ids_term(self.context, ref_param_name, references))
+            self.where_params.append(ref_param_name)
+
+        if len(terms) == 0:
+            return builder
+        return builder.where(*terms)
+
+    def create_ids_term(self, search_context, param_name, values):
+        """Single term matching any of IDs (or references) values of search
+        parameter, rather than a group of one term per value."""
+        _, _, param_definitions = search_context.resolve_param_definitions(param_name)
+        terms: List = []
+        for sp in param_definitions:
+            path_ = search_context.resolve_path_context(sp)
+            _, term_path = self.resolve_term_factory(path_, None)
+            terms.append(ids_(term_path, values))
+
+        if len(terms) == 1:
+            return terms[0]
+        group = G_(*terms, path=terms[0].path, type_=GroupType.DECOUPLED)
+        return group.match_any()
+
+    def use_cursor_pagination(self) -> bool:
+        """Cursor is explicitly requested or enabled by engine, unless the
+        page is requested by number."""
+        if "_cursor" in self.result_params:
+            return True
+        return (
+            getattr(self.context.engine, "cursor_pagination", False) is True
+            and "page" not in self.result_params
+        )
+
     def attach_elements_terms(self, builder):
         """ """
         if "_elements" not in self.result_params:
@@ -1588,56 +2022,29 @@ class Search(object):
         if self.result_params["_summary"] in ["count", "false"]:
             return builder
 
-        specs = [
-            lookup_fhir_resource_spec(r, True, self.context.engine.fhir_release)
-            for r in self.context.resource_types
-        ]
+        summary = self.result_params["_summary"]
+        fhir_release = self.context.engine.fhir_release
 
-        if self.result_params["_summary"] in ("data", "true"):
+        if summary in ("data", "true"):
 
             summary_elements = [
                 f"{r}.{attr}"
                 for r in self.context.resource_types
                 for attr in ["id", "meta"]
             ]
-
-            def should_include(attr):
-                if self.result_params["_summary"] == "data":
-                    return (
-                        not attr.path.endswith(".text")
-                        and not attr.is_main_profile_element
-                    )
-                elif self.result_params["_summary"] == "true":
-                    return attr.is_summary
-
-            # filter all summary attributes
-            summary_attributes = [
-                attr for spec in specs for attr in spec.elements if should_include(attr)
-            ]
-
-            def get_attr_paths(attribute):
-                if attribute.path.endswith("[x]"):
-                    for prop in attribute.as_properties():
-                        return [
-                            f"{prop.path.rsplit('.', 1)[0]}.{prop.name}"
-                            for prop in attribute.as_properties()
-                        ]
-                else:
-                    return [attribute.path]
-
             # append summary attributes' paths to summary_elements
-            summary_elements.extend(
-                [path for attr in summary_attributes for path in get_attr_paths(attr)]
-            )
+            for r in self.context.resource_types:
+                summary_elements.extend(
+                    Search.get_summary_elements(r, summary, fhir_release)
+                )
 
             return builder.element(*summary_elements)
 
-        if self.result_params["_summary"] == "text":
+        if summary == "text":
             text_elements = [
-                el.path
-                for spec in specs
-                for el in spec.elements
-                if el.n_min is not None and el.n_min > 0
+                path
+                for r in self.context.resource_types
+                for path in Search.get_summary_elements(r, summary, fhir_release)
             ]
             text_elements.extend(
                 [
@@ -1649,122 +2056,327 @@ class Search(object):
 
             return builder.element(*text_elements)
 
-    def response(self, result, includes, as_json):
+    @staticmethod
+    def get_summary_elements(
+        resource_type: str, summary: str, fhir_release: FHIR_VERSION
+    ) -> Tuple[str, ...]:
+        """Element paths of resource type's specification for ``_summary``
+        (true, data or text), those are computed once by release."""
+        fhir_release = FHIR_VERSION.normalize(fhir_release)
+        storage = SUMMARY_ELEMENTS_STORAGE.get(fhir_release.name)
+        key = (resource_type, summary)
+        elements = storage.get(key, None)
+        if elements is not None:
+            return elements
+
+        spec = lookup_fhir_resource_spec(resource_type, True, fhir_release)
+
+        if summary == "text":
+            elements = tuple(
+                el.path for el in spec.elements if el.n_min is not None and el.n_min > 0
+            )
+        else:
+
+            def should_include(attr):
+                if summary == "data":
+                    return (
+                        not attr.path.endswith(".text")
+                        and not attr.is_main_profile_element
+                    )
+                elif summary == "true":
+                    return attr.is_summary
+
+            def get_attr_paths(attribute):
+                if attribute.path.endswith("[x]"):
+                    return [
+                        f"{prop.path.rsplit('.', 1)[0]}.{prop.name}"
+                        for prop in attribute.as_properties()
+                    ]
+                else:
+                    return [attribute.path]
+
+            elements = tuple(
+                path
+                for attr in spec.elements
+                if should_include(attr)
+                for path in get_attr_paths(attr)
+            )
+
+        storage.insert(key, elements)
+        return elements
+
+    def response(self, result, includes, as_json, as_bytes=False):
         """ """
+        self.label_profile(result.header)
         return self.context.engine.wrapped_with_bundle(
-            result, includes=includes, as_json=as_json
+            result, includes=includes, as_json=as_json, as_bytes=as_bytes
         )
 
-    def __call__(self, as_json=False):
+    def __call__(self, as_json=False, as_bytes=False):
         """ """
+        return self.call_many([self], as_json, as_bytes)[0]
 
-        # TODO: chaining
+    @classmethod
+    def call_many(cls, searches: List["Search"], as_json=False, as_bytes=False):
+        """Executes several searches at once, main queries are fetched together
+        then all _include/_revinclude queries (i.e by single multi search
+        request each). Responses are in order of searches, the same search
+        might be given several times but is executed once."""
+        unique = list(dict.fromkeys(searches))
+        main_results: Dict[Search, EngineResult] = dict()
+        pending: List[Search] = list()
+        executed: Set[Search] = set()
+        for search in unique:
+            # if the _has predicates or chained parameters did not match any
+            # documents, return an empty result
+            if not search.resolve_chaining():
+                main_results[search] = EngineResult(
+                    EngineResultHeader(total=0), EngineResultBody()
+                )
+                continue
 
-        # reverse chaining (_has)
-        if self.result_params.get("_has"):
-            has_queries = self.has()
-            # compute the intersection of referenced resources' ID
-            # from the result of _has queries.
-            self.reverse_chaining_results = {}
-            for ref_param, q in has_queries:
-                res = q.fetchall()
-                self.reverse_chaining_results = {
-                    r_type: set(ids).intersection(self.reverse_chaining_results[r_type])
-                    if self.reverse_chaining_results.get(r_type)
-                    else set(ids)
-                    for r_type, ids in res.extract_references(ref_param).items()
-                    if r_type in self.context.resource_types
-                }
+            # MAIN QUERY
+            search.main_query = search.build()
+            executed.add(search)
 
-            # if the _has predicates did not match any documents, return an empty result
-            # FIXME: we use the result of the last _has query to build the empty bundle,
-            # but we should be more explicit about the query context.
-            if not self.reverse_chaining_results:
-                return self.response(
-                    EngineResult(EngineResultHeader(total=0), EngineResultBody()),
-                    [],
-                    as_json,
-                )
+            # TODO handle count with _includes
+            if search.result_params.get("_summary") == "count":
+                main_results[search] = search.main_query.count_raw()
+            else:
+                pending.append(search)
 
-        # MAIN QUERY
-        self.main_query = self.build()
+        if len(pending) > 0:
+            fetched = pending[0].fetch_all([search.main_query for search in pending])
+            main_results.update(zip(pending, fetched))
 
-        # TODO handle count with _includes
-        if self.result_params.get("_summary") == "count":
-            main_result = self.main_query.count_raw()
-        else:
-            main_result = self.main_query.fetchall()
-        assert main_result is not None
+        include_queries: Dict[Search, List[QueryResult]] = {
+            search: [] for search in unique
+        }
+        for search in unique:
+            if search not in executed:
+                continue
+            # _include
+            search.include_queries = search.include(main_results[search])
+            # _revinclude
+            search.rev_include_queries = search.rev_include(main_results[search])
+            include_queries[search] = [
+                *search.include_queries,
+                *search.rev_include_queries,
+            ]
 
-        # _include
-        self.include_queries = self.include(main_result)
-        include_results: List[EngineResult] = [
-            q.fetchall() for q in self.include_queries
-        ]
+        all_includes = cls.split_includes(
+            include_queries,
+            unique[0].fetch_all(
+                [query for queries in include_queries.values() for query in queries]
+            ),
+        )
+        responses = {
+            search: search.response(
+                main_results[search], all_includes[search], as_json, as_bytes
+            )
+            for search in unique
+        }
+        return [responses[search] for search in searches]
 
-        # _revinclude
-        self.rev_include_queries = self.rev_include(main_result)
-        rev_include_results: List[EngineResult] = [
-            q.fetchall() for q in self.rev_include_queries
+    @staticmethod
+    def split_includes(
+        include_queries: Dict["Search", List[QueryResult]],
+        results: List[EngineResult],
+    ) -> Dict["Search", List[EngineResult]]:
+        """Results of all include queries (in order) are given back to
+        each search."""
+        all_includes: Dict[Search, List[EngineResult]] = dict()
+        offset = 0
+        for search, queries in include_queries.items():
+            all_includes[search] = results[offset : offset + len(queries)]
+            offset += len(queries)
+        return all_includes
+
+    def fetch_all(self, queries: List[QueryResult]) -> List[EngineResult]:
+        """Executes independent queries at once, by single multi search
+        request or concurrently on engine's thread pool,
+        results are kept in order of queries."""
+        if getattr(self.context.engine, "execute_many", None) is not None:
+            return QueryResult.fetchall_many(queries)
+        executor = getattr(self.context.engine, "query_executor", None)
+        if executor is None or len(queries) < 2:
+            return [q.fetchall() for q in queries]
+        futures = [executor.submit(q.fetchall) for q in queries]
+        return [future.result() for future in futures]
+
+    def fetch_references(
+        self, has_queries: List[Tuple[SearchParameter, QueryResult]]
+    ) -> List[Dict[str, List[str]]]:
+        """Collects distinct references of each _has query concurrently,
+        results are kept in order of queries."""
+        executor = getattr(self.context.engine, "query_executor", None)
+        if executor is None or len(has_queries) < 2:
+            return [
+                query.fetch_references(param, MAX_CHAINED_RESULT_COUNT)
+                for param, query in has_queries
+            ]
+        futures = [
+            executor.submit(query.fetch_references, param, MAX_CHAINED_RESULT_COUNT)
+            for param, query in has_queries
         ]
-
-        all_includes = [*include_results, *rev_include_results]
-        return self.response(main_result, all_includes, as_json)
+        return [future.result() for future in futures]
 
 
 class AsyncSearch(Search):
     """ """
 
-    async def __call__(self, as_json=False):
+    async def __call__(self, as_json=False, as_bytes=False):
         """ """
-        # TODO: chaining
+        return (await self.call_many([self], as_json, as_bytes))[0]
+
+    @classmethod
+    async def call_many(  # type: ignore
+        cls, searches: List["Search"], as_json=False, as_bytes=False
+    ):
+        """ """
+        unique = list(dict.fromkeys(searches))
+        main_results: Dict[Search, EngineResult] = dict()
+        pending: List[Search] = list()
+        executed: Set[Search] = set()
+        for search in unique:
+            if not await search.resolve_chaining():
+                main_results[search] = EngineResult(
+                    EngineResultHeader(total=0), EngineResultBody()
+                )
+                continue
+
+            # MAIN QUERY
+            search.main_query = search.build()
+            executed.add(search)
+
+            # TODO handle count with _includes
+            if search.result_params.get("_summary") == "count":
+                main_results[search] = await search.main_query.count_raw()
+            else:
+                pending.append(search)
 
+        if len(pending) > 0:
+            fetched = await pending[0].fetch_all(
+                [search.main_query for search in pending]
+            )
+            main_results.update(zip(pending, fetched))
+
+        include_queries: Dict[Search, List[QueryResult]] = {
+            search: [] for search in unique
+        }
+        for search in unique:
+            if search not in executed:
+                continue
+            # _include
+            search.include_queries = search.include(main_results[search])
+            # _revinclude
+            search.rev_include_queries = search.rev_include(main_results[search])
+            include_queries[search] = [
+                *search.include_queries,
+                *search.rev_include_queries,
+            ]
+
+        all_includes = cls.split_includes(
+            include_queries,
+            await unique[0].fetch_all(
+                [query for queries in include_queries.values() for query in queries]
+            ),
+        )
+        responses = {
+            search: search.response(
+                main_results[search], all_includes[search], as_json, as_bytes
+            )
+            for search in unique
+        }
+        return [responses[search] for search in searches]
+
+    async def resolve_chaining(self) -> bool:
+        """ """
         # reverse chaining (_has)
         if self.result_params.get("_has"):
             has_queries = self.has()
-            # compute the intersection of referenced resources' ID
-            # from the result of _has queries.
             self.reverse_chaining_results = {}
-            for ref_param, q in has_queries:
-                res = await q.fetchall()
+            for references in await self.fetch_references(has_queries):
                 self.reverse_chaining_results = {
                     r_type: set(ids).intersection(self.reverse_chaining_results[r_type])
                     if self.reverse_chaining_results.get(r_type)
                     else set(ids)
-                    for r_type, ids in res.extract_references(ref_param).items()
+                    for r_type, ids in references.items()
                     if r_type in self.context.resource_types
                 }
-
-            # if the _has predicates did not match any documents, return an empty result
-            # FIXME: we use the result of the last _has query to build the empty bundle,
-            # but we should be more explicit about the query context.
             if not self.reverse_chaining_results:
-                return self.response(res, [], as_json)
+                return False
+
+        # chaining
+        if self.result_params.get("_chain"):
+            self.chaining_results = []
+            for ref_param_name, searches in self.chain():
+                references = [
+                    f"{search.context.resource_types[0]}/{id_}"
+                    for search in searches
+                    for id_ in await search.fetch_ids()
+                ]
+                if len(references) == 0:
+                    return False
+                self.chaining_results.append((ref_param_name, references))
 
-        # MAIN QUERY
-        self.main_query = self.build()
+        return True
 
-        # TODO handle count with _includes
-        if self.result_params.get("_summary") == "count":
-            main_result = await self.main_query.count_raw()
-        else:
-            main_result = await self.main_query.fetchall()
-        assert main_result is not None
+    async def fetch_ids(self) -> List[str]:
+        """ """
+        cache_key = None
+        if self.chaining_cache is not None:
+            cache_key = self.get_chaining_cache_key()
+            if cache_key in self.chaining_cache:
+                return self.chaining_cache[cache_key]
+
+        ids: List[str] = []
+        if await self.resolve_chaining():
+            async for page in self.build_ids().iter_pages():
+                ids.extend(row[0] for row in page.body)
+                self.validate_chained_result_count(ids)
+
+        if cache_key is not None:
+            self.chaining_cache[cache_key] = ids
+        return ids
+
+    async def fetch_all(self, queries: List[QueryResult]) -> List[EngineResult]:
+        """Executes independent queries concurrently, at most engine's
+        ``query_concurrency`` at a time, results are kept in order of queries."""
+        if getattr(self.context.engine, "execute_many", None) is not None:
+            return await AsyncQueryResult.fetchall_many(queries)
+        if len(queries) < 2:
+            return [await q.fetchall() for q in queries]
+        semaphore = asyncio.Semaphore(
+            getattr(self.context.engine, "query_concurrency", len(queries))
+        )
 
-        # _include
-        self.include_queries = self.include(main_result)
-        include_results: List[EngineResult] = [
-            await q.fetchall() for q in self.include_queries
-        ]
+        async def fetch(query):
+            async with semaphore:
+                return await query.fetchall()
 
-        # _revinclude
-        self.rev_include_queries = self.rev_include(main_result)
-        rev_include_results: List[EngineResult] = [
-            await q.fetchall() for q in self.rev_include_queries
-        ]
+        return list(await asyncio.gather(*[fetch(q) for q in queries]))
+
+    async def fetch_references(
+        self, has_queries: List[Tuple[SearchParameter, QueryResult]]
+    ) -> List[Dict[str, List[str]]]:
+        """ """
+        if len(has_queries) < 2:
+            return [
+                await query.fetch_references(param, MAX_CHAINED_RESULT_COUNT)
+                for param, query in has_queries
+            ]
+        semaphore = asyncio.Semaphore(
+            getattr(self.context.engine, "query_concurrency", len(has_queries))
+        )
 
-        all_includes = [*include_results, *rev_include_results]
-        return self.response(main_result, all_includes, as_json)
+        async def fetch(param, query):
+            async with semaphore:
+                return await query.fetch_references(param, MAX_CHAINED_RESULT_COUNT)
+
+        return list(
+            await asyncio.gather(*[fetch(param, query) for param, query in has_queries])
+        )
 
 
 def fhir_search(
@@ -1772,13 +2384,86 @@ def fhir_search(
     query_string: str = None,
     params: Union[Dict[str, str], Tuple[Tuple[str, str]]] = None,
     response_as_dict: bool = False,
+    response_as_bytes: bool = False,
+    timeout: float = None,
+    profile: bool = False,
 ):
-    """ """
+    """``response_as_bytes``: Bundle is returned as json bytes, serialized
+    straight from the result, without building the Bundle model.
+    ``timeout``: time budget (in seconds) of whole search, partial result is
+    flagged by ``OperationOutcome`` entry, ``DeadlineExceeded`` is raised if
+    budget has been spent before a query could be sent.
+    ``profile``: execution time of each search parameter is reported by
+    ``OperationOutcome`` entry."""
     if TYPE_CHECKING:
         klass: Union[Type[AsyncSearch], Type[Search]]
     if context.engine.__class__.is_async():
         klass = AsyncSearch
     else:
         klass = Search
-    factory = klass(context, query_string=query_string, params=params)
-    return factory(as_json=response_as_dict)
+    factory = klass(
+        context,
+        query_string=query_string,
+        params=params,
+        timeout=timeout,
+        profile=profile,
+    )
+    return factory(as_json=response_as_dict, as_bytes=response_as_bytes)
+
+
+def fhir_search_many(
+    context_factory: Callable[[str], SearchContext],
+    query_strings: List[str],
+    response_as_dict: bool = False,
+    response_as_bytes: bool = False,
+    timeout: float = None,
+    profile: bool = False,
+):
+    """Executes several independent searches (i.e ``Patient?name=smith``) at
+    once, main queries are sent together then all _include/_revinclude queries.
+    ``context_factory`` is called with resource type, the context is shared by
+    all searches of that type. Identical searches are executed once, and share
+    the response. Responses are in order of ``query_strings``, empty
+    ``query_strings`` is rejected, as sync or async call cannot be chosen."""
+    if len(query_strings) == 0:
+        # engine (sync or async) is only known from the context of a search
+        raise ValidationError("At least one search is required.")
+    contexts: Dict[str, SearchContext] = dict()
+    searches: Dict[str, Search] = dict()
+    klass: Optional[Union[Type[AsyncSearch], Type[Search]]] = None
+    for search_string in query_strings:
+        if search_string in searches:
+            continue
+        resource_type, _, query_string = search_string.lstrip("/").partition("?")
+        if not resource_type:
+            raise ValidationError(
+                f"bad search '{search_string}', should be ResourceType?query"
+            )
+        params = Search.parse_query_string(query_string)
+        if "_type" in params:
+            # context is augmented with additional types, cannot be shared
+            context = context_factory(resource_type)
+        else:
+            if resource_type not in contexts:
+                contexts[resource_type] = context_factory(resource_type)
+            context = contexts[resource_type]
+
+        context_klass = AsyncSearch if context.engine.__class__.is_async() else Search
+        if klass is None:
+            # chosen by the first context
+            klass = context_klass
+        elif context_klass is not klass:
+            raise ValidationError(
+                "All searches must be either sync or async, "
+                f"engine of '{search_string}' is not like the others."
+            )
+        searches[search_string] = klass(
+            context, params=params, timeout=timeout, profile=profile
+        )
+
+    assert klass is not None
+    return klass.call_many(
+        [searches[search_string] for search_string in query_strings],
+        as_json=response_as_dict,
+        as_bytes=response_as_bytes,
+    )
@@ -1,5 +1,6 @@
 # _*_ coding: utf-8 _*_
-from collections import defaultdict
+import threading
+from collections import OrderedDict, defaultdict
 from datetime import datetime
 from typing import Optional
 
@@ -50,10 +51,90 @@ class MemoryStorage(defaultdict):
         return len(self)
 
 
+@implementer(IStorage)
+class LRUStorage(object):
+    """Bounded (thread safe) storage, the least recently used item is evicted
+    when ``maxsize`` is exceeded. Lookups are counted as ``hits``/``misses``."""
+
+    _last_updated: Optional[datetime]
+    _write_locked: Optional[bool]
+    _read_locked: Optional[bool]
+
+    def __init__(self, maxsize: int = 1024):
+        """ """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, item, default=EMPTY_VALUE):
+        """ """
+        with self._lock:
+            try:
+                value = self._data[item]
+            except KeyError:
+                self.misses += 1
+                if default is EMPTY_VALUE:
+                    raise
+                return default
+            self._data.move_to_end(item)
+            self.hits += 1
+            return value
+
+    def set(self, item, value):
+        """ """
+        self.insert(item, value)
+
+    def insert(self, item, value):
+        """ """
+        with self._lock:
+            self._data[item] = value
+            self._data.move_to_end(item)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, item):
+        """ """
+        with self._lock:
+            del self._data[item]
+
+    def clear(self):
+        """ """
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def exists(self, item):
+        """ """
+        return item in self._data
+
+    def empty(self):
+        """ """
+        return len(self._data) == 0
+
+    def total(self):
+        """ """
+        return len(self._data)
+
+    __getitem__ = get
+    __setitem__ = insert
+    __delitem__ = delete
+    __contains__ = exists
+    __len__ = total
+
+
 FHIR_RESOURCE_CLASS_STORAGE: MemoryStorage = MemoryStorage()
 PATH_INFO_STORAGE: MemoryStorage = MemoryStorage()
 SEARCH_PARAMETERS_STORAGE: MemoryStorage = MemoryStorage()
 FHIR_RESOURCE_SPEC_STORAGE: MemoryStorage = MemoryStorage()
+# element paths of ``_summary`` modes by resource type
+SUMMARY_ELEMENTS_STORAGE: MemoryStorage = MemoryStorage()
+# per release SearchParameterIndex (see fhirpath.search)
+SEARCH_PARAMETER_INDEX_STORAGE: MemoryStorage = MemoryStorage()
+# resolved search parameter definitions and term factories, by parameter name
+SEARCH_RESOLUTION_STORAGE: LRUStorage = LRUStorage(maxsize=1024)
 
 releases = set([member.name for member in FHIR_VERSION if member.name != "DEFAULT"])
 for release in releases:
@@ -68,4 +149,7 @@ for release in releases:
 
     if not FHIR_RESOURCE_SPEC_STORAGE.exists(release):
         FHIR_RESOURCE_SPEC_STORAGE.insert(release, MemoryStorage())
+
+    if not SUMMARY_ELEMENTS_STORAGE.exists(release):
+        SUMMARY_ELEMENTS_STORAGE.insert(release, MemoryStorage())
 del releases
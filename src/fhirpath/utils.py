@@ -1,4 +1,6 @@
 # _*_ coding: utf-8 _*_
+import base64
+import binascii
 import datetime
 import inspect
 import math
@@ -8,6 +10,7 @@ import re
 import sys
 import time
 import uuid
+from functools import lru_cache
 from importlib import import_module
 from inspect import signature
 from types import ModuleType
@@ -19,7 +22,9 @@ from typing import (
     Match,
     Optional,
     Pattern,
+    Set,
     Text,
+    Tuple,
     Type,
     Union,
     cast,
@@ -33,6 +38,7 @@ from zope.interface import implementer
 from fhirpath.thirdparty import Proxy
 
 from .enums import FHIR_VERSION
+from .exceptions import ValidationError
 from .interfaces import IPathInfoContext
 from .json import json_dumps, json_loads  # noqa: F401
 from .storage import FHIR_RESOURCE_CLASS_STORAGE, PATH_INFO_STORAGE
@@ -268,6 +274,56 @@ def lookup_fhir_class(
     return klass
 
 
+@lru_cache(maxsize=None)
+def _model_construct_plan(
+    model_class: Type["FHIRAbstractModel"],
+) -> Dict[str, Tuple[str, Optional[str], Optional[FHIR_VERSION]]]:
+    """json key: (field name, nested model name, nested model FHIR release)"""
+    plan = dict()
+    for name, field in model_class.__fields__.items():
+        nested_type = getattr(field.type_, "__resource_type__", None)
+        if isinstance(nested_type, str):
+            release = FHIR_VERSION[field.type_.__fhir_release__]
+            plan[field.alias] = (name, nested_type, release)
+        else:
+            plan[field.alias] = (name, None, None)
+    return plan
+
+
+def construct_fhir_model(
+    model_class: Type["FHIRAbstractModel"], data: Dict[str, Any]
+) -> "FHIRAbstractModel":
+    """Recursively constructs model (including nested elements) from trusted
+    data, without any validation."""
+    plan = _model_construct_plan(model_class)
+    values = dict()
+    for key, value in data.items():
+        if key not in plan:
+            # i.e resourceType
+            continue
+        name, nested_type, release = plan[key]
+        if nested_type is not None and value is not None:
+            if isinstance(value, list):
+                value = [
+                    _construct_nested_model(nested_type, release, item)
+                    for item in value
+                ]
+            else:
+                value = _construct_nested_model(nested_type, release, value)
+        values[name] = value
+    return model_class.construct(**values)
+
+
+def _construct_nested_model(nested_type: str, release: FHIR_VERSION, value: Any) -> Any:
+    """ """
+    if not isinstance(value, dict):
+        return value
+    if nested_type == "Resource":
+        # contained resource
+        nested_type = value.get("resourceType", nested_type)
+    return construct_fhir_model(lookup_fhir_class(nested_type, release), value)
+
+
 CONTAINS_PY_PACKAGE: Pattern = re.compile(
     r"^\${(?P<package_name>[0-9a-z._]+)}", re.IGNORECASE
 )
@@ -563,6 +619,22 @@ class PathInfoContextProxy(Proxy):
         self.initialize(context)
 
 
+class LazyFhirModelProxy(Proxy):
+    """FHIR model placeholder, resource data is validated into the model
+    on first attribute access."""
+
+    def __init__(self, model_class: Type["FHIRAbstractModel"], data: Dict[str, Any]):
+        """ """
+        super(LazyFhirModelProxy, self).__init__()
+        object.__setattr__(self, "_model_class", model_class)
+        object.__setattr__(self, "_data", data)
+
+    def __getattr__(self, attr):
+        if self.obj is None:
+            self.initialize(self._model_class.parse_obj(self._data))
+        return getattr(self.obj, attr)
+
+
 class BundleWrapper:
     """ """
 
@@ -578,8 +650,10 @@ class BundleWrapper:
         *,
         base_url: URL = None,
         init_data: Dict[str, Any] = None,
+        as_bytes: bool = False,
     ):
         """ """
+        self.as_bytes = as_bytes
         self.fhir_version = engine.fhir_release
         self.bundle_model = lookup_fhir_class("Bundle", fhir_release=self.fhir_version)
         self.base_url: URL = base_url or BundleWrapper.calculate_fhir_base_url(url)
@@ -591,7 +665,11 @@ class BundleWrapper:
         self.data["type"] = bundle_type
         # our pagination is based main query result.
         # fixme: still issue for _has chaining
-        self.data["total"] = result.header.total
+        if result.header.total is not None:
+            self.data["total"] = result.header.total
+
+        # fullUrl of attached entries, included resources are attached once
+        self.full_urls: Set[str] = set()
 
         # attach main results
         self.attach_entry(result, "match")
@@ -600,7 +678,11 @@ class BundleWrapper:
         for _include in includes:
             self.attach_entry(_include, "include")
 
-        self.attach_links(url, len(result.body))
+        self.attach_outcome([result, *includes])
+
+        self.attach_links(
+            url, len(result.body), cursor=getattr(result.header, "next_cursor", None)
+        )
 
     @classmethod
     def fhir_rest_server_path_pattern(cls):
@@ -683,9 +765,13 @@ class BundleWrapper:
                 raise NotImplementedError(
                     f"EngineRowResult must be a dict or FHIRAbstractModel, got: {resource}"
                 )
+            full_url = "{0}/{1}".format(resource_type, resource_id)
+            if mode == "include" and full_url in self.full_urls:
+                continue
+            self.full_urls.add(full_url)
             # entry = BundleEntry
             entry = dict()
-            entry["fullUrl"] = "{0}/{1}".format(resource_type, resource_id)
+            entry["fullUrl"] = full_url
             entry["resource"] = resource
             # search = BundleEntrySearch
             search = {"mode": mode}
@@ -693,17 +779,95 @@ class BundleWrapper:
 
             self.data["entry"].append(entry)
 
-    def attach_links(self, url, entries_count):
+    def attach_outcome(self, results):
+        """Warns about incomplete search by OperationOutcome entry,
+        any result was stopped by time budget or by max number of documents.
+        Execution time of each search parameter is informed, if main result
+        is profiled."""
+        timed_out = any(getattr(r.header, "timed_out", False) for r in results)
+        terminated_early = any(
+            getattr(r.header, "terminated_early", False) for r in results
+        )
+        issues = list()
+        if timed_out:
+            issues.append(
+                {
+                    "severity": "warning",
+                    "code": "incomplete",
+                    "diagnostics": "Search has exceeded its time budget, "
+                    "result is partial.",
+                }
+            )
+        if terminated_early:
+            issues.append(
+                {
+                    "severity": "warning",
+                    "code": "incomplete",
+                    "diagnostics": "Search has reached max number of documents, "
+                    "result is partial.",
+                }
+            )
+        for entry in getattr(results[0].header, "profile", None) or []:
+            if entry["index"] is None:
+                label = "Other clauses"
+            else:
+                label = "Search parameter '{0}' ({1})".format(
+                    entry.get("param"), ", ".join(entry["paths"])
+                )
+            issues.append(
+                {
+                    "severity": "information",
+                    "code": "informational",
+                    "diagnostics": "{0}: {1:.3f} ms".format(
+                        label, entry["time_in_nanos"] / 1000000
+                    ),
+                }
+            )
+        if len(issues) == 0:
+            return
+        if "entry" not in self.data:
+            self.data["entry"] = list()
+        self.data["entry"].append(
+            {
+                "resource": {"resourceType": "OperationOutcome", "issue": issues},
+                "search": {"mode": "outcome"},
+            }
+        )
+
+    def attach_links(self, url, entries_count, cursor=None):
         """ """
         container = list()
 
         _max_count = int(url.query.get("_count", 100))
-        _total_results = self.data["total"]
+        _total_results = self.data.get("total")
         _current_offset = int(url.query.get("search-offset", 0))
         url_params = {}
 
         container.append(self.make_link("self", url))
 
+        if cursor is not None or "_cursor" in url.query:
+            # cursor based pagination, only next page could be linked
+            if cursor is not None:
+                url_params["_cursor"] = cursor
+                container.append(self.make_link("next", url, url_params))
+            self.data["link"] = container
+            return
+
+        if _total_results is None:
+            # total is unknown (_total=none), full page might have next page
+            url_params["_count"] = _max_count
+            url_params["search-id"] = self.data["id"]
+            if _current_offset > 0:
+                url_params["search-offset"] = 0
+                container.append(self.make_link("first", url, url_params))
+                url_params["search-offset"] = max(_current_offset - _max_count, 0)
+                container.append(self.make_link("previous", url, url_params))
+            if entries_count >= _max_count:
+                url_params["search-offset"] = _current_offset + _max_count
+                container.append(self.make_link("next", url, url_params))
+            self.data["link"] = container
+            return
+
         # let's pagination here
         if _total_results > _max_count:
             # Yes pagination is required!
@@ -753,8 +917,15 @@ class BundleWrapper:
 
         return link
 
-    def __call__(self, as_json=False):
+    def __call__(self, as_json=False, as_bytes=None):
         """ """
+        if as_bytes is None:
+            as_bytes = self.as_bytes
+        if as_bytes:
+            # serialized by single pass, without building pydantic.BaseModel
+            data = self.data.copy()
+            data["resourceType"] = self.bundle_model.get_resource_type()
+            return json_dumps(data, return_bytes=True)
         if as_json:
             # if as_json is True, return the bundle as python dict
             # instead of building a pydantic.BaseModel
@@ -798,3 +969,24 @@ def timestamp_utc() -> datetime.datetime:
 def timestamp_local() -> datetime.datetime:
     """Timezone aware datetime with local timezone offset"""
     return datetime.datetime.now(tz=get_local_timezone())
+
+
+def encode_cursor(search_after: List[Any], point_in_time: Optional[str] = None) -> str:
+    """Opaque (url safe) cursor token for cursor based pagination"""
+    payload: Dict[str, Any] = {"sa": search_after}
+    if point_in_time is not None:
+        payload["pit"] = point_in_time
+    token = base64.urlsafe_b64encode(json_dumps(payload, return_bytes=True))
+    return token.decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str) -> Tuple[List[Any], Optional[str]]:
+    """Returns (search_after, point_in_time) from cursor token"""
+    try:
+        payload = json_loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        search_after = payload["sa"]
+        if not isinstance(search_after, list):
+            raise TypeError
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise ValidationError(f"Invalid cursor {token} has been supplied!")
+    return search_after, payload.get("pit", None)
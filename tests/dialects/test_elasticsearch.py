@@ -1,6 +1,16 @@
 #!/usr/bin/env python
 # _*_ coding: utf-8 _*_
 """Tests for `fhirpath` package."""
+from fhirpath import Q_
+from fhirpath.dialects import elasticsearch
+from fhirpath.dialects.elasticsearch import ESTIMATE_TOTAL_HITS
+from fhirpath.dialects.elasticsearch import ElasticSearchDialect
+from fhirpath.engine.es.mapping import contains_analysis_settings
+from fhirpath.engine.es.mapping import fhir_types_mapping
+from fhirpath.engine.es.mapping import reverse_analysis_settings
+from fhirpath.fql import T_
+from fhirpath.fql import ids_
+from fhirpath.fql.types import LimitClause
 from fhirpath.search import Search
 from fhirpath.search import SearchContext
 
@@ -93,3 +103,299 @@ async def test_dialect_generated_raw_query(es_data, engine):
     search_params = search_context.engine.connection.finalize_search_params(compiled)
     result = conn.search(index=index_name, **search_params)
     assert len(result["hits"]["hits"]) == 1
+
+
+def test_apply_track_total_hits():
+    """ """
+    limit_clause = LimitClause()
+    body_structure = ElasticSearchDialect.create_structure()
+    ElasticSearchDialect.apply_track_total_hits(limit_clause, body_structure)
+    assert "track_total_hits" not in body_structure
+
+    expected = {"none": False, "estimate": ESTIMATE_TOTAL_HITS, "accurate": True}
+    for mode, track_total_hits in expected.items():
+        limit_clause.total = mode
+        ElasticSearchDialect.apply_track_total_hits(limit_clause, body_structure)
+        assert body_structure["track_total_hits"] is track_total_hits
+
+
+def test_merge_nested_clauses():
+    """ """
+    name_family = ElasticSearchDialect.apply_nested(
+        {"match": {"Patient.name.family": "doe"}}, "Patient.name"
+    )
+    name_given = ElasticSearchDialect.apply_nested(
+        {"terms": {"Patient.name.given": ["john"]}}, "Patient.name"
+    )
+    telecom = ElasticSearchDialect.apply_nested(
+        {"match": {"Patient.telecom.value": "123"}}, "Patient.telecom"
+    )
+    active = {"match": {"Patient.active": True}}
+
+    merged = ElasticSearchDialect.merge_nested_clauses(
+        [name_family, telecom, active, name_given]
+    )
+    assert merged[1:] == [telecom, active]
+    assert merged[0]["nested"]["path"] == "Patient.name"
+    assert merged[0]["nested"]["query"]["bool"]["should"] == [
+        name_family["nested"]["query"],
+        name_given["nested"]["query"],
+    ]
+    # single nested query is kept as it is
+    assert ElasticSearchDialect.merge_nested_clauses([name_family]) == [name_family]
+
+
+def test_create_contains_term():
+    """ """
+    map_info = {"type": "keyword", "fields": {"contains": {"type": "text"}}}
+    assert ElasticSearchDialect.create_contains_term(
+        "Patient.name.family", "oe", map_info
+    ) == {"regexp": {"Patient.name.family": {"value": ".*oe.*"}}}
+    assert ElasticSearchDialect.create_contains_term(
+        "Patient.name.family", "doe", map_info
+    ) == {"match_phrase": {"Patient.name.family.contains": "doe"}}
+    # without n-gram subfield
+    assert ElasticSearchDialect.create_contains_term(
+        "Patient.name.family", "doe", {"type": "keyword"}
+    ) == {"regexp": {"Patient.name.family": {"value": ".*doe.*"}}}
+    # each value is looked up on its own
+    assert ElasticSearchDialect.create_contains_term(
+        "Patient.name.family", ["doe", "mi"], map_info
+    ) == {
+        "bool": {
+            "should": [
+                {"match_phrase": {"Patient.name.family.contains": "doe"}},
+                {"regexp": {"Patient.name.family": {"value": ".*mi.*"}}},
+            ],
+            "minimum_should_match": 1,
+        }
+    }
+
+
+def test_contains_mapping():
+    """ """
+    mappings = fhir_types_mapping("R4", contains_analyzer="fhir_contains_analyzer")
+    assert mappings["HumanName"]["properties"]["family"]["fields"]["contains"] == {
+        "type": "text",
+        "analyzer": "fhir_contains_analyzer",
+    }
+    assert "contains" not in mappings["HumanName"]["properties"]["use"]["fields"]
+    assert "contains" not in fhir_types_mapping("R4")["string"]["fields"]
+
+    settings = contains_analysis_settings()
+    tokenizer = settings["analyzer"]["fhir_contains_analyzer"]["tokenizer"]
+    assert settings["tokenizer"][tokenizer]["type"] == "ngram"
+
+
+def test_create_eb_term():
+    """ """
+    map_info = {"type": "keyword", "fields": {"reverse": {"type": "text"}}}
+    assert ElasticSearchDialect.create_eb_term(
+        "Patient.name.family", "Doe", map_info
+    ) == {"prefix": {"Patient.name.family.reverse": "eoD"}}
+    # without reversed subfield
+    assert ElasticSearchDialect.create_eb_term(
+        "Patient.name.family", "Doe", {"type": "keyword"}
+    ) == {"wildcard": {"Patient.name.family": {"value": "*Doe"}}}
+    assert ElasticSearchDialect.create_eb_term(
+        "Patient.name.family", ["doe", "mith"], map_info
+    )["bool"]["should"] == [
+        {"prefix": {"Patient.name.family.reverse": "eod"}},
+        {"prefix": {"Patient.name.family.reverse": "htim"}},
+    ]
+
+    mappings = fhir_types_mapping("R4", reverse_analyzer="fhir_reverse_analyzer")
+    assert mappings["string"]["fields"]["reverse"] == {
+        "type": "text",
+        "analyzer": "fhir_reverse_analyzer",
+    }
+    assert reverse_analysis_settings()["fhir_reverse_analyzer"]["filter"] == ["reverse"]
+
+
+def test_compile_merges_nested_must_not(engine):
+    """ """
+    search_context = SearchContext(engine, "Patient")
+    params = (("family:not", "doe"), ("given:not", "john"))
+    query = Search(context=search_context, params=params).build()._query
+    compiled = engine.dialect.compile(
+        query,
+        calculate_field_index_name=engine.calculate_field_index_name,
+        get_mapping=engine.get_mapping,
+    )
+    must_not = compiled["query"]["bool"]["must_not"]
+    assert len(must_not) == 1
+    assert len(must_not[0]["nested"]["query"]["bool"]["should"]) == 2
+
+
+def test_compile_keeps_nested_filter(engine):
+    """ """
+    search_context = SearchContext(engine, "Observation")
+    # both codes are required, those might be in different coding elements
+    params = (("code", "http://loinc.org|718-7"), ("code", "http://loinc.org|789-8"))
+    query = Search(context=search_context, params=params).build()._query
+    compiled = engine.dialect.compile(
+        query,
+        calculate_field_index_name=engine.calculate_field_index_name,
+        get_mapping=engine.get_mapping,
+    )
+    nested = [
+        clause["nested"]
+        for clause in compiled["query"]["bool"]["filter"]
+        if "nested" in clause
+    ]
+    assert [item["path"] for item in nested] == [
+        "observation_resource.code.coding",
+        "observation_resource.code.coding",
+    ]
+    assert "718-7" in str(nested[0]["query"])
+    assert "789-8" in str(nested[1]["query"])
+
+
+def test_apply_source_filter(engine):
+    """ """
+    search_context = SearchContext(engine, "Patient")
+    params = (("_elements", "gender"),)
+    query = Search(context=search_context, params=params).build()._query
+    compiled = engine.dialect.compile(
+        query,
+        calculate_field_index_name=engine.calculate_field_index_name,
+        get_mapping=engine.get_mapping,
+    )
+    # resources are identified by resourceType and id, whatever is selected
+    assert compiled["_source"]["includes"][:2] == [
+        "patient_resource.resourceType",
+        "patient_resource.id",
+    ]
+    assert "patient_resource.gender" in compiled["_source"]["includes"]
+
+
+def test_compile_cache(engine):
+    """ """
+    dialect = ElasticSearchDialect()
+
+    def compile_(params):
+        search_context = SearchContext(engine, "Patient")
+        query = Search(search_context, params=params).build()._query
+        compiled = dialect.compile(
+            query,
+            calculate_field_index_name=engine.calculate_field_index_name,
+            get_mapping=engine.get_mapping,
+        )
+        expected = dialect.compile_without_cache(
+            query,
+            calculate_field_index_name=engine.calculate_field_index_name,
+            get_mapping=engine.get_mapping,
+        )
+        assert compiled == expected
+        return compiled
+
+    compile_((("gender", "male"), ("name", "Saint"), ("_count", "10")))
+    assert (dialect.compile_cache.hits, dialect.compile_cache.misses) == (0, 1)
+
+    # same structure, other literal values
+    compiled = compile_((("gender", "female"), ("name", "Eelector"), ("_count", "10")))
+    assert (dialect.compile_cache.hits, dialect.compile_cache.misses) == (1, 1)
+    assert "Eelector" in str(compiled["query"])
+    assert "Saint" not in str(compiled["query"])
+
+    # limit is part of the structure
+    compile_((("gender", "female"), ("name", "Eelector"), ("_count", "20")))
+    assert (dialect.compile_cache.hits, dialect.compile_cache.misses) == (1, 2)
+
+    # date values are formatted, not spliced
+    compile_((("birthdate", "ge2010-01-01"),))
+    compile_((("birthdate", "ge2011-01-01"),))
+    assert (dialect.compile_cache.hits, dialect.compile_cache.misses) == (1, 4)
+
+    dialect = ElasticSearchDialect(cache_size=1)
+    compile_((("gender", "male"),))
+    compile_((("name", "Saint"),))
+    compile_((("gender", "female"),))
+    assert (dialect.compile_cache.hits, dialect.compile_cache.misses) == (0, 3)
+    assert len(dialect.compile_cache) == 1
+
+
+def test_compile_cache_slots(engine):
+    """ """
+    dialect = ElasticSearchDialect()
+
+    def compile_(value, search_after=None, point_in_time=None):
+        builder = Q_("Patient", engine).where(
+            T_("Patient.multipleBirthInteger") == value
+        )
+        builder = builder.where(T_("Patient.gender") == "male")
+        builder = builder.limit(10).sort("Patient.birthDate")
+        if search_after is not None:
+            builder = builder.cursor(search_after, point_in_time)
+        query = builder()._query
+        compiled = dialect.compile(
+            query,
+            calculate_field_index_name=engine.calculate_field_index_name,
+            get_mapping=engine.get_mapping,
+        )
+        assert compiled == dialect.compile_without_cache(
+            query,
+            calculate_field_index_name=engine.calculate_field_index_name,
+            get_mapping=engine.get_mapping,
+        )
+        return compiled
+
+    # interpreter shares small integers objects, those are not located by
+    # identity but kept in the structure.
+    compile_(1)
+    compile_(2)
+    assert (dialect.compile_cache.hits, dialect.compile_cache.misses) == (0, 2)
+    compile_(1000)
+    compile_(2000)
+    assert (dialect.compile_cache.hits, dialect.compile_cache.misses) == (1, 3)
+
+    # cursor values are bound into the cached template
+    compile_(1000, ["a", "p1"], "pit1")
+    compiled = compile_(1000, ["b", "p2"], "pit2")
+    assert (dialect.compile_cache.hits, dialect.compile_cache.misses) == (2, 4)
+    assert compiled["search_after"] == ["b", "p2"]
+    assert compiled["pit"]["id"] == "pit2"
+
+
+def test_resolve_ids_term(engine, monkeypatch):
+    """ """
+    dialect = ElasticSearchDialect()
+    ids = ["p1", "p2", "p3"]
+    query = Q_("Patient", engine).where(ids_("Patient.id", ids))()._query
+    compiled = dialect.compile(
+        query,
+        calculate_field_index_name=engine.calculate_field_index_name,
+        get_mapping=engine.get_mapping,
+    )
+    assert compiled["query"]["bool"]["filter"][0] == {
+        "terms": {"patient_resource.id": ids}
+    }
+    assert (dialect.compile_cache.hits, dialect.compile_cache.misses) == (0, 1)
+
+    # same structure, other ids are spliced into cached template
+    other = Q_("Patient", engine).where(ids_("Patient.id", ["p4", "p5"]))()._query
+    compiled = dialect.compile(
+        other,
+        calculate_field_index_name=engine.calculate_field_index_name,
+        get_mapping=engine.get_mapping,
+    )
+    assert compiled["query"]["bool"]["filter"][0] == {
+        "terms": {"patient_resource.id": ["p4", "p5"]}
+    }
+    assert (dialect.compile_cache.hits, dialect.compile_cache.misses) == (1, 1)
+
+    monkeypatch.setattr(elasticsearch, "MAX_TERMS_COUNT", 2)
+    compiled = dialect.compile_without_cache(
+        query,
+        calculate_field_index_name=engine.calculate_field_index_name,
+        get_mapping=engine.get_mapping,
+    )
+    assert compiled["query"]["bool"]["filter"][0] == {
+        "bool": {
+            "should": [
+                {"terms": {"patient_resource.id": ["p1", "p2"]}},
+                {"terms": {"patient_resource.id": ["p3"]}},
+            ],
+            "minimum_should_match": 1,
+        }
+    }
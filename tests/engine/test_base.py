@@ -0,0 +1,144 @@
+# _*_ coding: utf-8 _*_
+import datetime
+import math
+
+from fhirpath.engine.base import ColumnarEngineResultBody
+from fhirpath.engine.base import Engine
+from fhirpath.engine.base import EngineResult
+from fhirpath.engine.base import EngineResultBody
+from fhirpath.engine.base import EngineResultColumn
+from fhirpath.engine.base import EngineResultHeader
+from fhirpath.engine.base import EngineResultRow
+from fhirpath.engine.base import compile_reference_extractor
+
+
+__author__ = "Md Nazrul Islam <email2nazrul@gmail.com>"
+
+
+def test_engine_result_column():
+    """ """
+    column = EngineResultColumn("Observation.valueInteger", "integer")
+    column.append(1)
+    column.append(2)
+    assert column.values.typecode == "q"
+    # None is not possible for integer, becomes decimal
+    column.append(None)
+    assert column.kind == "decimal"
+    assert list(column) == [1.0, 2.0, None]
+    assert math.isnan(column.values[2])
+
+    column = EngineResultColumn("Observation.effectiveDateTime", "datetime")
+    column.append("2020-01-01T02:00:00+02:00")
+    column.append("2021")
+    column.append(None)
+    assert column.values.typecode == "q"
+    assert column[0] == datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    assert column[1].year == 2021
+    assert column[2] is None
+    # not parsable, falls back to object
+    column.append("unknown")
+    assert column.kind is None
+    assert column[0] == datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    assert column[3] == "unknown"
+
+
+def test_columnar_engine_result_body():
+    """ """
+    body = ColumnarEngineResultBody(
+        [
+            EngineResultColumn("Observation.valueQuantity.value", "decimal"),
+            EngineResultColumn("Observation.status"),
+        ]
+    )
+    body.add([5.4, "final"])
+    body.add([None, "amended"])
+
+    assert len(body) == 2
+    assert body[1] == [None, "amended"]
+    assert body.column("Observation.status").values == ["final", "amended"]
+    assert body.names == ["Observation.valueQuantity.value", "Observation.status"]
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        assert body.to_records() == [(5.4, "final"), (None, "amended")]
+        return
+
+    arrays = body.to_numpy()
+    assert arrays["Observation.valueQuantity.value"].dtype.name == "float64"
+    assert len(body.to_records()) == 2
+
+
+def test_compile_reference_extractor():
+    """ """
+    extractor = compile_reference_extractor(
+        "Observation.subject.where(resolve() is Patient)"
+    )
+    assert compile_reference_extractor(
+        "Observation.subject.where(resolve() is Patient)"
+    ) is extractor
+    observation = {
+        "resourceType": "Observation",
+        "subject": {"reference": "http://example.org/fhir/Patient/p1/_history/2"},
+    }
+    assert list(extractor(observation)) == [("Patient", "p1")]
+    assert list(extractor({"subject": {"reference": "Group/g1"}})) == []
+
+    extractor = compile_reference_extractor("Encounter.participant.individual")
+    encounter = {
+        "resourceType": "Encounter",
+        "participant": [
+            {"individual": {"reference": "Practitioner/pr1"}},
+            {"individual": {"reference": "urn:uuid:pr2", "type": "Practitioner"}},
+            {"individual": {"reference": "#contained"}},
+            {"individual": {"display": "No reference"}},
+            {"type": []},
+        ],
+    }
+    assert list(extractor(encounter)) == [
+        ("Practitioner", "pr1"),
+        ("Practitioner", "pr2"),
+    ]
+
+
+class SinglePageEngine(Engine):
+    """ """
+
+    def __init__(self, result):
+        """ """
+        self.result = result
+
+    def execute(self, query, unrestricted=False):
+        """ """
+        return self.result
+
+
+class AsyncSinglePageEngine(SinglePageEngine):
+    """ """
+
+    @classmethod
+    def is_async(cls):
+        return True
+
+    async def execute(self, query, unrestricted=False):
+        """ """
+        return self.result
+
+
+def _create_result():
+    """ """
+    body = EngineResultBody()
+    body.append(EngineResultRow(["row"]))
+    return EngineResult(header=EngineResultHeader(total=1), body=body)
+
+
+def test_engine_execute_iter_fallback():
+    """ """
+    result = _create_result()
+    assert list(SinglePageEngine(result).execute_iter(None)) == [result]
+
+
+async def test_async_engine_execute_iter_fallback():
+    """ """
+    result = _create_result()
+    pages = [page async for page in AsyncSinglePageEngine(result).execute_iter(None)]
+    assert pages == [result]
@@ -1,5 +1,9 @@
 # _*_ coding: utf-8 _*_
 from fhirpath.engine.base import EngineResultBody
+from fhirpath.engine.es import compile_field_pattern
+from fhirpath.engine.es import compile_path_segment
+from fhirpath.engine.es import compile_source_filter
+from fhirpath.exceptions import ValidationError
 import pytest
 
 from .dataset import DATASET_1
@@ -45,6 +49,45 @@ def test_hit_extraction_with_index(engine):
     assert result[0][1] is None
 
 
+def test_compile_source_filter():
+    """ """
+    fullpath = "organization_resource.address.Skip(0).Take(0).line[0]"
+    accessors = compile_source_filter(fullpath)
+    assert len(accessors) == 5
+    # compiled once
+    assert compile_source_filter(fullpath) is accessors
+
+    source = DATASET_1["_source"]
+    for accessor in accessors:
+        source = accessor(source)
+    assert (
+        source == DATASET_1["_source"]["organization_resource"]["address"][1]["line"][0]
+    )
+
+    assert compile_path_segment("count()")("Burgers") == 7
+    with pytest.raises(ValidationError):
+        compile_path_segment("line")(["first", "second"])
+    with pytest.raises(ValidationError):
+        compile_path_segment("first()")({"line": []})
+
+
+def test_compile_field_pattern():
+    """ """
+    pattern = compile_field_pattern("patient_resource.name.family")
+    assert pattern.search("+patient_resource.name.family:doe")
+    assert pattern.search('patient_resource.name.family.contains:"doe"')
+    assert pattern.search("ConstantScore(patient_resource.name.family:[a TO z])")
+    assert not pattern.search("patient_resource.name.family_x:doe")
+    assert not pattern.search("patient_resource.name.family.given:doe")
+    assert not compile_field_pattern("patient_resource.name").search(
+        "patient_resource.name.family:doe"
+    )
+    # search on all resources
+    assert compile_field_pattern("*.id").search("#organization_resource.id:o1")
+    with pytest.raises(NotImplementedError):
+        compile_path_segment("line")(1)
+
+
 @pytest.mark.asyncio
 async def test_async_hit_extraction(async_engine):
     """ """
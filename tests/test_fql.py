@@ -15,6 +15,7 @@ from fhirpath.fql.expressions import and_
 from fhirpath.fql.expressions import contains_
 from fhirpath.fql.expressions import eb_
 from fhirpath.fql.expressions import exists_
+from fhirpath.fql.expressions import ids_
 from fhirpath.fql.expressions import in_
 from fhirpath.fql.expressions import not_exists_
 from fhirpath.fql.expressions import not_in_
@@ -27,6 +28,7 @@ from fhirpath.interfaces import IQuery
 from fhirpath.interfaces import IQueryResult
 from fhirpath.interfaces.fql import IExistsTerm
 from fhirpath.interfaces.fql import IGroupTerm
+from fhirpath.interfaces.fql import IIdsTerm
 from fhirpath.interfaces.fql import ITerm
 from fhirpath.query import QueryBuilder
 from fhirpath.storage import PATH_INFO_STORAGE
@@ -156,6 +158,21 @@ def test_expression_in(engine):
     assert len(term.value) == 2
 
 
+def test_expression_ids(engine):
+    """ """
+    term = ids_("Patient.id", ("p1", "p2", "p3"))
+    term.finalize(engine)
+
+    assert IIdsTerm.providedBy(term) is True
+    assert ITerm.providedBy(term) is True
+    assert term.unary_operator == OPERATOR.pos
+    assert term.get_real_value() == ["p1", "p2", "p3"]
+
+    term = -ids_("Observation.subject.reference", ["Patient/p1"])
+    term.finalize(engine)
+    assert term.unary_operator == OPERATOR.neg
+
+
 def test_expression_in_exception(engine):
     """ """
     # Test not same type value
@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from fhirpath.json import json_dumps
+from fhirpath.json import json_loads
+import pytest
+
+__author__ = "Md Nazrul Islam <email2nazrul@gmail.com>"
+
+
+def test_json_dumps_return_bytes():
+    """ """
+    data = {"resourceType": "Bundle", "entry": [{"resource": {"id": "p1"}}]}
+    value = json_dumps(data, return_bytes=True)
+    assert isinstance(value, bytes)
+    assert json_loads(value) == data
+
+
+def test_json_dumps_not_serializable():
+    """ """
+    with pytest.raises(TypeError):
+        json_dumps({"value": object()})
@@ -1,9 +1,14 @@
 # _*_ coding: utf-8 _*_
+import asyncio
+import time
+
 import pytest
 
 from fhirpath import Q_
 from fhirpath.engine import EngineResultRow
+from fhirpath.enums import MaterializationType
 from fhirpath.enums import SortOrderType
+from fhirpath.exceptions import DeadlineExceeded
 from fhirpath.exceptions import MultipleResultsFound
 from fhirpath.exceptions import ValidationError
 from fhirpath.fql import T_
@@ -14,7 +19,13 @@ from fhirpath.fql import in_
 from fhirpath.fql import not_
 from fhirpath.fql import not_in_
 from fhirpath.fql import sort_
+from fhirpath.json import json_loads
+from fhirpath.query import AsyncQueryResult
+from fhirpath.query import QueryResult
+from fhirpath.utils import construct_fhir_model
+from fhirpath.utils import lookup_fhir_class
 
+from ._utils import FHIR_EXAMPLE_RESOURCES
 from ._utils import load_organizations_data
 
 
@@ -143,6 +154,23 @@ def test_first_query(es_data, engine):
     assert result is None
 
 
+def test_single_first_total_none(es_data, engine):
+    """ """
+    conn, meta_info = es_data
+    load_organizations_data(conn, 2)
+
+    builder = Q_(resource="Organization", engine=engine).total("none")
+    assert builder().fetchall().header.total is None
+    assert isinstance(builder().first(), EngineResultRow)
+
+    with pytest.raises(MultipleResultsFound):
+        builder().single()
+
+    builder = builder.where(T_("Organization.active", "false"))
+    assert builder().first() is None
+    assert builder().single() is None
+
+
 @pytest.mark.asyncio
 async def test_async_first_query(es_data, async_engine):
     """ """
@@ -326,3 +354,235 @@ def test_query_with_non_fhir_select(es_data, engine):
 
     assert len(result.header.selects) == 2
     assert "creation_date" in result.header.selects
+
+
+def test_iter_pages(es_data, engine):
+    """ """
+    conn, meta_info = es_data
+    load_organizations_data(conn, 152)
+    builder = Q_(resource="Organization", engine=engine)
+    builder = builder.where(T_("Organization.active") == V_("true"))
+
+    pages = list(builder().iter_pages())
+    # default scroll page size is 100
+    assert len(pages) == 2
+    assert pages[0].header.total == 153
+    assert sum(len(page.body) for page in pages) == 153
+    assert len(list(builder())) == 153
+
+
+@pytest.mark.asyncio
+async def test_async_iter_pages(es_data, async_engine):
+    """ """
+    conn, meta_info = es_data
+    load_organizations_data(conn, 152)
+    builder = Q_(resource="Organization", engine=async_engine)
+    builder = builder.where(T_("Organization.active") == V_("true"))
+
+    pages = [page async for page in builder().iter_pages()]
+    assert len(pages) == 2
+    assert pages[0].header.total == 153
+    assert sum(len(page.body) for page in pages) == 153
+    assert len([resource async for resource in builder()]) == 153
+
+
+def test_sliced_scroll(es_data, engine, monkeypatch):
+    """ """
+    conn, meta_info = es_data
+    load_organizations_data(conn, 152)
+    monkeypatch.setattr(engine, "scroll_slices", 2)
+    builder = Q_(resource="Organization", engine=engine)
+    builder = builder.where(T_("Organization.active") == V_("true"))
+
+    result = builder().fetchall()
+    assert result.header.total == 153
+    assert len(result.body) == 153
+    assert len({row[0]["id"] for row in result.body}) == 153
+
+    pages = list(builder().iter_pages())
+    assert sum(len(page.body) for page in pages) == 153
+
+
+@pytest.mark.asyncio
+async def test_async_sliced_scroll(es_data, async_engine, monkeypatch):
+    """ """
+    conn, meta_info = es_data
+    load_organizations_data(conn, 152)
+    monkeypatch.setattr(async_engine, "scroll_slices", 2)
+    builder = Q_(resource="Organization", engine=async_engine)
+    builder = builder.where(T_("Organization.active") == V_("true"))
+
+    result = await builder().fetchall()
+    assert result.header.total == 153
+    assert len({row[0]["id"] for row in result.body}) == 153
+    assert len([resource async for resource in builder()]) == 153
+
+
+def test_columnar_result(es_data, engine):
+    """ """
+    conn, meta_info = es_data
+    load_organizations_data(conn, 5)
+    builder = Q_(resource="Organization", engine=engine)
+    builder = builder.select("Organization.name", "Organization.telecom.count()").where(
+        T_("Organization.active") == V_("true")
+    )
+    result = builder().columns()
+    assert result.header.total == 6
+    assert len(result.body) == 6
+    assert result.body.column("Organization.telecom.count()").kind == "integer"
+    assert result.body[0][0] == "Burgers University Medical Center"
+
+    with pytest.raises(ValidationError):
+        Q_(resource="Organization", engine=engine)().columns()
+
+
+def test_iter_materialization(es_data, engine):
+    """ """
+    builder = Q_(resource="Organization", engine=engine)
+    builder = builder.where(T_("Organization.active") == V_("true"))
+
+    resource = next(iter(builder(materialization="dict")))
+    assert isinstance(resource, dict)
+    assert resource["resourceType"] == "Organization"
+
+    validated = next(iter(builder()))
+    constructed = next(iter(builder(materialization=MaterializationType.CONSTRUCT)))
+    assert isinstance(constructed, validated.__class__)
+    assert constructed.id == validated.id
+    assert constructed.address[0].city == validated.address[0].city
+
+    lazy = next(iter(builder(materialization="lazy")))
+    assert lazy.obj is None
+    assert lazy.id == validated.id
+    assert lazy.obj == validated
+
+
+def test_construct_fhir_model():
+    """ """
+    with open(str(FHIR_EXAMPLE_RESOURCES / "Patient.json"), "r") as fp:
+        data = json_loads(fp.read())
+    data["contained"] = [{"resourceType": "Organization", "id": "o1", "name": "Org"}]
+
+    patient = construct_fhir_model(lookup_fhir_class("Patient"), data)
+    assert patient.id == data["id"]
+    assert patient.name[0].family == data["name"][0]["family"]
+    assert patient.contained[0].resource_type == "Organization"
+    assert patient.contained[0].name == "Org"
+
+
+def test_fetchall_many(es_data, engine):
+    """ """
+    conn, meta_info = es_data
+    load_organizations_data(conn, 5)
+    builder = Q_(resource="Organization", engine=engine).where(
+        T_("Organization.active") == V_("true")
+    )
+    results = QueryResult.fetchall_many(
+        [builder.limit(2)(), builder(), Q_(resource="Patient", engine=engine)()]
+    )
+    assert len(results[0].body) == 2
+    assert results[0].header.total == 6
+    # unlimited query is not batched
+    assert len(results[1].body) == 6
+    assert results[2].body[0][0]["resourceType"] == "Patient"
+
+
+@pytest.mark.asyncio
+async def test_async_fetchall_many(es_data, async_engine):
+    """ """
+    conn, meta_info = es_data
+    load_organizations_data(conn, 5)
+    builder = Q_(resource="Organization", engine=async_engine).where(
+        T_("Organization.active") == V_("true")
+    )
+    results = await AsyncQueryResult.fetchall_many(
+        [builder.limit(2)(), builder(), Q_(resource="Patient", engine=async_engine)()]
+    )
+    assert len(results[0].body) == 2
+    assert results[0].header.total == 6
+    assert len(results[1].body) == 6
+    assert results[2].body[0][0]["resourceType"] == "Patient"
+
+
+def test_query_deadline(es_data, engine, monkeypatch):
+    """ """
+    conn, meta_info = es_data
+    load_organizations_data(conn, 152)
+    monkeypatch.setattr(engine, "terminate_after", 1000)
+    builder = Q_(resource="Organization", engine=engine)
+    builder = builder.where(T_("Organization.active") == V_("true"))
+
+    result = builder.deadline(time.monotonic() + 30)().fetchall()
+    assert len(result.body) == 153
+    assert result.header.timed_out is False
+    assert result.header.terminated_early is False
+    assert result.header.raw_query["body"]["timeout"].endswith("ms")
+    assert result.header.raw_query["body"]["terminate_after"] == 1000
+
+    with pytest.raises(DeadlineExceeded):
+        builder.deadline(time.monotonic() - 1)().fetchall()
+
+    # time budget is spent before scrolling, result is partial
+    fetch = engine.connection.fetch
+
+    def slow_fetch(*args, **kwargs):
+        raw_result = fetch(*args, **kwargs)
+        time.sleep(0.2)
+        return raw_result
+
+    monkeypatch.setattr(engine.connection, "fetch", slow_fetch)
+    result = builder.deadline(time.monotonic() + 0.1)().fetchall()
+    assert result.header.timed_out is True
+    assert len(result.body) == 100
+
+
+def test_query_profile(es_data, engine):
+    """ """
+    conn, meta_info = es_data
+    load_organizations_data(conn, 5)
+    builder = Q_(resource="Organization", engine=engine)
+    builder = builder.where(T_("Organization.active") == V_("true"))
+
+    result = builder().fetchall()
+    assert result.header.profile is None
+    assert "profile" not in result.header.raw_query["body"]
+
+    result = builder.profile()().fetchall()
+    assert result.header.raw_query["body"]["profile"] is True
+    term_profile, other_profile = result.header.profile
+    assert term_profile["index"] == 0
+    assert term_profile["paths"] == ["Organization.active"]
+    assert term_profile["time_in_nanos"] > 0
+    # resource type constraint
+    assert other_profile["index"] is None
+    assert other_profile["time_in_nanos"] > 0
+
+    # count API cannot be profiled
+    assert builder.profile()().count() == len(result.body)
+
+
+@pytest.mark.asyncio
+async def test_async_cancel_clears_scroll(es_data, async_engine, monkeypatch):
+    """ """
+    conn, meta_info = es_data
+    load_organizations_data(conn, 152)
+    cleared = list()
+    clear_scroll = async_engine.connection.clear_scroll
+
+    async def slow_scroll(*args, **kwargs):
+        await asyncio.sleep(10)
+
+    async def tracked_clear_scroll(scroll_id):
+        cleared.append(scroll_id)
+        await clear_scroll(scroll_id)
+
+    monkeypatch.setattr(async_engine.connection, "scroll", slow_scroll)
+    monkeypatch.setattr(async_engine.connection, "clear_scroll", tracked_clear_scroll)
+    builder = Q_(resource="Organization", engine=async_engine)
+
+    task = asyncio.ensure_future(builder().fetchall())
+    await asyncio.sleep(0.5)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert len(cleared) == 1
@@ -9,16 +9,24 @@ from fhirpath.enums import OPERATOR
 from fhirpath.enums import MatchType
 from fhirpath.enums import SortOrderType
 from fhirpath.interfaces.fql import IGroupTerm
+from fhirpath.search import RESOURCE_TYPES_CACHE_SIZE
 from fhirpath.search import Search
 from fhirpath.search import AsyncSearch
 from fhirpath.search import SearchContext
+from fhirpath.search import SearchParameterIndex
+from fhirpath.search import fhir_search_many
 from fhirpath.exceptions import ValidationError
+from fhirpath.json import json_loads
+from fhirpath.storage import SEARCH_RESOLUTION_STORAGE
+from fhirpath.utils import encode_cursor
 
 from fhir.resources.patient import Patient
 from fhir.resources.observation import Observation
 from fhir.resources.practitioner import Practitioner
 from fhir.resources.medicationrequest import MedicationRequest
 
+from ._utils import load_organizations_data
+
 
 __author__ = "Md Nazrul Islam<email2nazrul@gmail.com>"
 
@@ -31,6 +39,49 @@ def test_params_definition(engine):
     assert definition[0].name.expression == "Organization.name"
 
 
+def test_search_parameter_index(engine):
+    """ """
+    index = SearchParameterIndex.from_release(FHIR_VERSION.R4)
+    assert SearchParameterIndex.from_release(FHIR_VERSION.DEFAULT) is index
+
+    context = SearchContext(engine, "Patient")
+    assert context.definitions == list(index.get_definitions(("Patient",)))
+    assert index.get_definitions(("Patient",)) is index.get_definitions(("Patient",))
+
+    context.augment_with_types(["Practitioner"])
+    intersection = index.get_intersection(("Patient", "Practitioner"))
+    assert context.search_params_intersection == list(intersection)
+    assert "name" in intersection
+    assert "general-practitioner" not in intersection
+    # independent of the order of resource types
+    assert index.get_intersection(("Practitioner", "Patient")) is intersection
+    assert len(index._intersections) <= RESOURCE_TYPES_CACHE_SIZE
+
+    search_param = context.definitions[0].name
+    path_ = context.resolve_path_context(search_param)
+    assert path_ is index.get_path_context(search_param)
+    assert str(path_) == "Patient.name"
+
+
+def test_search_resolution_cache(engine):
+    """ """
+    SEARCH_RESOLUTION_STORAGE.clear()
+    context = SearchContext(engine, "Observation")
+    params = (("status", "final"), ("subject", "Patient/1"))
+    Search(context, params=params).build()
+    assert (SEARCH_RESOLUTION_STORAGE.hits, SEARCH_RESOLUTION_STORAGE.misses) == (0, 4)
+
+    # parameters are resolved once, terms are built with new values
+    params = (("status", "amended"), ("subject", "Patient/2"))
+    result = Search(context, params=params).build()
+    assert (SEARCH_RESOLUTION_STORAGE.hits, SEARCH_RESOLUTION_STORAGE.misses) == (4, 4)
+    values = {
+        str(term.path): term.get_real_value() for term in result._query.get_where()
+    }
+    assert values["Observation.status"] == "amended"
+    assert values["Observation.subject.reference"] == "Patient/2"
+
+
 def test_parse_query_string():
     """ """
     params = (
@@ -414,6 +465,34 @@ def test_limit_attachment(engine):
     assert builder._limit.offset == 300
 
 
+def test_cursor_limit_attachment(engine):
+    """ """
+    context = SearchContext(engine, "Task")
+    params = (("status", "active"), ("_count", "10"), ("_cursor", ""))
+    fhir_search = Search(context, params=params)
+    builder = Q_(context.resource_types, context.engine)
+    builder = fhir_search.attach_limit_terms(builder)
+
+    assert builder._limit.limit == 10
+    assert builder._limit.cursor is True
+    assert builder._limit.search_after == []
+
+    cursor = encode_cursor(["2010-05-28T05:35:56+00:00", "TASK001"], "pit-id")
+    params = (("status", "active"), ("_count", "10"), ("_cursor", cursor))
+    fhir_search = Search(context, params=params)
+    builder = Q_(context.resource_types, context.engine)
+    builder = fhir_search.attach_limit_terms(builder)
+
+    assert builder._limit.offset == 0
+    assert builder._limit.search_after == ["2010-05-28T05:35:56+00:00", "TASK001"]
+    assert builder._limit.point_in_time == "pit-id"
+
+    with raises(ValidationError):
+        Search(context, params=(("_cursor", "invalid"),)).attach_limit_terms(
+            Q_(context.resource_types, context.engine)
+        )
+
+
 def test_build_query_from_search_params(engine):
     """ """
     context = SearchContext(engine, "ChargeItem")
@@ -498,6 +577,45 @@ def test_search_result_as_json(es_data, engine):
     assert isinstance(bundle["entry"][0], dict)
 
 
+def test_search_result_as_bytes(es_data, engine):
+    """ """
+    search_context = SearchContext(engine, "Organization")
+    params = (("active", "true"),)
+    fhir_search = Search(search_context, params=params)
+
+    bundle = fhir_search(as_bytes=True)
+    assert isinstance(bundle, bytes)
+    bundle_data = json_loads(bundle)
+    assert bundle_data["resourceType"] == "Bundle"
+    assert bundle_data["total"] == 1
+    assert bundle_data["entry"][0]["resource"]["resourceType"] == "Organization"
+    assert bundle_data["entry"][0]["fullUrl"].startswith("Organization/")
+
+
+def test_search_total_modes(es_data, engine):
+    """ """
+    conn, meta_info = es_data
+    load_organizations_data(conn, 5)
+    search_context = SearchContext(engine, "Organization")
+
+    params = (("active", "true"), ("_total", "none"), ("_count", "2"))
+    bundle = Search(search_context, params=params)()
+    assert bundle.total is None
+    assert len(bundle.entry) == 2
+    assert [link.relation for link in bundle.link] == ["self", "next"]
+
+    params = (("active", "true"), ("_total", "estimate"))
+    bundle = Search(search_context, params=params)()
+    assert bundle.total == 6
+
+    params = (("active", "true"), ("_total", "accurate"))
+    bundle = Search(search_context, params=params)()
+    assert bundle.total == 6
+
+    with raises(ValidationError):
+        Search(search_context, params=(("_total", "exact"),))
+
+
 def test_search_missing_modifier(es_data, engine):
     """ """
     search_context = SearchContext(engine, "Organization")
@@ -871,6 +989,66 @@ def test_search_include(es_data, engine):
         fhir_search()
 
 
+def test_search_include_deduplicated(es_data, engine, monkeypatch):
+    """ """
+    monkeypatch.setattr("fhirpath.search.INCLUDE_CHUNK_SIZE", 1)
+    search_context = SearchContext(engine, "Observation")
+    params = (
+        ("_include", "Observation:subject:Patient"),
+        ("_include", "Observation:patient"),
+    )
+    fhir_search = Search(search_context, params=params)
+    bundle = fhir_search()
+    assert bundle.total == 1
+    # the patient is fetched once, by first _include
+    assert len(fhir_search.include_queries) == 1
+    assert len(bundle.entry) == 2
+    assert isinstance(bundle.entry[1].resource, Patient)
+    assert bundle.entry[1].search.mode == "include"
+
+
+def test_search_timeout(es_data, engine, monkeypatch):
+    """ """
+    search_context = SearchContext(engine, "Observation")
+    params = (("_include", "Observation:subject:Patient"),)
+    fhir_search = Search(search_context, params=params, timeout=30)
+    bundle = fhir_search()
+    assert len(bundle.entry) == 2
+    # sub-queries share the deadline of main query
+    deadline = fhir_search.main_query._query.get_limit().deadline
+    assert deadline == fhir_search.deadline
+    assert fhir_search.include_queries[0]._query.get_limit().deadline == deadline
+
+    # partial result is flagged by OperationOutcome entry
+    evaluate_result = engine.connection.evaluate_result
+
+    def timed_out(result):
+        evaluate_result(result)
+        result["timed_out"] = True
+
+    monkeypatch.setattr(engine.connection, "evaluate_result", timed_out)
+    bundle = Search(SearchContext(engine, "Observation"), timeout=30)()
+    assert bundle.entry[-1].search.mode == "outcome"
+    assert bundle.entry[-1].resource.issue[0].code == "incomplete"
+
+
+def test_search_profile(es_data, engine):
+    """ """
+    search_context = SearchContext(engine, "Patient")
+    params = (("gender", "male"), ("family:contains", "Saint"))
+    fhir_search = Search(search_context, params=params, profile=True)
+    bundle = fhir_search()
+    assert fhir_search.main_query._query.get_limit().profile is True
+    assert bundle.entry[-1].search.mode == "outcome"
+    diagnostics = [issue.diagnostics for issue in bundle.entry[-1].resource.issue]
+    assert any(d.startswith("Search parameter 'gender'") for d in diagnostics)
+    assert any(d.startswith("Search parameter 'family:contains'") for d in diagnostics)
+
+    # not profiled, no outcome
+    bundle = Search(SearchContext(engine, "Patient"), params=params)()
+    assert all(entry.search.mode == "match" for entry in bundle.entry)
+
+
 def test_search_has(es_data, engine):
     # found
     search_context = SearchContext(engine, "Patient")
@@ -940,6 +1118,86 @@ def test_search_has(es_data, engine):
         fhir_search()
 
 
+def test_search_has_references(es_data, engine, monkeypatch):
+    """ """
+    search_context = SearchContext(engine, "Observation")
+    query = Q_("Observation", engine)()
+    # distinct references are aggregated, page by page
+    monkeypatch.setattr(engine, "references_page_size", 1)
+    ref_param = search_context._get_search_param_definitions("patient")[0]
+    references = query.fetch_references(ref_param)
+    assert references == {"Patient": ["19c5245f-89a8-49f8-b244-666b32adb92e"]}
+    assert references == query.fetchall().extract_references(ref_param)
+
+    # nested path cannot be aggregated, references are extracted from resources
+    ref_param = search_context._get_search_param_definitions("performer")[0]
+    assert engine.execute_references(query._query, ref_param) is None
+    assert query.fetch_references(ref_param) == {
+        "Practitioner": ["619c1ac0-821d-46d9-9d40-a61f2578cadf"]
+    }
+    # fetched resources are bounded, references must not be truncated silently
+    load_organizations_data(es_data[0], 2)
+    monkeypatch.setattr(engine, "execute_references", lambda *args: None)
+    query = Q_("Organization", engine)()
+    ref_param = SearchContext(engine, "Organization")._get_search_param_definitions(
+        "partof"
+    )[0]
+    with raises(ValidationError, match="more than 1 Organization resources"):
+        query.fetch_references(ref_param, max_count=1)
+
+    search_context = SearchContext(engine, "Patient")
+    params = (("_has:Observation:patient:code", "718-7"),)
+    bundle = Search(search_context, params=params)()
+    assert bundle.total == 1
+
+
+def test_search_chaining(es_data, engine):
+    """ """
+    search_context = SearchContext(engine, "Observation")
+    params = (("subject:Patient.family", "Saint"),)
+    bundle = Search(search_context, params=params)()
+    assert bundle.total == 1
+    assert isinstance(bundle.entry[0].resource, Observation)
+
+    # target resource type is resolved from the search parameter
+    chaining_cache = dict()
+    search_context = SearchContext(engine, "Observation")
+    params = (("subject.family", "Saint"), ("status", "final"))
+    fhir_search = Search(search_context, params=params, chaining_cache=chaining_cache)
+    bundle = fhir_search()
+    assert bundle.total == 1
+    assert fhir_search.chaining_results == [
+        ("subject", ["Patient/19c5245f-89a8-49f8-b244-666b32adb92e"])
+    ]
+    assert list(chaining_cache.values()) == [["19c5245f-89a8-49f8-b244-666b32adb92e"]]
+
+    # not found
+    search_context = SearchContext(engine, "Observation")
+    params = (("subject:Patient.family", "XXX"),)
+    bundle = Search(search_context, params=params)()
+    assert bundle.total == 0
+
+    # bad searchparam
+    search_context = SearchContext(engine, "Observation")
+    params = (("code.name", "something"),)
+    with raises(
+        ValidationError,
+        match=re.escape(
+            "chained search parameter code must be of type 'reference', got token"
+        ),
+    ):
+        Search(search_context, params=params)()
+
+
+@pytest.mark.asyncio
+async def test_async_search_chaining(es_data, async_engine):
+    """ """
+    search_context = SearchContext(async_engine, "Observation")
+    params = (("subject:Patient.family", "Saint"),)
+    bundle = await AsyncSearch(search_context, params=params)()
+    assert bundle.total == 1
+
+
 def test_search_revinclude(es_data, engine):
     # untyped
     search_context = SearchContext(engine, "Patient")
@@ -1062,6 +1320,101 @@ def test_search_revinclude(es_data, engine):
         fhir_search()
 
 
+def test_search_fetch_all(es_data, engine):
+    """ """
+    fhir_search = Search(SearchContext(engine, "Patient"))
+    resource_types = ["Organization", "Patient", "Observation", "Practitioner"]
+    queries = [
+        Q_(resource=resource_type, engine=engine).limit(1)()
+        for resource_type in resource_types
+    ]
+    results = fhir_search.fetch_all(queries)
+    assert [result.body[0][0]["resourceType"] for result in results] == resource_types
+
+
+@pytest.mark.asyncio
+async def test_async_search_fetch_all(es_data, async_engine):
+    """ """
+    fhir_search = AsyncSearch(SearchContext(async_engine, "Patient"))
+    resource_types = ["Organization", "Patient", "Observation", "Practitioner"]
+    queries = [
+        Q_(resource=resource_type, engine=async_engine).limit(1)()
+        for resource_type in resource_types
+    ]
+    results = await fhir_search.fetch_all(queries)
+    assert [result.body[0][0]["resourceType"] for result in results] == resource_types
+
+
+def test_fhir_search_many(es_data, engine):
+    """ """
+    contexts = []
+
+    def context_factory(resource_type):
+        contexts.append(resource_type)
+        return SearchContext(engine, resource_type)
+
+    bundles = fhir_search_many(
+        context_factory,
+        [
+            "Patient?_revinclude=Observation:subject",
+            "Organization?_count=1",
+            "Patient?_revinclude=Observation:subject",
+            "Observation?_summary=count",
+        ],
+    )
+    # context is shared by searches of the same resource type
+    assert contexts == ["Patient", "Organization", "Observation"]
+    assert len(bundles) == 4
+    assert len(bundles[0].entry) == 2
+    assert bundles[0].entry[1].search.mode == "include"
+    assert bundles[1].entry[0].resource.resource_type == "Organization"
+    # identical searches are executed once
+    assert bundles[2] is bundles[0]
+    assert bundles[3].total == 1
+
+    with raises(ValidationError):
+        fhir_search_many(context_factory, ["?_count=1"])
+
+
+def test_fhir_search_many_empty():
+    """ """
+    contexts = list()
+    with raises(ValidationError):
+        fhir_search_many(contexts.append, [])
+    assert len(contexts) == 0
+
+
+def test_search_split_includes():
+    """ """
+    first, second, third = object(), object(), object()
+    # results of include queries of all searches, in order of queries
+    all_includes = Search.split_includes(
+        {first: ["q1", "q2"], second: [], third: ["q3"]}, ["r1", "r2", "r3"]
+    )
+    assert all_includes == {first: ["r1", "r2"], second: [], third: ["r3"]}
+
+
+def test_fhir_search_many_mixed_engines(engine, async_engine):
+    """ """
+    engines = {"Patient": engine, "Organization": async_engine}
+    with raises(ValidationError, match="either sync or async"):
+        fhir_search_many(
+            lambda resource_type: SearchContext(engines[resource_type], resource_type),
+            ["Patient?_count=1", "Organization?_count=1"],
+        )
+
+
+@pytest.mark.asyncio
+async def test_async_fhir_search_many(es_data, async_engine):
+    """ """
+    bundles = await fhir_search_many(
+        lambda resource_type: SearchContext(async_engine, resource_type),
+        ["Organization?_count=1", "Patient?_revinclude=Observation:subject"],
+    )
+    assert bundles[0].entry[0].resource.resource_type == "Organization"
+    assert len(bundles[1].entry) == 2
+
+
 @pytest.mark.asyncio
 async def test_async_search_revinclude(es_data, async_engine):
     # untyped
@@ -1571,6 +1924,25 @@ def test_searchparam_summary_text(es_data, engine):
     assert result.entry[0].resource.birthDate is None  # birthDate is not mandatory
 
 
+def test_summary_elements_cache(engine):
+    """ """
+    elements = Search.get_summary_elements("Patient", "text", engine.fhir_release)
+    assert "Patient.link" in elements
+    assert "Patient.birthDate" not in elements
+    assert (
+        Search.get_summary_elements("Patient", "text", engine.fhir_release) is elements
+    )
+
+    elements = Search.get_summary_elements("Patient", "true", engine.fhir_release)
+    assert "Patient.birthDate" in elements
+    assert "Patient.deceasedBoolean" in elements
+
+    search_context = SearchContext(engine, "Patient")
+    query = Search(search_context, params=(("_summary", "true"),)).build()
+    paths = [str(el) for el in query._query.get_element()]
+    assert paths == ["Patient.id", "Patient.meta"] + list(elements)
+
+
 def test_searchparam_summary_data(es_data, engine):
     """Handle _summary=data
     Remove the text element
@@ -1630,3 +2002,18 @@ def test_search_patient_with_name(es_data, engine):
     fhir_search = Search(search_context, params=params)
     bundle = fhir_search()
     assert bundle.total == 1
+
+
+def test_search_cursor_pagination(es_data, engine):
+    """ """
+    conn, meta_info = es_data
+    load_organizations_data(conn, 2)
+    search_context = SearchContext(engine, "Organization")
+    params = (("_count", "1"), ("_sort", "_lastUpdated"), ("_cursor", ""))
+    bundle = Search(search_context, params=params)()
+
+    assert bundle.total == 3
+    assert len(bundle.entry) == 1
+    next_link = [link for link in bundle.link if link.relation == "next"][0]
+    assert "_cursor=" in next_link.url
+    assert "search-offset" not in next_link.url
@@ -16,3 +16,20 @@ def test_fhir_releases_exists():
         assert rel.name in storage.FHIR_RESOURCE_SPEC_STORAGE
         assert rel.name in storage.PATH_INFO_STORAGE
         assert rel.name in storage.SEARCH_PARAMETERS_STORAGE
+
+
+def test_lru_storage():
+    """ """
+    lru = storage.LRUStorage(maxsize=2)
+    lru.insert("a", 1)
+    lru["b"] = 2
+    assert lru.get("a") == 1
+    # least recently used item is evicted
+    lru.insert("c", 3)
+    assert lru.exists("a")
+    assert "b" not in lru
+    assert lru.get("b", None) is None
+    assert lru.total() == 2
+    assert (lru.hits, lru.misses) == (1, 1)
+    lru.clear()
+    assert lru.empty()